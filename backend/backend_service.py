@@ -5,6 +5,7 @@ ORB Backend - Executável para rodar como serviço Windows
 import sys
 import os
 import logging
+import multiprocessing
 from pathlib import Path
 
 # Adicionar src ao path
@@ -105,6 +106,7 @@ def main():
         # Configurações
         host = os.getenv("HOST", "127.0.0.1")
         port = int(os.getenv("PORT", "8000"))
+        workers = int(os.getenv("ORB_WORKERS", "1"))
         
         logger.info(f" Servidor iniciando em {host}:{port}")
         
@@ -118,6 +120,13 @@ def main():
             log_config["handlers"]["default"]["stream"] = "ext://sys.__stdout__"
             log_config["handlers"]["access"]["stream"] = "ext://sys.__stdout__"
         
+        if workers > 1:
+            # Roteador com afinidade de sessão na porta pública + workers em portas internas
+            logger.info(f" Modo multi-worker: {workers} workers")
+            from api.workers import run_workers
+            run_workers(workers, host=host, port=port, log_level="info", log_config=log_config)
+            return
+        
         # Iniciar servidor
         uvicorn.run(
             app,
@@ -134,5 +143,6 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
 
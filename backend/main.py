@@ -6,6 +6,8 @@ Suporte para execução como serviço Windows ou modo desenvolvimento
 
 import sys
 import os
+import argparse
+import multiprocessing
 import uvicorn
 
 # Configura logging limpo antes de qualquer import
@@ -26,8 +28,20 @@ def is_windows_service():
     except ImportError:
         return False
 
+def parse_args():
+    """Argumentos de linha de comando"""
+    parser = argparse.ArgumentParser(description="ORB Backend - Servidor principal")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("ORB_WORKERS", "1")),
+        help="Processos worker (>1 sobe um roteador com afinidade de sessão na porta 8000)"
+    )
+    return parser.parse_args()
+
 def main():
     """Função principal"""
+    args = parse_args()
     print("ORB Backend - Assistente de IA Flutuante")
     print("=" * 50)
     
@@ -47,6 +61,14 @@ def main():
         print("WebSocket: ws://localhost:8000/ws")
         print("=" * 50)
         
+        if args.workers > 1:
+            # Vários processos: estado de sessão no SQLite (WAL), sessões
+            # roteadas por hash do session_id para manter os caches quentes
+            print(f"Workers: {args.workers}")
+            from api.workers import run_workers
+            run_workers(args.workers, host="0.0.0.0", port=8000, log_level="warning")
+            return
+        
         uvicorn.run(
             "api.main:app",
             host="0.0.0.0",
@@ -56,4 +78,5 @@ def main():
         )
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,108 @@
+"""
+Linha de comando do Agente ORB
+
+Uso:
+    python -m agentes.orb_agent batch entrada.jsonl saida.jsonl [--concurrency N]
+
+Cada linha da entrada é um JSON com "message" e, opcionalmente, "id",
+"session_id" e "image_data". Cada linha da saída é o resultado de uma
+entrada, na ordem em que termina. A saída serve de checkpoint: rodar de
+novo com o mesmo arquivo pula as entradas já concluídas sem erro.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+from typing import Dict, Any, Iterator, Set
+
+
+def _completed_ids(output_path: str) -> Set[str]:
+    """Ids concluídos sem erro em execuções anteriores"""
+    completed: Set[str] = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # Linha truncada por interrupção
+                continue
+            if not result.get('error'):
+                completed.add(str(result.get('id')))
+    return completed
+
+
+def _ends_with_newline(path: str) -> bool:
+    """Verifica se o arquivo termina em quebra de linha"""
+    with open(path, 'rb') as file:
+        file.seek(-1, os.SEEK_END)
+        return file.read(1) == b'\n'
+
+
+def _read_items(input_path: str) -> Iterator[Dict[str, Any]]:
+    """Lê as entradas sob demanda"""
+    from .batch import normalize_item
+    
+    with open(input_path, 'r', encoding='utf-8') as file:
+        for index, line in enumerate(file):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                raw = json.loads(line)
+            except ValueError:
+                raw = {'id': index, 'message': ''}
+            yield normalize_item(raw, index)
+
+
+async def run_batch(input_path: str, output_path: str, concurrency: int) -> Dict[str, int]:
+    """Executa o lote gravando cada resultado assim que termina"""
+    from .agente import AgenteORB
+    from .batch import BatchRunner
+    
+    agente = AgenteORB()
+    runner = BatchRunner(agente, concurrency)
+    skip_ids = _completed_ids(output_path)
+    
+    with open(output_path, 'a', encoding='utf-8') as output:
+        if output.tell() and not _ends_with_newline(output_path):
+            # Última linha truncada pela interrupção anterior
+            output.write('\n')
+        async for result in runner.run(_read_items(input_path), skip_ids):
+            output.write(json.dumps(result, ensure_ascii=False) + '\n')
+            output.flush()
+    
+    # Aguarda resumos em andamento e grava os turnos ainda na fila
+    await agente.summarizer.wait_idle(timeout=30.0)
+    if agente.chat_memory:
+        agente.chat_memory.flush(timeout=30.0)
+    return runner.get_stats()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m agentes.orb_agent", description="Agente ORB")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    batch = subparsers.add_parser("batch", help="Processa um arquivo JSONL de prompts")
+    batch.add_argument("input", help="Arquivo JSONL de entrada")
+    batch.add_argument("output", help="Arquivo JSONL de saída (também usado como checkpoint)")
+    batch.add_argument("--concurrency", type=int, default=None, help="Entradas processadas simultaneamente")
+    
+    args = parser.parse_args(argv)
+    
+    if args.command == "batch":
+        stats = asyncio.run(run_batch(args.input, args.output, args.concurrency))
+        print(
+            f"Lote concluído: {stats['processed']} processadas, "
+            f"{stats['failed']} com erro, {stats['skipped']} já concluídas",
+            file=sys.stderr
+        )
+        return 1 if stats['failed'] else 0
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,14 +3,16 @@ Pipeline principal do Agente ORB
 Pipeline: recebe sessão/input → verificação de contexto → verifica tools → salva contexto → responde
 """
 
+import asyncio
 import os
 import logging
 import yaml
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, AsyncIterator, Union
 from datetime import datetime
 from dotenv import load_dotenv
 from pathlib import Path
 import sys
+import time
 
 # Carrega variáveis de ambiente do arquivo .env
 load_dotenv()
@@ -24,6 +26,9 @@ if str(database_path) not in sys.path:
 try:
     from database.config_manager import ConfigManager
     from database.chat_memory import ChatMemoryManager
+    from database.response_cache_store import ResponseCacheStore
+    from database.usage_store import get_usage_store
+    from database.image_store import ImageBlob
     DATABASE_AVAILABLE = True
 except ImportError:
     DATABASE_AVAILABLE = False
@@ -32,7 +37,24 @@ except ImportError:
 # Importações dos módulos do agente
 from .tools.tool_selector import ToolSelector
 from .llms.llm_provider import LLMProvider
+from .llms.resilience import ResiliencePolicy, ResilientCaller
 from .utils.logging_config import get_utf8_logger
+from .utils.session_cache import get_session_cache
+from .utils.response_cache import ResponseCache, get_response_cache, response_cache_enabled
+from .utils.semantic_cache import SemanticCache, get_semantic_cache, semantic_cache_enabled
+from .utils.image_pipeline import PreparedImage, get_image_preprocessor
+from .utils.concurrency import get_session_locks
+from .utils.token_budget import ContextPacker, get_token_counter
+from .utils.model_router import ModelChoice, ModelRouter
+from .memory.session_summarizer import get_session_summarizer
+from .utils.metrics import PipelineTimer, track_pipeline, record_timing, timed, get_pipeline_histograms, set_usage_recorder
+from .utils.stage_graph import Stage, StageGraph
+
+# Termos que indicam pedido de análise/raciocínio mais longo
+COMPLEX_REQUEST_WORDS = (
+    'analis', 'analyz', 'compar', 'revis', 'review', 'refator', 'refactor', 'depur', 'debug',
+    'otimiz', 'optimiz', 'arquitetura', 'architecture', 'passo a passo', 'step by step', 'detalhad'
+)
 
 class AgenteORB:
     """Classe principal do Agente ORB - Pipeline: input → contexto → tools → salva → responde"""
@@ -71,6 +93,9 @@ class AgenteORB:
         self._tools = None
         self._system_prompt = None
         self._generation_params = None
+        self._context_budget = None
+        self._model_router = None
+        self._pipeline = None
         
         # Flag para controlar inicialização
         self._initialized = False
@@ -78,8 +103,20 @@ class AgenteORB:
         # Sessão atual de chat
         self.session_id = session_id
         
-        # Histórico de conversação (em memória para compatibilidade)
-        self.conversation_history = {}
+        # Cache LRU de contexto por sessão (compartilhado entre instâncias)
+        self.context_cache = get_session_cache()
+        
+        # Com vários workers o banco é a fonte da verdade: entradas do cache
+        # são validadas pela versão da sessão antes do uso
+        self.shared_db = bool(self.chat_memory) and int(os.getenv('ORB_WORKERS', '1')) > 1
+        if self.shared_db:
+            self.chat_memory.write_queue.add_commit_listener(self.context_cache.advance_version)
+        
+        # Locks por sessão: turnos da mesma conversa são processados em ordem
+        self.session_locks = get_session_locks()
+        
+        # Resumo incremental das mensagens que saem da janela de contexto
+        self.summarizer = get_session_summarizer(self.chat_memory, self.context_cache, self.config)
         
         self.logger.info("Agente ORB configurado - componentes serão carregados sob demanda")
     
@@ -88,11 +125,19 @@ class AgenteORB:
         if not self._initialized:
             # Inicializa componentes na ordem correta (sem logs verbosos)
             self._llm_provider = self._init_llm_provider()
+            self._init_usage_accounting()
             self._tool_selector = self._init_tool_selector()
             self._tools = self._init_tools()
             
             # Carrega prompt do sistema
             self._system_prompt, self._generation_params = self._load_system_prompt()
+            self._context_budget = self._load_context_budget()
+            # Janela do cache do tamanho do maior orçamento, para o empacotador poder preenchê-lo
+            self.context_cache.fit_token_budget(max(
+                [self._context_budget['default'], *map(int, self._context_budget['models'].values())]
+            ))
+            self._model_router = ModelRouter.from_config(self._load_prompt_config().get('model_routing'))
+            self._pipeline = self._build_pipeline()
             
             self._initialized = True
     
@@ -203,18 +248,51 @@ class AgenteORB:
             llm_config_combined = {
                 **self.config,
                 'llm_provider': llm_config.get('provider', 'openai'),
-                'llm_model': llm_config.get('model', 'gpt-4o-mini')
+                'llm_model': llm_config.get('model', 'gpt-4o-mini'),
+                'routing': prompt_config.get('llm_routing')
             }
             
             self.logger.info(f"Configuração final do LLM: {llm_config_combined}")
             
-            provider = LLMProvider(llm_config_combined)
+            provider = LLMProvider(
+                llm_config_combined,
+                response_cache=self._init_response_cache(),
+                semantic_cache=self._init_semantic_cache(),
+                resilience=ResilientCaller(ResiliencePolicy.from_config(prompt_config.get('response_config')))
+            )
             self.logger.info(f"LLM Provider inicializado: {llm_config.get('provider', 'openai')}/{llm_config.get('model', 'gpt-4o-mini')}")
             return provider
         except Exception as e:
             self.logger.error(f"Erro ao inicializar LLM Provider: {str(e)}")
             raise
     
+    def _init_response_cache(self) -> Optional[ResponseCache]:
+        """Cache de respostas exatas (memória + tabela no banco, quando disponível)"""
+        if not response_cache_enabled():
+            return None
+        store = None
+        if self.chat_memory:
+            store = ResponseCacheStore(
+                self.chat_memory.db_path,
+                max_bytes=int(os.getenv('RESPONSE_CACHE_DB_MAX_BYTES', 256 * 1024 * 1024))
+            )
+        return get_response_cache(store)
+    
+    def _init_usage_accounting(self):
+        """Grava o uso de cada chamada ao provedor no banco (llm_usage_events + rollups)"""
+        if not self.chat_memory or os.getenv('USAGE_ACCOUNTING', 'true').lower() != 'true':
+            return
+        set_usage_recorder(get_usage_store(self.chat_memory.db_path).record)
+    
+    def _init_semantic_cache(self) -> Optional[SemanticCache]:
+        """Cache semântico (opt-in); o índice fica ao lado do banco quando disponível"""
+        if not semantic_cache_enabled():
+            return None
+        path = os.getenv('SEMANTIC_CACHE_PATH')
+        if not path and self.chat_memory:
+            path = str(Path(self.chat_memory.db_path).with_name('semantic_cache'))
+        return get_semantic_cache(path or None)
+    
     def _init_tool_selector(self) -> ToolSelector:
         """Inicializa seletor de ferramentas"""
         try:
@@ -303,6 +381,64 @@ class AgenteORB:
             default_params = {'temperature': 0.7, 'max_tokens': 1000}
             return default_prompt, default_params
     
+    def _load_context_budget(self) -> Dict[str, Any]:
+        """Carrega orçamento de tokens por modelo (CONTEXT_TOKEN_BUDGET sobrescreve o padrão)"""
+        budget_config = self._load_prompt_config().get('context_budget', {}) or {}
+        env_budget = os.getenv('CONTEXT_TOKEN_BUDGET')
+        return {
+            'default': int(env_budget) if env_budget else int(budget_config.get('default', 8000)),
+            'models': {} if env_budget else dict(budget_config.get('models', {}) or {})
+        }
+    
+    @property
+    def pipeline(self) -> StageGraph:
+        """Lazy loading para o grafo de etapas"""
+        if self._pipeline is None:
+            self._ensure_initialized()
+        return self._pipeline
+    
+    def _build_pipeline(self) -> StageGraph:
+        """
+        Monta o grafo de etapas do pipeline
+        
+        Contexto, tools e pré-processamento da imagem não dependem um do
+        outro e rodam em paralelo; a escolha do modelo espera o contexto e a
+        imagem, a geração espera tudo e o salvamento espera a geração. Timeout,
+        retentativas e cache de cada etapa vêm de pipeline_stages no
+        system_prompt.yaml.
+        """
+        policies = self._load_prompt_config().get('pipeline_stages', {}) or {}
+        
+        def stage(name: str, func, inputs: tuple, output: str) -> Stage:
+            policy = policies.get(name, {}) or {}
+            return Stage(
+                name, func, inputs, output=output,
+                timeout=policy.get('timeout'),
+                retries=int(policy.get('retries', 0)),
+                retry_delay=float(policy.get('retry_delay', 0.0)),
+                cache_ttl=policy.get('cache_ttl')
+            )
+        
+        return StageGraph([
+            stage('context', self._verify_context_async, ('session_id', 'message'), 'context'),
+            stage('tools', self._check_tools_needed_async, ('message',), 'tool_result'),
+            stage('image', self._prepare_image, ('image_data',), 'prepared_image'),
+            stage('routing', self._select_model, ('message', 'context', 'prepared_image'), 'model_choice'),
+            stage('generation', self._generate_response, ('message', 'context', 'tool_result', 'prepared_image', 'model_choice'), 'response'),
+            stage('save', self._save_context, ('session_id', 'message', 'response', 'tool_result', 'image_data'), 'saved')
+        ])
+    
+    def _get_context_packer(self, model: Optional[str] = None) -> ContextPacker:
+        """Monta o empacotador de contexto para o modelo do turno (padrão: o configurado)"""
+        llm_config = self.llm_provider.config
+        model = model or llm_config.get('llm_model', 'gpt-4o-mini')
+        budget = self._context_budget['models'].get(model, self._context_budget['default'])
+        return ContextPacker(
+            get_token_counter(model),
+            budget=budget,
+            reserve_output=int(llm_config.get('max_tokens', 1000))
+        )
+    
     def _validate_session_id(self, session_id: str) -> str:
         """
         Valida e normaliza session_id
@@ -319,36 +455,44 @@ class AgenteORB:
         # Aceita qualquer session_id não vazio (para testes e uso real)
         return session_id.strip()
     
-    async def process_message(self, message: str, session_id: str, image_data: Optional[str] = None) -> Dict[str, Any]:
+    async def process_message(self, message: str, session_id: str, image_data: Optional[Union[str, 'ImageBlob']] = None) -> Dict[str, Any]:
         """
-        Pipeline principal: recebe sessão/input → verificação de contexto → verifica tools → salva contexto → responde
+        Pipeline principal: recebe sessão/input → verificação de contexto e tools (em paralelo) → responde → salva contexto
         
         Args:
             message: Mensagem do usuário
             session_id: ID da sessão
-            image_data: Dados de imagem (opcional)
+            image_data: Imagem em base64 ou ImageBlob já decodificado (upload binário), opcional
             
         Returns:
             Resposta do agente
         """
+        timer = PipelineTimer()
         try:
-            # Valida e corrige session_id se necessário
-            session_id = self._validate_session_id(session_id)
-            self.logger.info(f"Iniciando pipeline para sessão {session_id}")
-            
-            # Verifica contexto de conversação
-            conversation_context = await self._verify_context_async(session_id, message)
-            
-            # Verifica se precisa usar alguma ferramenta
-            tool_result = await self._check_tools_needed_async(message, conversation_context)
-            
-            # Gera resposta usando LLM
-            response = await self._generate_response(message, conversation_context, tool_result, image_data)
-            
-            # Salva contexto da conversação (incluindo image_data se houver)
-            self._save_context(session_id, message, response, tool_result, image_data)
+            with track_pipeline(timer):
+                # Valida e corrige session_id se necessário
+                session_id = self._validate_session_id(session_id)
+                timer.session_id = session_id
+                self.logger.info(f"Iniciando pipeline para sessão {session_id}")
+                
+                # Turnos da mesma sessão são serializados (sessões diferentes seguem em paralelo)
+                lock_start = time.perf_counter()
+                async with self.session_locks.hold(session_id):
+                    record_timing('session_lock_wait', (time.perf_counter() - lock_start) * 1000)
+                    
+                    # Executa o grafo de etapas (contexto e tools em paralelo,
+                    # depois geração e salvamento do contexto)
+                    results = await self.pipeline.run({
+                        'session_id': session_id,
+                        'message': message,
+                        'image_data': image_data
+                    }, timer=timer)
+                    response = results['response']
             
-            self.logger.info("Pipeline concluída com sucesso")
+            response['timings'] = self._finish_timings(timer)
+            response['usage'] = dict(timer.usage)
+            response['cache_hit'] = timer.cache_source is not None
+            self.logger.info(f"Pipeline concluída com sucesso em {response['timings']['total_ms']}ms")
             return response
             
         except Exception as e:
@@ -357,41 +501,140 @@ class AgenteORB:
                 'content': 'Desculpe, ocorreu um erro ao processar sua mensagem. Tente novamente.',
                 'error': str(e),
                 'timestamp': datetime.now().isoformat(),
-                'pipeline_step': 'error'
+                'pipeline_step': 'error',
+                'timings': self._finish_timings(timer)
+            }
+    
+    async def stream_message(self, message: str, session_id: str, image_data: Optional[Union[str, 'ImageBlob']] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Pipeline em streaming: mesmas etapas de process_message, mas emite
+        os deltas da resposta conforme o LLM os gera
+        
+        Args:
+            message: Mensagem do usuário
+            session_id: ID da sessão
+            image_data: Imagem em base64 ou ImageBlob já decodificado (upload binário), opcional
+            
+        Yields:
+            {'type': 'delta', 'content': str} para cada trecho gerado e,
+            ao final, {'type': 'response', 'response': Dict} com a resposta
+            completa (mesmo formato de process_message), já persistida
+        
+        Se a task for cancelada (ou o consumidor fechar o gerador) durante a
+        geração, a chamada ao provedor é abortada e o texto já emitido é
+        persistido marcado como truncado, pois o usuário já o viu.
+        """
+        timer = PipelineTimer()
+        try:
+            with track_pipeline(timer):
+                # Valida e corrige session_id se necessário
+                session_id = self._validate_session_id(session_id)
+                timer.session_id = session_id
+                self.logger.info(f"Iniciando pipeline (streaming) para sessão {session_id}")
+                
+                # Turnos da mesma sessão são serializados (sessões diferentes seguem em paralelo)
+                lock_start = time.perf_counter()
+                async with self.session_locks.hold(session_id):
+                    record_timing('session_lock_wait', (time.perf_counter() - lock_start) * 1000)
+                    
+                    # Etapas anteriores à geração pelo grafo (contexto, tools e
+                    # imagem em paralelo)
+                    results = await self.pipeline.run({
+                        'session_id': session_id,
+                        'message': message,
+                        'image_data': image_data
+                    }, targets=('context', 'tool_result', 'prepared_image', 'model_choice'), timer=timer)
+                    conversation_context = results['context']
+                    tool_result = results['tool_result']
+                    
+                    # Gera resposta usando LLM, repassando cada delta
+                    with timer.stage('generation'):
+                        model_choice = results['model_choice']
+                        llm_context = self._prepare_llm_context(
+                            message, conversation_context, tool_result, results['prepared_image'], model_choice
+                        )
+                        chunks = []
+                        try:
+                            async for delta in self.llm_provider.stream_response(llm_context):
+                                chunks.append(delta)
+                                yield {'type': 'delta', 'content': delta}
+                        except (asyncio.CancelledError, GeneratorExit):
+                            self._save_partial_response(session_id, message, chunks, tool_result, image_data,
+                                                        model_choice, llm_context['served_by'])
+                            raise
+                        
+                        response = self._format_response(''.join(chunks), tool_result, model_choice, llm_context['served_by'])
+                    
+                    # Salva contexto apenas com o texto final completo
+                    with timer.stage('save'):
+                        self._save_context(session_id, message, response, tool_result, image_data)
+            
+            response['timings'] = self._finish_timings(timer)
+            response['usage'] = dict(timer.usage)
+            self.logger.info(f"Pipeline (streaming) concluída com sucesso em {response['timings']['total_ms']}ms")
+            yield {'type': 'response', 'response': response}
+            
+        except Exception as e:
+            self.logger.error(f"Erro na pipeline (streaming): {str(e)}")
+            yield {
+                'type': 'response',
+                'response': {
+                    'content': 'Desculpe, ocorreu um erro ao processar sua mensagem. Tente novamente.',
+                    'error': str(e),
+                    'timestamp': datetime.now().isoformat(),
+                    'pipeline_step': 'error',
+                    'timings': self._finish_timings(timer)
+                }
             }
     
+    def _save_partial_response(self, session_id: str, message: str, chunks: List[str], tool_result: Dict[str, Any], image_data: Optional[Union[str, 'ImageBlob']] = None,
+                               model_choice: Optional[ModelChoice] = None, served: Optional[Dict[str, str]] = None):
+        """Persiste resposta interrompida (cancelamento/desconexão) marcada como truncada"""
+        partial = ''.join(chunks)
+        self.logger.info(f"Geracao cancelada na sessao {session_id} apos {len(partial)} caracteres")
+        if not partial:
+            # Nada foi exibido ao usuário: o turno é descartado
+            return
+        response = self._format_response(partial, tool_result, model_choice, served)
+        response['truncated'] = True
+        self._save_context(session_id, message, response, tool_result, image_data)
+    
+    def _finish_timings(self, timer: PipelineTimer) -> Dict[str, Any]:
+        """Encerra a medição da requisição e alimenta os histogramas agregados"""
+        timings = timer.finish()
+        get_pipeline_histograms().observe_timings(timings)
+        return timings
+    
     async def _verify_context_async(self, session_id: str, message: str) -> Dict[str, Any]:
         """Verificação de contexto assíncrona com suporte a banco de dados"""
-        conversation_history = []
-        
-        # Tentar carregar do banco primeiro
-        if self.chat_memory:
-            try:
-                db_messages = self.chat_memory.get_messages(session_id, limit=20)
-                # Converter ChatMessage para dict
-                conversation_history = [
-                    {
-                        'role': msg.role,
-                        'content': msg.content,
-                        'timestamp': msg.created_at,
-                        'additional_kwargs': msg.additional_kwargs
-                    }
-                    for msg in db_messages
-                ]
-                self.logger.info(f"Historico carregado do banco: {len(conversation_history)} mensagens")
-            except Exception as e:
-                self.logger.warning(f"Erro ao carregar historico do banco: {e}")
+        # Sessões quentes vêm do cache (write-through a partir de _save_context)
+        conversation_history = self.context_cache.get(session_id)
+        if conversation_history is not None and self.shared_db:
+            # Outro worker pode ter escrito nesta sessão
+            if self.chat_memory.get_session_version(session_id) != self.context_cache.get_version(session_id):
+                self.context_cache.invalidate(session_id, stale=True)
+                conversation_history = None
         
-        # Fallback para memória RAM se banco não disponível
-        if not conversation_history:
-            conversation_history = self.conversation_history.get(session_id, [])
-            if conversation_history:
-                self.logger.info(f"Usando historico da memoria RAM: {len(conversation_history)} mensagens")
+        if conversation_history is not None:
+            self.logger.info(f"Historico carregado do cache: {len(conversation_history)} mensagens")
+        else:
+            conversation_history = []
+            
+            if self.chat_memory:
+                try:
+                    # Leitura fora do event loop: etapas paralelas seguem rodando
+                    with timed('db.load_history'):
+                        conversation_history, summary, version = await asyncio.to_thread(self._load_history_from_db, session_id)
+                    self.context_cache.put(session_id, conversation_history, summary, version)
+                    self.logger.info(f"Historico carregado do banco: {len(conversation_history)} mensagens")
+                except Exception as e:
+                    self.logger.warning(f"Erro ao carregar historico do banco: {e}")
         
         context_analysis = {
             'session_id': session_id,
             'message': message,
             'conversation_history': conversation_history,
+            'conversation_summary': self.context_cache.get_summary(session_id),
             'message_length': len(message),
             'is_question': message.strip().endswith('?'),
             'has_keywords': self._extract_keywords(message),
@@ -402,8 +645,31 @@ class AgenteORB:
         # Contexto verificado silenciosamente
         return context_analysis
     
-    async def _check_tools_needed_async(self, message: str, context: Dict[str, Any]) -> Dict[str, Any]:
-        """Verificação de tools necessárias assíncrona"""
+    def _load_history_from_db(self, session_id: str) -> tuple[List[Dict[str, Any]], Optional[Dict[str, Any]], Optional[int]]:
+        """Lê mensagens recentes, resumo e versão da sessão do banco (bloqueante)"""
+        # Versão lida antes das mensagens: uma escrita concorrente deixa a
+        # entrada com versão antiga (recarregada depois), nunca o contrário
+        version = self.chat_memory.get_session_version(session_id) if self.shared_db else None
+        db_messages = self.chat_memory.get_messages(
+            session_id,
+            limit=self.context_cache.max_messages,
+            max_chars=self.context_cache.window_chars()
+        )
+        summary = self.chat_memory.get_session_summary(session_id)
+        # Converter ChatMessage para dict (banco retorna mais recentes primeiro)
+        history = [
+            self._history_entry(msg.role, msg.content, msg.additional_kwargs, msg.created_at)
+            for msg in reversed(db_messages)
+        ]
+        return history, summary, version
+    
+    async def _check_tools_needed_async(self, message: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Verificação de tools necessárias assíncrona
+        
+        Depende apenas da mensagem, para rodar em paralelo com a carga do
+        contexto (context é opcional para seletores que precisem dele)
+        """
         try:
             # Por enquanto, não temos ferramentas específicas
             # Mas mantemos a estrutura para futuras implementações
@@ -422,31 +688,64 @@ class AgenteORB:
                 'needs_tool': False
             }
     
-    async def _generate_response(self, message: str, context: Dict[str, Any], tool_result: Dict[str, Any], image_data: Optional[str] = None) -> Dict[str, Any]:
+    async def _prepare_image(self, image_data: Optional[Union[str, 'ImageBlob']] = None) -> Optional[PreparedImage]:
+        """
+        Reduz a imagem à resolução útil do provedor e recodifica (pool de processos)
+        
+        Returns:
+            Imagem preparada, ou None sem imagem (ou com base64 inválido)
+        """
+        if not image_data:
+            return None
+        # ImageBlob (upload binário): os bytes seguem sem nova decodificação
+        raw = image_data if isinstance(image_data, str) else image_data.data
+        try:
+            image = await get_image_preprocessor().prepare(raw, self.llm_provider.config.get('llm_provider', 'openai'))
+        except ValueError as e:
+            self.logger.warning(f"Imagem ignorada: {e}")
+            return None
+        self.logger.info(
+            f"Imagem preparada: {image.original_bytes} -> {image.sent_bytes} bytes, "
+            f"{image.width}x{image.height} {image.mime_type}, detail={image.detail}, ~{image.tokens} tokens"
+        )
+        return image
+    
+    async def _select_model(self, message: str, context: Dict[str, Any], prepared_image: Optional[PreparedImage] = None) -> ModelChoice:
+        """
+        Escolhe a faixa de modelo do turno pela complexidade da requisição
+        
+        A decisão e os sinais que a motivaram vão para o log (e para
+        model_routing em /agent/metrics) para ajuste dos pesos.
+        """
+        choice = self._model_router.select(
+            message,
+            context.get('has_keywords', []),
+            context.get('context_type', ''),
+            context.get('conversation_history', []),
+            prepared_image is not None
+        )
+        provider = self.llm_provider.config.get('llm_provider', 'openai')
+        model = choice.model_for(provider, self.llm_provider.config.get('llm_model', 'gpt-4o-mini'))
+        self.logger.info(
+            f"Modelo escolhido: {choice.tier} ({model}), score {choice.score:g} "
+            f"[{', '.join(choice.reasons) or 'sem sinais'}]"
+        )
+        return choice
+    
+    async def _generate_response(self, message: str, context: Dict[str, Any], tool_result: Dict[str, Any], prepared_image: Optional[PreparedImage] = None,
+                                 model_choice: Optional[ModelChoice] = None) -> Dict[str, Any]:
         """
         ETAPA 3: Gera resposta usando LLM
         """
         try:
             # Prepara contexto para o LLM
-            llm_context = self._prepare_llm_context(message, context, tool_result, image_data)
+            llm_context = self._prepare_llm_context(message, context, tool_result, prepared_image, model_choice)
             
             # Gera resposta usando LLM Provider
             response_content = await self.llm_provider.generate_response(llm_context)
             
-            # Formata resposta no padrão esperado
-            response = {
-                'content': response_content,
-                'pipeline_step': 'response_generated',
-                'tool_used': tool_result.get('tool_used'),
-                'reasoning': tool_result.get('decision', {}).get('reasoning'),
-                'model_used': self.config.get('llm_model', 'gpt-4o-mini'),
-                'provider': self.config.get('llm_provider', 'openai'),
-                'context_verified': True,
-                'timestamp': datetime.now().isoformat()
-            }
-            
             # Resposta gerada silenciosamente
-            return response
+            return self._format_response(response_content, tool_result, model_choice, llm_context['served_by'])
             
         except Exception as e:
             self.logger.error(f"Erro na geração de resposta: {str(e)}")
@@ -457,75 +756,94 @@ class AgenteORB:
                 'timestamp': datetime.now().isoformat()
             }
     
-    def _save_context(self, session_id: str, message: str, response: Dict[str, Any], tool_result: Dict[str, Any], image_data: Optional[str] = None) -> bool:
+    def _format_response(self, content: str, tool_result: Dict[str, Any], model_choice: Optional[ModelChoice] = None,
+                         served: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """
+        Formata resposta do LLM no padrão esperado pela API
+        
+        provider/model_used vêm de quem atendeu (served, ex: backend do
+        roteamento após failover); sem ele (cache), do configurado.
+        """
+        provider = self.llm_provider.config.get('llm_provider', 'openai')
+        model = self.llm_provider.config.get('llm_model', 'gpt-4o-mini')
+        if model_choice:
+            model = model_choice.model_for(provider, model)
+        if served and served.get('provider'):
+            provider = served['provider']
+            model = served.get('model') or model
+        return {
+            'content': content,
+            'pipeline_step': 'response_generated',
+            'tool_used': tool_result.get('tool_used'),
+            'reasoning': tool_result.get('decision', {}).get('reasoning'),
+            'model_used': model,
+            'model_tier': model_choice.tier if model_choice else None,
+            'provider': provider,
+            'context_verified': True,
+            'timestamp': datetime.now().isoformat()
+        }
+    
+    def _save_context(self, session_id: str, message: str, response: Dict[str, Any], tool_result: Dict[str, Any], image_data: Optional[Union[str, 'ImageBlob']] = None) -> bool:
         """
         ETAPA 4: Salva contexto
         Armazena conversa no banco de dados E no histórico local (fallback)
         """
         try:
-            # Salvar no banco de dados (se disponível)
+            # Respostas interrompidas ficam marcadas no histórico
+            assistant_kwargs = {'truncated': True} if response.get('truncated') else {}
+            
+            # Imagem decodificada uma vez: o banco guarda os bytes em image_blobs
+            # e o histórico (banco e cache) só a referência
+            image_blob = None
+            if image_data and self.chat_memory:
+                if not isinstance(image_data, str):
+                    # Upload binário: já chega como ImageBlob
+                    image_blob = image_data
+                else:
+                    try:
+                        image_blob = ImageBlob.from_base64(image_data)
+                    except ValueError as e:
+                        self.logger.warning(f"Imagem descartada do histórico: {e}")
+            
+            # Salvar no banco de dados (se disponível) via fila write-behind:
+            # sessão, título e mensagens são gravados numa única transação
+            # fora do event loop
             if self.chat_memory:
                 try:
-                    # Criar sessão se não existir
-                    session_created = self.chat_memory.create_session(session_id)
-                    self.logger.info(f"Sessao criada/verificada: {session_id}")
+                    # Título da sessão a partir da primeira mensagem (limitar a 50 caracteres)
+                    title = message[:50] + '...' if len(message) > 50 else message
                     
-                    # Verificar se é a primeira mensagem da sessão
-                    session_info = self.chat_memory.get_session_info(session_id)
-                    if session_info and session_info.get('message_count', 0) == 0:
-                        # Primeira mensagem - usar como título (limitar a 50 caracteres)
-                        title = message[:50] + '...' if len(message) > 50 else message
-                        self.chat_memory.update_session_title(session_id, title)
-                        self.logger.info(f"Titulo da sessao atualizado: {title}")
-                    
-                    # Salvar mensagem do usuário
-                    user_saved = self.chat_memory.add_user_message(session_id, message, image_data)
-                    self.logger.info(f"Mensagem do usuario salva: {user_saved}")
-                    
-                    # Salvar resposta do assistente
-                    assistant_saved = self.chat_memory.add_assistant_message(
-                        session_id, 
-                        response.get('content', '')
-                    )
-                    self.logger.info(f"Resposta do assistente salva: {assistant_saved}")
-                    
-                    self.logger.info(f"Mensagens salvas no banco para sessao {session_id}")
+                    with timed('db.enqueue_turn'):
+                        queued = self.chat_memory.enqueue_turn(
+                            session_id,
+                            message,
+                            response.get('content', ''),
+                            image_data=image_blob,
+                            title=title,
+                            assistant_kwargs=assistant_kwargs
+                        )
+                    self.logger.info(f"Turno enfileirado para gravacao na sessao {session_id}: {queued}")
                 except Exception as e:
                     self.logger.error(f"Erro ao salvar no banco: {e}", exc_info=True)
-                    import traceback
-                    traceback.print_exc()
             else:
                 self.logger.warning("ChatMemory nao disponivel, usando apenas memoria")
             
-            # Fallback: Salvar em memória também (compatibilidade)
-            # Recupera histórico atual
-            if session_id not in self.conversation_history:
-                self.conversation_history[session_id] = []
-            
-            conversation_history = self.conversation_history[session_id]
-            
-            # Adiciona mensagem do usuário
-            user_message = {
-                'role': 'user',
-                'content': message,
-                'timestamp': datetime.now().isoformat()
-            }
-            if image_data:
-                user_message['image_data'] = image_data
-            conversation_history.append(user_message)
-            
-            # Adiciona resposta do assistente
-            conversation_history.append({
-                'role': 'assistant',
-                'content': response.get('content', ''),
-                'timestamp': datetime.now().isoformat(),
-                'tool_used': tool_result.get('tool_used'),
-                'pipeline_step': response.get('pipeline_step')
-            })
-            
-            # Mantém apenas as últimas 20 mensagens para não exceder limites
-            if len(conversation_history) > 20:
-                self.conversation_history[session_id] = conversation_history[-20:]
+            # Write-through no cache de contexto. Sem banco, o cache é a única
+            # fonte do histórico e a entrada pode ser criada aqui
+            if image_blob is not None:
+                user_kwargs = {'image_ref': image_blob.ref}
+            else:
+                user_kwargs = {}
+                if image_data and not self.chat_memory:
+                    user_kwargs['image_data'] = image_data if isinstance(image_data, str) else image_data.to_base64()
+            self.context_cache.append(
+                session_id,
+                [
+                    self._history_entry('user', message, user_kwargs),
+                    self._history_entry('assistant', response.get('content', ''), assistant_kwargs)
+                ],
+                create=not self.chat_memory
+            )
             
             # Contexto salvo silenciosamente
             return True
@@ -534,6 +852,15 @@ class AgenteORB:
             self.logger.error(f"Erro ao salvar contexto: {str(e)}")
             return False
     
+    def _history_entry(self, role: str, content: str, additional_kwargs: Optional[Dict] = None, timestamp: Optional[str] = None) -> Dict[str, Any]:
+        """Mensagem do histórico no formato usado pelo cache e pelo LLM Provider"""
+        return {
+            'role': role,
+            'content': content,
+            'timestamp': timestamp or datetime.now().isoformat(),
+            'additional_kwargs': additional_kwargs or {}
+        }
+    
     def _extract_keywords(self, message: str) -> List[str]:
         """Extrai palavras-chave da mensagem"""
         keywords = []
@@ -546,6 +873,11 @@ class AgenteORB:
             keywords.append('thanks')
         if '?' in message:
             keywords.append('question')
+        # Sinais de requisição complexa (usados na escolha do modelo)
+        if '```' in message or 'traceback' in message_lower or 'def ' in message or 'function ' in message_lower:
+            keywords.append('code')
+        if any(word in message_lower for word in COMPLEX_REQUEST_WORDS):
+            keywords.append('complex_request')
         
         return keywords
     
@@ -559,21 +891,48 @@ class AgenteORB:
         
         return 'ongoing_conversation'
     
-    def _prepare_llm_context(self, message: str, context: Dict[str, Any], tool_result: Dict[str, Any], image_data: Optional[str] = None) -> Dict[str, Any]:
+    def _prepare_llm_context(self, message: str, context: Dict[str, Any], tool_result: Dict[str, Any], image: Optional[PreparedImage] = None,
+                             model_choice: Optional[ModelChoice] = None) -> Dict[str, Any]:
         """Prepara contexto para o LLM Provider"""
-        # Prepara histórico da conversa (enviar como array de dicts)
-        conversation_history = context.get('conversation_history', [])
+        # Orçamento de tokens do modelo escolhido para o turno
+        provider_config = self.llm_provider.config
+        model = model_choice.model_for(provider_config.get('llm_provider', 'openai'), provider_config.get('llm_model')) if model_choice else None
+        # Resumo das mensagens que já saíram da janela (mantido em background)
+        summary = context.get('conversation_summary') or {}
+        summary_text = f"Resumo da conversa anterior: {summary['summary']}" if summary.get('summary') else ''
+        
+        # Prepara histórico da conversa (enviar como array de dicts), limitado
+        # pelo orçamento de tokens do modelo em vez de um número fixo de mensagens
+        with timed('prompt.pack'):
+            conversation_history, packing = self._get_context_packer(model).pack(
+                context.get('conversation_history', []),
+                f"{self.system_prompt}\n{summary_text}" if summary_text else self.system_prompt,
+                message,
+                image_count=1 if image else 0,
+                image_tokens=image.tokens if image and image.tokens else None
+            )
+        self.logger.info(
+            f"Contexto empacotado: {packing['messages_included']} mensagens, "
+            f"{packing['prompt_tokens']}/{packing['budget']} tokens ({packing['counter']})"
+        )
+        
+        if summary_text:
+            conversation_history = [{'role': 'system', 'content': summary_text}] + conversation_history
         
-        # Pegar apenas as últimas 10 mensagens para não exceder limites
-        if conversation_history:
-            conversation_history = conversation_history[-10:]
+        # Mensagens fora da janela atual alimentam o resumo (fora do caminho da requisição)
+        if context.get('session_id'):
+            self.summarizer.schedule(context['session_id'], packing['messages_included'])
         
         return {
             'user_input': message,
             'conversation_history': conversation_history,  # Enviar array diretamente
             'system_prompt': self.system_prompt,
-            'image_data': image_data,
-            'context_analysis': f"Tipo: {context.get('context_type', 'unknown')}, Palavras-chave: {context.get('has_keywords', [])}"
+            **(image.to_context() if image else {'image_data': None}),
+            **(model_choice.to_context() if model_choice else {}),
+            'context_analysis': f"Tipo: {context.get('context_type', 'unknown')}, Palavras-chave: {context.get('has_keywords', [])}",
+            'context_packing': packing,
+            # Preenchido pelo LLM Provider com o provedor/modelo que atendeu
+            'served_by': {}
         }
     
     def cleanup(self):
@@ -593,7 +952,8 @@ class AgenteORB:
             'llm_provider': self.config.get('llm_provider', 'openai'),
             'model': self.config.get('model', 'gpt-3.5-turbo'),
             'tools_available': list(self.tools.keys()) if self._tools else [],
-            'active_sessions': len(self.conversation_history),
+            'active_sessions': len(self.context_cache),
+            'context_cache': self.context_cache.get_stats(),
             'timestamp': datetime.now().isoformat(),
             'components': {
                 "llm_provider": self._llm_provider is not None,
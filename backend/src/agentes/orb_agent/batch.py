@@ -0,0 +1,148 @@
+"""
+Processamento em lote para o Agente ORB
+Executa muitos prompts com concorrência limitada sobre a mesma instância do
+agente (mesmos clientes de provedor e fila de escrita em lote); resultados
+saem na ordem em que terminam, sempre com o id da entrada
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+from typing import Dict, Any, AsyncIterator, Iterable, Optional, Set
+
+# Concorrência padrão do lote (o limitador global de chamadas ao LLM continua valendo)
+DEFAULT_BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 8))
+
+_DONE = object()
+
+
+def normalize_item(raw: Dict[str, Any], index: int) -> Dict[str, Any]:
+    """
+    Normaliza uma entrada do lote
+    
+    Args:
+        raw: Entrada com message e, opcionalmente, id, session_id e image_data
+        index: Posição da entrada (id padrão)
+    """
+    item_id = raw.get('id')
+    return {
+        'id': item_id if item_id is not None else index,
+        'message': raw.get('message') or '',
+        # Sem sessão informada, cada entrada é uma conversa independente
+        'session_id': raw.get('session_id') or f"batch-{uuid.uuid4()}",
+        'image_data': raw.get('image_data')
+    }
+
+
+class BatchRunner:
+    """
+    Executa entradas do lote com um pool fixo de workers assíncronos
+    
+    As entradas são consumidas sob demanda (a fila interna aplica
+    backpressure), então arquivos grandes não são carregados em memória.
+    """
+    
+    def __init__(self, agente, concurrency: Optional[int] = None):
+        """
+        Args:
+            agente: Instância de AgenteORB compartilhada pelo lote
+            concurrency: Entradas processadas simultaneamente
+        """
+        self.agente = agente
+        self.concurrency = max(1, concurrency or DEFAULT_BATCH_CONCURRENCY)
+        self.logger = logging.getLogger(__name__)
+        
+        self.processed = 0
+        self.failed = 0
+        self.skipped = 0
+    
+    async def run(self, items: Iterable[Dict[str, Any]], skip_ids: Optional[Set[str]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Processa as entradas e emite os resultados conforme terminam
+        
+        Args:
+            items: Entradas normalizadas (ver normalize_item)
+            skip_ids: Ids (como str) já concluídos em execução anterior
+        
+        Yields:
+            Resultado de cada entrada, com 'id' da entrada e 'error' em caso de falha
+        """
+        skip_ids = skip_ids or set()
+        pending: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        results: asyncio.Queue = asyncio.Queue()
+        
+        async def produce():
+            try:
+                for item in items:
+                    if str(item['id']) in skip_ids:
+                        self.skipped += 1
+                        continue
+                    await pending.put(item)
+            finally:
+                for _ in range(self.concurrency):
+                    await pending.put(_DONE)
+        
+        async def work():
+            while True:
+                item = await pending.get()
+                if item is _DONE:
+                    await results.put(_DONE)
+                    return
+                await results.put(await self._process(item))
+        
+        tasks = [asyncio.create_task(produce())]
+        tasks.extend(asyncio.create_task(work()) for _ in range(self.concurrency))
+        try:
+            finished = 0
+            while finished < self.concurrency:
+                result = await results.get()
+                if result is _DONE:
+                    finished += 1
+                    continue
+                yield result
+            # Propaga erro de leitura das entradas
+            await tasks[0]
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    async def _process(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """Processa uma entrada pelo pipeline do agente"""
+        if not item['message']:
+            self.failed += 1
+            return {'id': item['id'], 'session_id': item['session_id'], 'error': 'Mensagem vazia'}
+        
+        try:
+            response = await self.agente.process_message(
+                message=item['message'],
+                session_id=item['session_id'],
+                image_data=item.get('image_data')
+            )
+        except Exception as e:
+            self.logger.error(f"Erro ao processar entrada {item['id']} do lote: {e}")
+            response = {'error': str(e)}
+        
+        if response.get('error'):
+            self.failed += 1
+        else:
+            self.processed += 1
+        return {
+            'id': item['id'],
+            'session_id': item['session_id'],
+            'content': response.get('content'),
+            'error': response.get('error'),
+            'model_used': response.get('model_used'),
+            'provider': response.get('provider'),
+            'timings': response.get('timings'),
+            'usage': response.get('usage'),
+            'cache_hit': response.get('cache_hit', False)
+        }
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Contadores do lote"""
+        return {
+            'processed': self.processed,
+            'failed': self.failed,
+            'skipped': self.skipped
+        }
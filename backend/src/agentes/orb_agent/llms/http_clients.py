@@ -0,0 +1,408 @@
+"""
+Clientes HTTP compartilhados dos provedores LLM
+Um único httpx.AsyncClient por processo (keep-alive e limites do pool
+ajustáveis, HTTP/2 opcional) atende todos os clientes OpenAI/Anthropic:
+instâncias do agente criadas por conexão WebSocket reaproveitam as conexões
+TLS já abertas em vez de refazer o handshake a cada turno. As conexões são
+pré-aquecidas no startup e reaquecidas antes de expirarem por ociosidade.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Any, Iterable, Optional, Tuple
+
+from ..utils.concurrency import current_adaptive_limiter, OVERLOAD_STATUS, OVERLOAD_OBSERVED
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+try:
+    import h2  # noqa: F401
+    H2_AVAILABLE = True
+except ImportError:
+    H2_AVAILABLE = False
+
+# URL base padrão de cada provedor (OPENAI_BASE_URL / ANTHROPIC_BASE_URL sobrescrevem)
+PROVIDER_BASE_URLS = {
+    'openai': 'https://api.openai.com/v1',
+    'anthropic': 'https://api.anthropic.com',
+}
+
+
+class _RequestTrace:
+    """Acompanha, via extensão 'trace' do httpcore, se a requisição abriu conexão nova"""
+    
+    __slots__ = ('registry', 'host', 'connected', '_connect_start')
+    
+    def __init__(self, registry: 'ProviderClientRegistry', host: str):
+        self.registry = registry
+        self.host = host
+        self.connected = False
+        self._connect_start = None
+    
+    async def __call__(self, event_name: str, info: Dict[str, Any]) -> None:
+        if event_name == 'connection.connect_tcp.started':
+            self._connect_start = time.perf_counter()
+        elif event_name == 'connection.connect_tcp.complete':
+            self.connected = True
+            self.registry._record_connection(self.host)
+        elif event_name == 'connection.start_tls.complete':
+            self.registry.tls_handshakes += 1
+            if self._connect_start is not None:
+                self.registry._record_connect_time((time.perf_counter() - self._connect_start) * 1000)
+        elif event_name.startswith('http2.') and event_name.endswith('send_request_headers.started'):
+            self.registry.http2_requests += 1
+
+
+class ProviderClientRegistry:
+    """
+    Registro de clientes dos provedores LLM do processo
+    
+    Clientes do SDK são criados uma vez por (provedor, api_key, base_url) e
+    compartilham o mesmo pool de conexões. Cada requisição é contada como
+    conexão nova ou reaproveitada; hosts ociosos há mais de rewarm_after
+    segundos recebem uma requisição leve (HEAD) para manter a conexão aberta,
+    até idle_max segundos sem tráfego real.
+    """
+    
+    def __init__(self, max_connections: int = 20, max_keepalive: int = 10, keepalive_expiry: float = 120.0,
+                 http2: bool = False, connect_timeout: float = 5.0, warmup_connections: int = 2,
+                 rewarm_after: Optional[float] = None, idle_max: float = 1800.0):
+        """
+        Args:
+            max_connections: Conexões simultâneas no pool
+            max_keepalive: Conexões ociosas mantidas abertas
+            keepalive_expiry: Segundos até uma conexão ociosa ser fechada
+            http2: Usa HTTP/2 (requer o pacote h2; sem ele, HTTP/1.1)
+            connect_timeout: Timeout de conexão em segundos
+            warmup_connections: Conexões abertas por host no aquecimento
+            rewarm_after: Segundos de ociosidade até reaquecer (padrão: 80% do keepalive_expiry; 0 desativa)
+            idle_max: Segundos sem tráfego real após os quais o host deixa de ser reaquecido
+        """
+        self.logger = logging.getLogger(__name__)
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2 and H2_AVAILABLE
+        if http2 and not H2_AVAILABLE:
+            self.logger.warning("HTTP/2 requer o pacote h2 (pip install httpx[http2]); usando HTTP/1.1")
+        self.connect_timeout = connect_timeout
+        self.warmup_connections = max(1, warmup_connections)
+        self.rewarm_after = keepalive_expiry * 0.8 if rewarm_after is None else rewarm_after
+        self.idle_max = idle_max
+        
+        self._http_client = None
+        self._loop = None
+        self._clients: Dict[Tuple[str, str, Optional[str]], Any] = {}
+        # host -> URL base usada no aquecimento
+        self._targets: Dict[str, str] = {}
+        # host -> última requisição (incluindo aquecimento) / última requisição real
+        self._last_activity: Dict[str, float] = {}
+        self._last_use: Dict[str, float] = {}
+        self._keepalive_task = None
+        self._warming = set()
+        self._tasks = set()
+        
+        self.requests = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.tls_handshakes = 0
+        self.http2_requests = 0
+        self.warmups = 0
+        self.warmup_errors = 0
+        self.loop_resets = 0
+        self._connect_ms_total = 0.0
+        self._connect_ms_max = 0.0
+        self._host_stats: Dict[str, Dict[str, int]] = {}
+    
+    def _check_loop(self) -> None:
+        """
+        Conexões do pool ficam presas ao event loop em que foram abertas:
+        se o loop mudou (ex: vários asyncio.run), recria cliente e pool
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._loop is None:
+            self._loop = loop
+        elif self._loop is not loop:
+            self.logger.info("Event loop mudou; recriando clientes HTTP dos provedores")
+            if self._http_client is not None:
+                self._close_stale(self._http_client, self._loop)
+            self._http_client = None
+            self._clients.clear()
+            self._keepalive_task = None
+            self._warming.clear()
+            self._loop = loop
+            self.loop_resets += 1
+    
+    def _close_stale(self, http_client: 'httpx.AsyncClient', loop: asyncio.AbstractEventLoop) -> None:
+        """
+        Fecha o pool do cliente substituído: no loop dele, se ainda existir;
+        senão no loop atual (conexões de loop encerrado podem falhar ao fechar)
+        """
+        if not loop.is_closed():
+            try:
+                asyncio.run_coroutine_threadsafe(http_client.aclose(), loop)
+                return
+            except RuntimeError:
+                pass
+        
+        async def close_quietly():
+            try:
+                await http_client.aclose()
+            except Exception as e:
+                self.logger.debug(f"Cliente HTTP antigo fechado com erro: {e}")
+        
+        task = asyncio.get_running_loop().create_task(close_quietly())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    def http_client(self) -> 'httpx.AsyncClient':
+        """Cliente httpx compartilhado (criado sob demanda)"""
+        if not HTTPX_AVAILABLE:
+            raise ImportError("httpx não está instalado. Execute: pip install httpx")
+        self._check_loop()
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                    keepalive_expiry=self.keepalive_expiry
+                ),
+                # Timeout de leitura fica a cargo do SDK (por requisição)
+                timeout=httpx.Timeout(600.0, connect=self.connect_timeout),
+                http2=self.http2,
+                follow_redirects=True,
+                event_hooks={'request': [self._on_request], 'response': [self._on_response]}
+            )
+        return self._http_client
+    
+    def client(self, provider: str, api_key: str, base_url: Optional[str] = None):
+        """
+        Cliente do SDK do provedor, compartilhado por todas as instâncias do agente
+        
+        Args:
+            provider: 'openai' ou 'anthropic'
+            api_key: Chave da API
+            base_url: URL base (None = padrão do SDK / variável de ambiente)
+        """
+        http_client = self.http_client()
+        key = (provider, api_key, base_url)
+        sdk_client = self._clients.get(key)
+        if sdk_client is not None:
+            return sdk_client
+        
+        # Sem retentativas no SDK: ResilientCaller é a única camada (backoff, prazo e hedge)
+        kwargs = {'api_key': api_key, 'http_client': http_client, 'max_retries': 0}
+        if base_url:
+            kwargs['base_url'] = base_url
+        if provider == 'openai':
+            import openai
+            sdk_client = openai.AsyncOpenAI(**kwargs)
+        elif provider == 'anthropic':
+            import anthropic
+            sdk_client = anthropic.AsyncAnthropic(**kwargs)
+        else:
+            raise ValueError(f"Provedor sem cliente HTTP: {provider}")
+        
+        self._clients[key] = sdk_client
+        self.add_target(str(sdk_client.base_url))
+        self.logger.info(f"Cliente {provider} criado (pool compartilhado, http2={self.http2})")
+        return sdk_client
+    
+    def add_target(self, base_url: str) -> None:
+        """Registra a URL base para aquecimento (e aquece em background se houver loop rodando)"""
+        if not HTTPX_AVAILABLE:
+            return
+        host = httpx.URL(base_url).host
+        if host in self._targets:
+            return
+        self._targets[host] = base_url
+        self._last_use[host] = time.monotonic()
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = asyncio.create_task(self.warmup([host]))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def _on_request(self, request: 'httpx.Request') -> None:
+        """Hook de requisição: conta e instala o trace de conexão"""
+        self.requests += 1
+        if 'trace' not in request.extensions:
+            request.extensions['trace'] = _RequestTrace(self, request.url.host)
+    
+    async def _on_response(self, response: 'httpx.Response') -> None:
+        """
+        Hook de resposta: conexão sem connect_tcp foi reaproveitada do pool;
+        status e cabeçalhos de rate limit vão para o limitador adaptativo da chamada
+        """
+        limiter = current_adaptive_limiter()
+        if limiter is not None:
+            limiter.observe_response(response.status_code, response.headers)
+            if response.status_code in OVERLOAD_STATUS:
+                # O erro do SDK com esta resposta não conta de novo em call_slot
+                response.extensions[OVERLOAD_OBSERVED] = True
+        trace = response.request.extensions.get('trace')
+        if isinstance(trace, _RequestTrace) and not trace.connected:
+            self.reused_connections += 1
+            self._host_stat(trace.host)['reused'] += 1
+        now = time.monotonic()
+        host = response.request.url.host
+        self._last_activity[host] = now
+        if host not in self._warming:
+            self._last_use[host] = now
+    
+    def _host_stat(self, host: str) -> Dict[str, int]:
+        stats = self._host_stats.get(host)
+        if stats is None:
+            stats = self._host_stats[host] = {'new': 0, 'reused': 0}
+        return stats
+    
+    def _record_connection(self, host: str) -> None:
+        self.new_connections += 1
+        self._host_stat(host)['new'] += 1
+    
+    def _record_connect_time(self, ms: float) -> None:
+        self._connect_ms_total += ms
+        self._connect_ms_max = max(self._connect_ms_max, ms)
+    
+    async def warmup(self, hosts: Optional[list] = None) -> int:
+        """
+        Abre conexões com os hosts registrados (TCP + TLS) antes da primeira chamada real
+        
+        A resposta do HEAD (normalmente 4xx) é descartada: interessa apenas
+        deixar a conexão no pool.
+        
+        Args:
+            hosts: Hosts a aquecer (None = todos os registrados)
+        
+        Returns:
+            Quantidade de requisições de aquecimento bem-sucedidas
+        """
+        if not HTTPX_AVAILABLE:
+            return 0
+        client = self.http_client()
+        if self._keepalive_task is None and self.rewarm_after > 0:
+            self._keepalive_task = asyncio.create_task(self._keepalive_loop())
+        
+        targets = [(host, self._targets[host]) for host in (hosts or list(self._targets)) if host in self._targets]
+        
+        async def _ping(url: str) -> bool:
+            try:
+                await client.head(url, timeout=self.connect_timeout * 2)
+                return True
+            except Exception as e:
+                self.warmup_errors += 1
+                self.logger.debug(f"Falha ao aquecer conexão com {url}: {str(e)}")
+                return False
+        
+        done = 0
+        for host, url in targets:
+            self._warming.add(host)
+            try:
+                results = await asyncio.gather(*(_ping(url) for _ in range(self.warmup_connections)))
+            finally:
+                self._warming.discard(host)
+            done += sum(results)
+            self.warmups += sum(results)
+        return done
+    
+    async def _keepalive_loop(self) -> None:
+        """Reaquece hosts ociosos antes que o keep-alive expire (enquanto houver uso recente)"""
+        interval = max(1.0, self.rewarm_after / 4)
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            stale = [
+                host for host in self._targets
+                if now - self._last_activity.get(host, 0.0) >= self.rewarm_after
+                and now - self._last_use.get(host, 0.0) <= self.idle_max
+            ]
+            if stale:
+                await self.warmup(stale)
+    
+    async def aclose(self) -> None:
+        """Encerra o aquecimento periódico e fecha o pool de conexões"""
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+            self._keepalive_task = None
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+        self._clients.clear()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Retorna métricas de reaproveitamento de conexões"""
+        handshakes = self.tls_handshakes
+        settled = self.new_connections + self.reused_connections
+        now = time.monotonic()
+        return {
+            'http2': self.http2,
+            'max_connections': self.max_connections,
+            'max_keepalive': self.max_keepalive,
+            'keepalive_expiry': self.keepalive_expiry,
+            'clients': len(self._clients),
+            'requests': self.requests,
+            'new_connections': self.new_connections,
+            'reused_connections': self.reused_connections,
+            'reuse_ratio': round(self.reused_connections / settled, 3) if settled else 0.0,
+            'tls_handshakes': handshakes,
+            'http2_requests': self.http2_requests,
+            'connect_ms': {
+                'avg': round(self._connect_ms_total / handshakes, 2) if handshakes else 0.0,
+                'max': round(self._connect_ms_max, 2)
+            },
+            'warmups': self.warmups,
+            'warmup_errors': self.warmup_errors,
+            'loop_resets': self.loop_resets,
+            'hosts': {
+                host: {
+                    **self._host_stat(host),
+                    'idle_s': round(now - self._last_activity[host], 1) if host in self._last_activity else None
+                }
+                for host in self._targets
+            }
+        }
+
+
+# Instância global (compartilhada entre instâncias do agente)
+_provider_clients = None
+
+
+def get_provider_clients() -> ProviderClientRegistry:
+    """Retorna instância singleton do ProviderClientRegistry"""
+    global _provider_clients
+    if _provider_clients is None:
+        _provider_clients = ProviderClientRegistry(
+            max_connections=int(os.getenv('LLM_HTTP_MAX_CONNECTIONS', 20)),
+            max_keepalive=int(os.getenv('LLM_HTTP_MAX_KEEPALIVE', 10)),
+            keepalive_expiry=float(os.getenv('LLM_HTTP_KEEPALIVE_EXPIRY', 120)),
+            http2=os.getenv('LLM_HTTP2', 'false').lower() == 'true',
+            connect_timeout=float(os.getenv('LLM_HTTP_CONNECT_TIMEOUT', 5)),
+            warmup_connections=int(os.getenv('LLM_HTTP_WARMUP_CONNECTIONS', 2)),
+            rewarm_after=float(os.environ['LLM_HTTP_REWARM_AFTER']) if os.getenv('LLM_HTTP_REWARM_AFTER') else None,
+            idle_max=float(os.getenv('LLM_HTTP_IDLE_MAX', 1800))
+        )
+    return _provider_clients
+
+
+def register_configured_providers(providers: Iterable[str] = ()) -> None:
+    """
+    Registra para aquecimento os provedores informados (ex: o ativo no banco,
+    cuja chave o agente carrega de lá) e os com chave no ambiente
+    (OPENAI_API_KEY / ANTHROPIC_API_KEY)
+    """
+    registry = get_provider_clients()
+    providers = set(providers)
+    for provider, base_url in PROVIDER_BASE_URLS.items():
+        if provider in providers or os.getenv(f'{provider.upper()}_API_KEY'):
+            registry.add_target(os.getenv(f'{provider.upper()}_BASE_URL') or base_url)
@@ -3,37 +3,127 @@ LLM Provider para o Agente ORB
 Suporte para OpenAI e Anthropic
 """
 
+import asyncio
 import os
+import time
 import logging
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, AsyncIterator
 from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+
+from database.image_store import sniff_base64_image_type
+from ..utils.concurrency import get_llm_limiter, get_adaptive_limiters, parse_retry_after, OVERLOAD_STATUS, OVERLOAD_OBSERVED
+from ..utils.metrics import record_timing, record_usage, record_cache_source, timed, track_call
+from ..utils.response_cache import ResponseCache
+from ..utils.semantic_cache import SemanticCache
+from .http_clients import get_provider_clients
+from .resilience import ResilientCaller
+
+# Marca de cache de prompt da Anthropic (o prefixo até o bloco marcado é reaproveitado)
+ANTHROPIC_CACHE_CONTROL = {"type": "ephemeral"}
+
+# Resposta devolvida quando o provedor falha
+ERROR_RESPONSE = "Desculpe, ocorreu um erro ao processar sua mensagem."
 
 class BaseLLMProvider(ABC):
     """Classe base para provedores de LLM"""
     
+    # Nome do provedor (chave de tier_models) e modelo padrão
+    name = ''
+    default_model = ''
+    # Provedor que já repete a chamada em outros backends quando ela falha
+    fails_over = False
+    
+    def model_for(self, context: Dict[str, Any]) -> str:
+        """Modelo da chamada: o da faixa escolhida para o turno (tier_models) ou o configurado"""
+        return (context.get('tier_models') or {}).get(self.name) or self.config.get('llm_model', self.default_model)
+    
+    def served(self, context: Dict[str, Any]) -> Dict[str, str]:
+        """Provedor/modelo que atende a chamada"""
+        return {'provider': self.name, 'model': self.model_for(context)}
+    
+    def latency_key(self, context: Dict[str, Any]) -> str:
+        """Provedor/modelo que agrupa as latências usadas pelo hedge"""
+        served = self.served(context)
+        return f"{served['provider']}/{served['model']}"
+    
+    @asynccontextmanager
+    async def call_slot(self, context: Dict[str, Any], streaming: bool = False) -> AsyncIterator[Any]:
+        """
+        Vaga para uma chamada à API: limite adaptativo do provedor/modelo e,
+        dentro dele, o limite global (quem espera pelo modelo não ocupa vaga global)
+        
+        Chamadas sem streaming alimentam o limitador com a latência total;
+        em streaming o provedor informa o primeiro token. Um 429/529 que
+        chega como exceção corta o limite se o hook do cliente HTTP
+        compartilhado ainda não o tiver contado. Tokens, latência e
+        resultado da chamada vão para a contabilidade de uso (track_call):
+        o provedor passa o registro da chamada a _record_usage.
+        
+        Yields:
+            (limiter, call): AdaptiveLimiter do provedor/modelo (None se
+            desativado) e registro de uso da chamada
+        """
+        model = self.model_for(context)
+        wait_start = time.perf_counter()
+        async with get_adaptive_limiters().slot(f"{self.name}/{model}") as limiter:
+            async with get_llm_limiter().slot():
+                call_start = time.perf_counter()
+                record_timing('provider.queue_wait', (call_start - wait_start) * 1000)
+                try:
+                    with track_call(self.name, model) as call:
+                        yield limiter, call
+                except Exception as e:
+                    response = getattr(e, 'response', None)
+                    observed = (getattr(response, 'extensions', None) or {}).get(OVERLOAD_OBSERVED)
+                    if limiter is not None and getattr(e, 'status_code', None) in OVERLOAD_STATUS and not observed:
+                        headers = getattr(response, 'headers', None) or {}
+                        limiter.on_overload(parse_retry_after(headers))
+                    raise
+                if limiter is not None and not streaming:
+                    limiter.observe_latency(time.perf_counter() - call_start)
+    
     @abstractmethod
     async def generate_response(self, context: Dict[str, Any]) -> str:
         """Gera resposta baseada no contexto"""
         pass
+    
+    async def stream_response(self, context: Dict[str, Any]) -> AsyncIterator[str]:
+        """
+        Gera resposta em streaming, emitindo deltas de texto
+        
+        Implementação padrão para provedores sem streaming nativo:
+        emite a resposta completa como um único delta.
+        """
+        yield await self.generate_response(context)
+    
+    def cache_key_payload(self, context: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Requisição renderizada (modelo, parâmetros e mensagens) usada como
+        chave do cache de respostas; None indica resposta que não deve ser cacheada
+        """
+        return None
 
 class OpenAIProvider(BaseLLMProvider):
     """Provedor OpenAI"""
     
+    name = 'openai'
+    default_model = 'gpt-4o-mini'
+    
     def __init__(self, config: Dict[str, Any]):
         self.config = config
         self.logger = logging.getLogger(__name__)
         
         # Importa OpenAI
         try:
-            import openai
+            import openai  # noqa: F401
             # Usar api_key do config (database) ou fallback para .env
-            api_key = config.get('api_key') or os.getenv('OPENAI_API_KEY')
-            if not api_key:
+            self.api_key = config.get('api_key') or os.getenv('OPENAI_API_KEY')
+            if not self.api_key:
                 raise ValueError("API key do OpenAI nao encontrada no config ou .env")
             
-            self.client = openai.AsyncOpenAI(
-                api_key=api_key
-            )
+            # Cliente compartilhado entre instâncias do agente (pool de conexões do processo)
+            get_provider_clients().client('openai', self.api_key, os.getenv('OPENAI_BASE_URL'))
             self.logger.info("OpenAI client inicializado")
         except ImportError:
             raise ImportError("OpenAI não está instalado. Execute: pip install openai")
@@ -41,94 +131,184 @@ class OpenAIProvider(BaseLLMProvider):
             self.logger.error(f"Erro ao inicializar OpenAI: {str(e)}")
             raise
     
+    @property
+    def client(self):
+        """Cliente AsyncOpenAI do registro de clientes do processo"""
+        return get_provider_clients().client('openai', self.api_key, os.getenv('OPENAI_BASE_URL'))
+    
+    def _build_messages(self, context: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Monta lista de mensagens do chat a partir do contexto
+        
+        A ordem é sempre prompt do sistema → histórico cronológico → mensagem
+        atual, sem campos variáveis (timestamps, ids): turnos seguidos da mesma
+        sessão compartilham um prefixo idêntico, que a OpenAI serve do cache
+        de prompt automaticamente.
+        """
+        # Prepara mensagens para o chat
+        messages = [
+            {"role": "system", "content": context.get('system_prompt', 'Você é um assistente útil.')},
+        ]
+        
+        # Adiciona histórico da conversa
+        conversation_history = context.get('conversation_history', [])
+        if conversation_history:
+            # Se conversation_history é uma lista de dicts (formato novo)
+            if isinstance(conversation_history, list):
+                for msg in conversation_history:
+                    if isinstance(msg, dict):
+                        role = msg.get('role', 'user')
+                        content = msg.get('content', '')
+                        # Mapear role se necessário
+                        if role in ['user', 'assistant', 'system']:
+                            messages.append({"role": role, "content": content})
+            # Se conversation_history é string (formato antigo - fallback)
+            elif isinstance(conversation_history, str):
+                for line in conversation_history.strip().split('\n'):
+                    if line.startswith('Usuário: '):
+                        messages.append({"role": "user", "content": line[9:]})
+                    elif line.startswith('Assistente: '):
+                        messages.append({"role": "assistant", "content": line[12:]})
+        
+        # Prepara mensagem atual do usuário
+        user_input = context.get('user_input', '')
+        image_data = context.get('image_data')
+        
+        if image_data:
+            # Se há imagem, prepara mensagem multimodal
+            # Log para debug do formato da imagem
+            self.logger.info(f"Processando imagem - Tamanho base64: {len(image_data)} caracteres")
+            self.logger.info(f"Primeiros 50 caracteres: {image_data[:50]}...")
+            
+            # Tipo real da imagem (pré-processada ou detectado pelo conteúdo)
+            mime_type = context.get('image_mime_type') or sniff_base64_image_type(image_data)
+            image_url = {"url": f"data:{mime_type};base64,{image_data}"}
+            if context.get('image_detail'):
+                image_url["detail"] = context['image_detail']
+            
+            user_message = {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": user_input},
+                    {
+                        "type": "image_url",
+                        "image_url": image_url
+                    }
+                ]
+            }
+        else:
+            # Mensagem apenas texto
+            user_message = {"role": "user", "content": user_input}
+        
+        messages.append(user_message)
+        
+        return messages
+    
+    def cache_key_payload(self, context: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Requisição renderizada para o cache de respostas"""
+        return {
+            'provider': 'openai',
+            'model': self.model_for(context),
+            'max_tokens': self.config.get('max_tokens', 1000),
+            'temperature': self.config.get('temperature', 0.7),
+            'messages': self._build_messages(context)
+        }
+    
+    def _record_usage(self, usage, call: Dict[str, int]) -> None:
+        """Registra tokens consumidos e tokens de prompt servidos do cache"""
+        if usage is None:
+            return
+        details = getattr(usage, 'prompt_tokens_details', None)
+        record_usage({
+            'prompt_tokens': usage.prompt_tokens or 0,
+            'completion_tokens': usage.completion_tokens or 0,
+            'cached_tokens': (getattr(details, 'cached_tokens', None) or 0) if details else 0
+        }, call=call)
+    
     async def generate_response(self, context: Dict[str, Any]) -> str:
         """Gera resposta usando OpenAI"""
         try:
-            # Prepara mensagens para o chat
-            messages = [
-                {"role": "system", "content": context.get('system_prompt', 'Você é um assistente útil.')},
-            ]
-            
-            # Adiciona histórico da conversa
-            conversation_history = context.get('conversation_history', [])
-            if conversation_history:
-                # Se conversation_history é uma lista de dicts (formato novo)
-                if isinstance(conversation_history, list):
-                    for msg in conversation_history:
-                        if isinstance(msg, dict):
-                            role = msg.get('role', 'user')
-                            content = msg.get('content', '')
-                            # Mapear role se necessário
-                            if role in ['user', 'assistant', 'system']:
-                                messages.append({"role": role, "content": content})
-                # Se conversation_history é string (formato antigo - fallback)
-                elif isinstance(conversation_history, str):
-                    for line in conversation_history.strip().split('\n'):
-                        if line.startswith('Usuário: '):
-                            messages.append({"role": "user", "content": line[9:]})
-                        elif line.startswith('Assistente: '):
-                            messages.append({"role": "assistant", "content": line[12:]})
-            
-            # Prepara mensagem atual do usuário
-            user_input = context.get('user_input', '')
-            image_data = context.get('image_data')
-            
-            if image_data:
-                # Se há imagem, prepara mensagem multimodal
-                # Log para debug do formato da imagem
-                self.logger.info(f"Processando imagem - Tamanho base64: {len(image_data)} caracteres")
-                self.logger.info(f"Primeiros 50 caracteres: {image_data[:50]}...")
-                
-                user_message = {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": user_input},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_data}"
-                            }
-                        }
-                    ]
-                }
-            else:
-                # Mensagem apenas texto
-                user_message = {"role": "user", "content": user_input}
-            
-            messages.append(user_message)
+            messages = self._build_messages(context)
             
             # Chama a API
-            response = await self.client.chat.completions.create(
-                model=self.config.get('llm_model', 'gpt-4o-mini'),
-                messages=messages,
-                max_tokens=self.config.get('max_tokens', 1000),
-                temperature=self.config.get('temperature', 0.7)
-            )
+            async with self.call_slot(context) as (_, call):
+                response = await self.client.chat.completions.create(
+                    model=self.model_for(context),
+                    messages=messages,
+                    max_tokens=self.config.get('max_tokens', 1000),
+                    temperature=self.config.get('temperature', 0.7)
+                )
+                self._record_usage(response.usage, call)
             
             return response.choices[0].message.content
             
         except Exception as e:
             self.logger.error(f"Erro ao gerar resposta OpenAI: {str(e)}")
-            return "Desculpe, ocorreu um erro ao processar sua mensagem."
+            if self.config.get('raise_errors') or context.get('raise_errors'):
+                raise
+            return ERROR_RESPONSE
+    
+    async def stream_response(self, context: Dict[str, Any]) -> AsyncIterator[str]:
+        """Gera resposta em streaming usando OpenAI"""
+        emitted = False
+        try:
+            messages = self._build_messages(context)
+            
+            # Chama a API em modo streaming
+            async with self.call_slot(context, streaming=True) as (limiter, call):
+                call_start = time.perf_counter()
+                stream = await self.client.chat.completions.create(
+                    model=self.model_for(context),
+                    messages=messages,
+                    max_tokens=self.config.get('max_tokens', 1000),
+                    temperature=self.config.get('temperature', 0.7),
+                    stream=True,
+                    stream_options={"include_usage": True}
+                )
+                
+                # async with fecha a resposta HTTP se o consumidor parar antes do fim
+                async with stream:
+                    async for chunk in stream:
+                        # O último chunk não tem choices e traz o uso de tokens
+                        if chunk.usage is not None:
+                            self._record_usage(chunk.usage, call)
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            if not emitted and limiter is not None:
+                                limiter.observe_latency(time.perf_counter() - call_start, 'first_token')
+                            emitted = True
+                            yield delta
+            
+        except Exception as e:
+            self.logger.error(f"Erro ao gerar resposta OpenAI (streaming): {str(e)}")
+            if self.config.get('raise_errors') or context.get('raise_errors'):
+                raise
+            # Só emite mensagem de erro se nada foi enviado ainda
+            if not emitted:
+                yield ERROR_RESPONSE
 
 class AnthropicProvider(BaseLLMProvider):
     """Provedor Anthropic"""
     
+    name = 'anthropic'
+    default_model = 'claude-3-haiku-20240307'
+    
     def __init__(self, config: Dict[str, Any]):
         self.config = config
         self.logger = logging.getLogger(__name__)
         
         # Importa Anthropic
         try:
-            import anthropic
+            import anthropic  # noqa: F401
             # Usar api_key do config (database) ou fallback para .env
-            api_key = config.get('api_key') or os.getenv('ANTHROPIC_API_KEY')
-            if not api_key:
+            self.api_key = config.get('api_key') or os.getenv('ANTHROPIC_API_KEY')
+            if not self.api_key:
                 raise ValueError("API key do Anthropic nao encontrada no config ou .env")
             
-            self.client = anthropic.AsyncAnthropic(
-                api_key=api_key
-            )
+            # Cliente compartilhado entre instâncias do agente (pool de conexões do processo)
+            get_provider_clients().client('anthropic', self.api_key, os.getenv('ANTHROPIC_BASE_URL'))
             self.logger.info("Anthropic client inicializado")
         except ImportError:
             raise ImportError("Anthropic não está instalado. Execute: pip install anthropic")
@@ -136,65 +316,174 @@ class AnthropicProvider(BaseLLMProvider):
             self.logger.error(f"Erro ao inicializar Anthropic: {str(e)}")
             raise
     
+    @property
+    def client(self):
+        """Cliente AsyncAnthropic do registro de clientes do processo"""
+        return get_provider_clients().client('anthropic', self.api_key, os.getenv('ANTHROPIC_BASE_URL'))
+    
+    def _build_request(self, context: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Monta parâmetros da chamada messages.create a partir do contexto
+        
+        O prompt do sistema e o histórico anterior à mensagem atual recebem
+        breakpoints cache_control: enquanto o prefixo não muda, a Anthropic
+        cobra e processa apenas a parte nova do prompt.
+        """
+        # Prepara contexto da conversa
+        system_prompt = context.get('system_prompt', 'Você é um assistente útil.')
+        user_input = context.get('user_input', '')
+        image_data = context.get('image_data')
+        use_cache = self.config.get('prompt_caching', True)
+        
+        system_blocks = [{"type": "text", "text": system_prompt}]
+        if use_cache:
+            system_blocks[0]["cache_control"] = ANTHROPIC_CACHE_CONTROL
+        
+        # Histórico: mensagens 'system' (ex: resumo) vão para o system; a API
+        # exige papéis alternados começando pelo usuário
+        messages = []
+        conversation_history = context.get('conversation_history', [])
+        if isinstance(conversation_history, list):
+            for msg in conversation_history:
+                if not isinstance(msg, dict) or not msg.get('content'):
+                    continue
+                role = msg.get('role', 'user')
+                block = {"type": "text", "text": msg['content']}
+                if role == 'system':
+                    system_blocks.append(block)
+                elif role in ['user', 'assistant']:
+                    if messages and messages[-1]['role'] == role:
+                        messages[-1]['content'].append(block)
+                    elif messages or role == 'user':
+                        messages.append({"role": role, "content": [block]})
+        
+        if messages and use_cache:
+            # Breakpoint no fim do histórico: o próximo turno reaproveita este prefixo
+            messages[-1]['content'][-1]['cache_control'] = ANTHROPIC_CACHE_CONTROL
+        
+        # Prepara conteúdo da mensagem
+        message_content = []
+        
+        # Adiciona texto da mensagem
+        message_content.append({"type": "text", "text": user_input})
+        
+        # Adiciona imagem se disponível
+        if image_data:
+            message_content.append({
+                "type": "image",
+                "source": {
+                    "type": "base64",
+                    "media_type": context.get('image_mime_type') or sniff_base64_image_type(image_data),
+                    "data": image_data
+                }
+            })
+        
+        if messages and messages[-1]['role'] == 'user':
+            # Turno anterior sem resposta registrada
+            messages[-1]['content'].extend(message_content)
+        else:
+            messages.append({"role": "user", "content": message_content})
+        
+        return {
+            'model': self.model_for(context),
+            'max_tokens': self.config.get('max_tokens', 1000),
+            'temperature': self.config.get('temperature', 0.7),
+            'system': system_blocks,
+            'messages': messages
+        }
+    
+    def cache_key_payload(self, context: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Requisição renderizada para o cache de respostas"""
+        return {'provider': 'anthropic', **self._build_request(context)}
+    
+    def _record_usage(self, usage, call: Dict[str, int]) -> None:
+        """Registra tokens consumidos, lidos do cache e gravados no cache"""
+        if usage is None:
+            return
+        cached = getattr(usage, 'cache_read_input_tokens', None) or 0
+        created = getattr(usage, 'cache_creation_input_tokens', None) or 0
+        record_usage({
+            # input_tokens da Anthropic exclui os tokens lidos/gravados no cache
+            'prompt_tokens': (usage.input_tokens or 0) + cached + created,
+            'completion_tokens': usage.output_tokens or 0,
+            'cached_tokens': cached,
+            'cache_creation_tokens': created
+        }, call=call)
+    
     async def generate_response(self, context: Dict[str, Any]) -> str:
         """Gera resposta usando Anthropic"""
         try:
-            # Prepara contexto da conversa
-            system_prompt = context.get('system_prompt', 'Você é um assistente útil.')
-            conversation_history = context.get('conversation_history', '')
-            user_input = context.get('user_input', '')
-            image_data = context.get('image_data')
-            
-            # Prepara conteúdo da mensagem
-            message_content = []
-            
-            # Adiciona texto da mensagem
-            message_content.append({"type": "text", "text": user_input})
-            
-            # Adiciona imagem se disponível
-            if image_data:
-                message_content.append({
-                    "type": "image",
-                    "source": {
-                        "type": "base64",
-                        "media_type": "image/jpeg",
-                        "data": image_data
-                    }
-                })
-            
-            # Constrói o prompt completo para contexto
-            full_prompt = ""
-            if conversation_history:
-                full_prompt += f"Histórico da conversa:\n{conversation_history}\n\n"
-            full_prompt += f"Usuário: {user_input}"
-            
             # Chama a API
-            response = await self.client.messages.create(
-                model=self.config.get('llm_model', 'claude-3-haiku-20240307'),
-                max_tokens=self.config.get('max_tokens', 1000),
-                temperature=self.config.get('temperature', 0.7),
-                system=system_prompt,
-                messages=[
-                    {"role": "user", "content": message_content}
-                ]
-            )
+            async with self.call_slot(context) as (_, call):
+                response = await self.client.messages.create(**self._build_request(context))
+                self._record_usage(response.usage, call)
             
             return response.content[0].text
             
         except Exception as e:
             self.logger.error(f"Erro ao gerar resposta Anthropic: {str(e)}")
-            return "Desculpe, ocorreu um erro ao processar sua mensagem."
+            if self.config.get('raise_errors') or context.get('raise_errors'):
+                raise
+            return ERROR_RESPONSE
+    
+    async def stream_response(self, context: Dict[str, Any]) -> AsyncIterator[str]:
+        """Gera resposta em streaming usando Anthropic"""
+        emitted = False
+        try:
+            # Chama a API em modo streaming
+            async with self.call_slot(context, streaming=True) as (limiter, call):
+                call_start = time.perf_counter()
+                async with self.client.messages.stream(**self._build_request(context)) as stream:
+                    async for delta in stream.text_stream:
+                        if delta:
+                            if not emitted and limiter is not None:
+                                limiter.observe_latency(time.perf_counter() - call_start, 'first_token')
+                            emitted = True
+                            yield delta
+                    
+                    final_message = await stream.get_final_message()
+                    self._record_usage(final_message.usage, call)
+            
+        except Exception as e:
+            self.logger.error(f"Erro ao gerar resposta Anthropic (streaming): {str(e)}")
+            if self.config.get('raise_errors') or context.get('raise_errors'):
+                raise
+            # Só emite mensagem de erro se nada foi enviado ainda
+            if not emitted:
+                yield ERROR_RESPONSE
 
 class LLMProvider:
     """Gerenciador principal de provedores LLM"""
     
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(self, config: Dict[str, Any], response_cache: Optional[ResponseCache] = None,
+                 semantic_cache: Optional[SemanticCache] = None, resilience: Optional[ResilientCaller] = None):
+        """
+        Args:
+            config: Configuração do LLM (provedor, modelo, parâmetros)
+            response_cache: Cache de respostas exatas (None desativa)
+            semantic_cache: Cache de respostas por similaridade (None desativa)
+            resilience: Retentativas e hedging das chamadas (None = tentativa única)
+        """
         self.config = config
         self.logger = logging.getLogger(__name__)
         self.provider = self._initialize_provider()
+        self.response_cache = response_cache
+        self.semantic_cache = semantic_cache
+        self.resilience = resilience or ResilientCaller()
+        if self.provider.fails_over:
+            # Uma camada só repete chamadas: com o roteador, cada falha já vai
+            # para o próximo backend e retentativas/hedge aqui multiplicariam
+            # as chamadas (retentativas x backends) justamente sob sobrecarga
+            self.resilience = ResilientCaller(self.resilience.policy.single_attempt())
     
     def _initialize_provider(self) -> BaseLLMProvider:
         """Inicializa o provedor LLM baseado na configuração"""
+        routing = self.config.get('routing') or {}
+        if routing.get('enabled') and routing.get('backends'):
+            router = self._initialize_router(routing)
+            if router is not None:
+                return router
+        
         provider_type = self.config.get('llm_provider', 'openai')
         
         # Verificar se api_key está presente no config (prioritário) ou no .env (fallback)
@@ -216,9 +505,213 @@ class LLMProvider:
             self.logger.warning(f"Provedor '{provider_type}' não suportado. Usando modo demonstração.")
             return DemoProvider(self.config)
     
+    def _initialize_router(self, routing: Dict[str, Any]) -> Optional[BaseLLMProvider]:
+        """
+        Roteador entre o provedor configurado (primário) e os backends de llm_routing
+        
+        Backends sem API key (config para o provedor primário; senão a variável
+        api_key_env ou <PROVEDOR>_API_KEY) ficam de fora. Com menos de dois
+        backends utilizáveis, retorna None e o provedor único é usado.
+        """
+        from .router import Backend, RoutingProvider, get_backend_health
+        
+        primary = {'provider': self.config.get('llm_provider', 'openai'), 'model': self.config.get('llm_model')}
+        entries = [primary] + [entry for entry in routing.get('backends', []) if isinstance(entry, dict)]
+        breaker = routing.get('breaker', {}) or {}
+        providers = {'openai': OpenAIProvider, 'anthropic': AnthropicProvider}
+        
+        backends = []
+        for entry in entries:
+            provider_type = entry.get('provider')
+            model = entry.get('model')
+            name = f"{provider_type}/{model}"
+            if provider_type not in providers or not model or any(backend.name == name for backend in backends):
+                continue
+            api_key = (self.config.get('api_key') if provider_type == primary['provider'] else None) or \
+                os.getenv(entry.get('api_key_env') or f"{provider_type.upper()}_API_KEY")
+            if not api_key:
+                self.logger.info(f"Backend {name} sem API key; fora do roteamento")
+                continue
+            try:
+                provider = providers[provider_type]({
+                    **self.config, 'llm_provider': provider_type, 'llm_model': model, 'api_key': api_key
+                })
+            except Exception as e:
+                self.logger.warning(f"Backend {name} não inicializado: {str(e)}")
+                continue
+            backends.append(Backend(name, provider, get_backend_health().get(name, **breaker)))
+        
+        if len(backends) < 2:
+            return None
+        self.logger.info(f"Roteamento entre backends LLM: {', '.join(backend.name for backend in backends)}")
+        # YAML lê off/on como booleanos
+        race = routing.get('race', 'off')
+        if isinstance(race, bool) or race is None:
+            race = 'always' if race else 'off'
+        return RoutingProvider(backends, strategy=routing.get('strategy', 'latency'), race=race)
+    
     async def generate_response(self, context: Dict[str, Any]) -> str:
-        """Gera resposta usando o provedor configurado"""
-        return await self.provider.generate_response(context)
+        """
+        Gera resposta usando o provedor configurado
+        
+        Mensagens avulsas parecidas com uma já respondida são servidas do
+        cache semântico; requisições idênticas, do cache de respostas (ou
+        aguardam a chamada idêntica em andamento). Só as demais ocupam o
+        limite global de concorrência.
+        """
+        uses_cache = self.response_cache is not None or self.semantic_cache is not None
+        payload = self.provider.cache_key_payload(context) if uses_cache else None
+        if payload is None:
+            return await self._call_provider(context)
+        
+        scope = self._semantic_scope(context, payload)
+        if scope is not None:
+            hit = await asyncio.to_thread(self.semantic_cache.lookup, context.get('user_input', ''), scope)
+            if hit is not None:
+                self.logger.info(f"Resposta servida do cache semântico (similaridade {hit[1]:.3f})")
+                record_cache_source('semantic')
+                return hit[0]
+        
+        # Erros sobem até aqui para que a mensagem de erro não seja cacheada
+        strict_context = {**context, 'raise_errors': True}
+        try:
+            if self.response_cache is not None:
+                content, source = await self.response_cache.get_or_generate(
+                    ResponseCache.make_key(payload),
+                    lambda: self._call_provider(strict_context),
+                    model=payload.get('model')
+                )
+            else:
+                content, source = await self._call_provider(strict_context), None
+        except Exception:
+            if self.config.get('raise_errors'):
+                raise
+            return ERROR_RESPONSE
+        
+        record_cache_source(source)
+        if scope is not None and source is None:
+            await asyncio.to_thread(
+                self.semantic_cache.store, context.get('user_input', ''), scope, content, payload.get('model')
+            )
+        return content
+    
+    def _semantic_scope(self, context: Dict[str, Any], payload: Dict[str, Any]) -> Optional[str]:
+        """
+        Escopo do cache semântico para a requisição, ou None se não se aplica
+        
+        Só mensagens avulsas entram: com histórico ou imagem a resposta
+        depende de mais do que o texto da mensagem.
+        """
+        if self.semantic_cache is None or context.get('conversation_history') or context.get('image_data'):
+            return None
+        if not context.get('user_input', '').strip():
+            return None
+        return ResponseCache.make_key({
+            'provider': payload.get('provider'),
+            'model': payload.get('model'),
+            'max_tokens': payload.get('max_tokens'),
+            'temperature': payload.get('temperature'),
+            'system_prompt': context.get('system_prompt')
+        })
+    
+    def _latency_key(self, context: Dict[str, Any]) -> str:
+        """Provedor/modelo previsto para a chamada (com roteamento, o primeiro backend da ordem atual)"""
+        return self.provider.latency_key(context)
+    
+    @staticmethod
+    def _served_key(served: Optional[Dict[str, str]]) -> Optional[str]:
+        return f"{served['provider']}/{served['model']}" if served else None
+    
+    async def _attempt(self, context: Dict[str, Any]):
+        """
+        Uma tentativa de chamada (os limites de concorrência ficam em BaseLLMProvider.call_slot)
+        
+        Returns:
+            (resposta, provedor/modelo que atendeu); cada tentativa tem o próprio
+            served_by, então com hedge vale o da tentativa vencedora
+        """
+        served: Dict[str, str] = {}
+        with timed('provider.call'):
+            content = await self.provider.generate_response({**context, 'served_by': served})
+        return content, served or self.provider.served(context)
+    
+    async def _call_provider(self, context: Dict[str, Any]) -> str:
+        """
+        Chama o provedor com retentativas e hedging (response_config)
+        
+        Erros que esgotam as tentativas sobem se raise_errors estiver no
+        contexto ou na configuração; senão viram a mensagem de erro padrão.
+        O provedor/modelo que atendeu vai para context['served_by'], se houver.
+        """
+        strict_context = {**context, 'raise_errors': True}
+        try:
+            content, served = await self.resilience.call(
+                lambda: self._attempt(strict_context),
+                self._latency_key(context),
+                served_key=lambda result: self._served_key(result[1])
+            )
+            if context.get('served_by') is not None:
+                context['served_by'].update(served)
+            return content
+        except Exception as e:
+            if self.config.get('raise_errors') or context.get('raise_errors'):
+                raise
+            self.logger.error(f"Erro ao gerar resposta após retentativas: {str(e)}")
+            return ERROR_RESPONSE
+    
+    async def _stream_attempt(self, context: Dict[str, Any], served_out: Optional[Dict[str, str]]) -> AsyncIterator[str]:
+        """
+        Uma tentativa de streaming (os limites de concorrência ficam em BaseLLMProvider.call_slot)
+        
+        O served_by da tentativa só é copiado para served_out quando o
+        consumidor pede o delta seguinte ao primeiro: a tentativa perdedora
+        de um hedge é fechada antes disso.
+        """
+        call_start = time.perf_counter()
+        first_token = True
+        async for delta in self.provider.stream_response(context):
+            if first_token:
+                record_timing('provider.first_token', (time.perf_counter() - call_start) * 1000)
+            yield delta
+            if first_token:
+                first_token = False
+                if served_out is not None:
+                    served_out.update(context['served_by'] or self.provider.served(context))
+        record_timing('provider.call', (time.perf_counter() - call_start) * 1000)
+    
+    async def stream_response(self, context: Dict[str, Any]) -> AsyncIterator[str]:
+        """
+        Gera resposta em streaming usando o provedor configurado
+        
+        Retentativas e hedging valem até o primeiro delta; uma falha depois
+        dele encerra o stream.
+        """
+        strict_context = {**context, 'raise_errors': True}
+        # Gerador da tentativa -> served_by dela (latência registrada em quem atendeu)
+        attempts: Dict[int, Dict[str, str]] = {}
+        
+        def attempt() -> AsyncIterator[str]:
+            served: Dict[str, str] = {}
+            generator = self._stream_attempt({**strict_context, 'served_by': served}, context.get('served_by'))
+            attempts[id(generator)] = served
+            return generator
+        
+        emitted = False
+        try:
+            async for delta in self.resilience.stream(
+                attempt,
+                self._latency_key(context),
+                served_key=lambda generator: self._served_key(attempts.get(id(generator)) or self.provider.served(context))
+            ):
+                emitted = True
+                yield delta
+        except Exception as e:
+            if self.config.get('raise_errors') or context.get('raise_errors'):
+                raise
+            self.logger.error(f"Erro ao gerar resposta em streaming: {str(e)}")
+            # Só emite mensagem de erro se nada foi enviado ainda
+            if not emitted:
+                yield ERROR_RESPONSE
 
 class DemoProvider(BaseLLMProvider):
     """Provedor de demonstração quando não há API keys"""
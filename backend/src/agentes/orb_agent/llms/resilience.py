@@ -0,0 +1,387 @@
+"""
+Resiliência das chamadas aos provedores LLM
+- Retentativas com backoff exponencial e jitter em erros transitórios
+- Requisições "hedged": uma segunda tentativa é disparada quando a primeira
+  passa do p95 de latência do provedor/modelo; a primeira a concluir vence e
+  a outra é cancelada
+Configurado por response_config no system_prompt.yaml.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, AsyncIterator, Awaitable, Callable, Optional
+
+from ..utils.concurrency import get_llm_limiter, parse_retry_after, _percentile
+from ..utils.metrics import record_timing
+
+# Status HTTP que indicam falha transitória
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+
+# Exceções dos SDKs (OpenAI/Anthropic) e do httpx tratadas como transitórias
+RETRYABLE_ERRORS = {
+    'APIConnectionError', 'APITimeoutError', 'RateLimitError', 'InternalServerError',
+    'OverloadedError', 'ServiceUnavailableError', 'TransportError', 'TimeoutException',
+    'ConnectError', 'ReadError', 'RemoteProtocolError',
+}
+
+
+class ProviderAttemptTimeout(TimeoutError):
+    """Tentativa excedeu attempt_timeout"""
+    pass
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Erro transitório (rede, timeout, 429, 5xx) que vale uma nova tentativa"""
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return any(cls.__name__ in RETRYABLE_ERRORS for cls in type(error).__mro__)
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Segundos pedidos pelo provedor no cabeçalho Retry-After (None se ausente)"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    return parse_retry_after(headers)
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Backoff exponencial com jitter completo: uniforme em [0, min(cap, base * 2^attempt)]"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class ResiliencePolicy:
+    """Política de retentativas e hedging (chaves de response_config)"""
+    
+    def __init__(self, retry_attempts: int = 2, retry_base_delay: float = 0.5, retry_max_delay: float = 8.0,
+                 max_response_time: Optional[float] = None, attempt_timeout: Optional[float] = None,
+                 hedge: bool = False, hedge_percentile: float = 95, hedge_min_delay: float = 1.0,
+                 hedge_min_samples: int = 20):
+        """
+        Args:
+            retry_attempts: Tentativas extras após erro transitório (os clientes do SDK
+                não repetem sozinhos; 2 = o padrão que o SDK usaria)
+            retry_base_delay: Base do backoff exponencial em segundos
+            retry_max_delay: Teto do backoff em segundos
+            max_response_time: Prazo em segundos para iniciar retentativas (None = sem prazo)
+            attempt_timeout: Timeout de cada tentativa em segundos (None = sem timeout)
+            hedge: Dispara segunda tentativa quando a primeira passa do percentil de latência
+            hedge_percentile: Percentil de latência que dispara o hedge
+            hedge_min_delay: Espera mínima antes do hedge em segundos
+            hedge_min_samples: Amostras de latência necessárias antes de fazer hedge
+        """
+        self.retry_attempts = max(0, retry_attempts)
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.max_response_time = max_response_time
+        self.attempt_timeout = attempt_timeout
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+    
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]]) -> 'ResiliencePolicy':
+        """Cria a política a partir de response_config"""
+        config = config or {}
+        
+        def _optional(name: str) -> Optional[float]:
+            value = config.get(name)
+            return float(value) if value else None
+        
+        return cls(
+            retry_attempts=int(config.get('retry_attempts', 2)),
+            retry_base_delay=float(config.get('retry_base_delay', 0.5)),
+            retry_max_delay=float(config.get('retry_max_delay', 8.0)),
+            max_response_time=_optional('max_response_time'),
+            attempt_timeout=_optional('attempt_timeout'),
+            hedge=bool(config.get('hedge', False)),
+            hedge_percentile=float(config.get('hedge_percentile', 95)),
+            hedge_min_delay=float(config.get('hedge_min_delay', 1.0)),
+            hedge_min_samples=int(config.get('hedge_min_samples', 20))
+        )
+    
+    def single_attempt(self) -> 'ResiliencePolicy':
+        """Mesma política sem retentativas nem hedge (prazos e timeout mantidos)"""
+        return ResiliencePolicy(
+            retry_attempts=0,
+            retry_base_delay=self.retry_base_delay,
+            retry_max_delay=self.retry_max_delay,
+            max_response_time=self.max_response_time,
+            attempt_timeout=self.attempt_timeout,
+            hedge=False,
+            hedge_percentile=self.hedge_percentile,
+            hedge_min_delay=self.hedge_min_delay,
+            hedge_min_samples=self.hedge_min_samples
+        )
+
+
+class ProviderLatencyTracker:
+    """Latências recentes de tentativas bem-sucedidas por provedor/modelo (para o limiar do hedge)"""
+    
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, key: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+            samples.append(seconds)
+    
+    def percentile(self, key: str, percentile: float, min_samples: int = 1) -> Optional[float]:
+        """Percentil em segundos, ou None com menos de min_samples amostras"""
+        with self._lock:
+            samples = self._samples.get(key)
+            if not samples or len(samples) < min_samples:
+                return None
+            return _percentile(sorted(samples), percentile)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            snapshot = {key: sorted(samples) for key, samples in self._samples.items()}
+        return {
+            key: {
+                'samples': len(values),
+                'p50_ms': round(_percentile(values, 50) * 1000, 2),
+                'p95_ms': round(_percentile(values, 95) * 1000, 2)
+            }
+            for key, values in snapshot.items()
+        }
+
+
+class ResilienceStats:
+    """Contadores de tentativas do processo"""
+    
+    FIELDS = ('calls', 'attempts', 'retries', 'hedges', 'hedge_wins', 'cancelled', 'successes',
+              'failures', 'timeouts', 'exhausted')
+    
+    def __init__(self):
+        self._counts = {field: 0 for field in self.FIELDS}
+        self._errors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+    
+    def incr(self, field: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counts[field] += amount
+    
+    def error(self, error: BaseException) -> None:
+        name = type(error).__name__
+        status = getattr(error, 'status_code', None)
+        label = f"{name}:{status}" if status is not None else name
+        with self._lock:
+            self._counts['failures'] += 1
+            self._errors[label] = self._errors.get(label, 0) + 1
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._counts, 'errors': dict(self._errors)}
+
+
+class ResilientCaller:
+    """
+    Executa chamadas ao provedor com retentativas e hedging
+    
+    Cada tentativa é criada por uma fábrica (nova corrotina ou gerador a cada
+    chamada). Em streaming, o hedge e as retentativas só valem até o primeiro
+    delta: depois dele a resposta já está sendo entregue ao cliente.
+    """
+    
+    def __init__(self, policy: Optional[ResiliencePolicy] = None):
+        self.policy = policy or ResiliencePolicy()
+        self.logger = logging.getLogger(__name__)
+    
+    def _hedge_delay(self, key: str) -> Optional[float]:
+        """Espera antes do hedge (None = sem hedge)"""
+        if not self.policy.hedge:
+            return None
+        threshold = get_latency_tracker().percentile(key, self.policy.hedge_percentile, self.policy.hedge_min_samples)
+        if threshold is None:
+            return None
+        return max(self.policy.hedge_min_delay, threshold)
+    
+    @staticmethod
+    def _has_capacity() -> bool:
+        """Hedge só com vaga livre no limitador global (não amplifica sobrecarga)"""
+        limiter = get_llm_limiter()
+        return limiter.queue_depth == 0 and limiter.in_flight < limiter.max_concurrency
+    
+    async def _attempt(self, factory: Callable[[], Awaitable[Any]], key: str,
+                       served_key: Optional[Callable[[Any], Optional[str]]] = None) -> Any:
+        """Uma tentativa, medida e com timeout opcional"""
+        stats = get_resilience_stats()
+        stats.incr('attempts')
+        start = time.perf_counter()
+        try:
+            if self.policy.attempt_timeout:
+                try:
+                    async with asyncio.timeout(self.policy.attempt_timeout):
+                        result = await factory()
+                except TimeoutError:
+                    stats.incr('timeouts')
+                    raise ProviderAttemptTimeout(f"Tentativa excedeu {self.policy.attempt_timeout}s")
+            else:
+                result = await factory()
+        except asyncio.CancelledError:
+            stats.incr('cancelled')
+            raise
+        except Exception as e:
+            stats.error(e)
+            raise
+        finally:
+            record_timing('provider.attempt', (time.perf_counter() - start) * 1000)
+        
+        # A latência vai para quem atendeu (ex: backend escolhido pelo roteador)
+        get_latency_tracker().observe((served_key(result) if served_key else None) or key, time.perf_counter() - start)
+        stats.incr('successes')
+        return result
+    
+    async def _race(self, factory: Callable[[], Awaitable[Any]], key: str,
+                    served_key: Optional[Callable[[Any], Optional[str]]] = None) -> Any:
+        """Tentativa com hedge: a primeira a concluir com sucesso vence, a outra é cancelada"""
+        first = asyncio.ensure_future(self._attempt(factory, key, served_key))
+        delay = self._hedge_delay(key)
+        if delay is None:
+            return await first
+        
+        second = None
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+            if done or not self._has_capacity():
+                return await first
+            
+            get_resilience_stats().incr('hedges')
+            record_timing('provider.hedge_delay', delay * 1000)
+            second = asyncio.ensure_future(self._attempt(factory, key, served_key))
+            pending = {first, second}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            get_resilience_stats().incr('hedge_wins')
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in (first, second):
+                if task is not None and not task.done():
+                    task.cancel()
+    
+    def _retry_delay(self, error: Exception, attempt: int, started: float) -> Optional[float]:
+        """Espera até a próxima tentativa, ou None se não deve haver outra"""
+        if attempt >= self.policy.retry_attempts or not is_retryable(error):
+            return None
+        delay = backoff_delay(attempt, self.policy.retry_base_delay, self.policy.retry_max_delay)
+        requested = retry_after(error)
+        if requested is not None:
+            delay = max(delay, min(requested, self.policy.retry_max_delay))
+        if self.policy.max_response_time and time.monotonic() - started + delay > self.policy.max_response_time:
+            return None
+        return delay
+    
+    async def call(self, factory: Callable[[], Awaitable[Any]], key: str,
+                   served_key: Optional[Callable[[Any], Optional[str]]] = None) -> Any:
+        """
+        Executa a chamada com retentativas e hedging
+        
+        Args:
+            factory: Cria a corrotina de uma tentativa
+            key: Provedor/modelo previsto (limiar do hedge)
+            served_key: Chave de quem atendeu, a partir do resultado da tentativa
+                (None = key); é nela que a latência observada é registrada
+        
+        Raises:
+            Exception: erro da última tentativa
+        """
+        stats = get_resilience_stats()
+        stats.incr('calls')
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                return await self._race(factory, key, served_key)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, started)
+                if delay is None:
+                    if attempt:
+                        stats.incr('exhausted')
+                    raise
+                attempt += 1
+                stats.incr('retries')
+                self.logger.warning(
+                    f"Chamada ao provedor falhou ({type(e).__name__}: {e}); "
+                    f"tentativa {attempt + 1}/{self.policy.retry_attempts + 1} em {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
+    
+    async def stream(self, factory: Callable[[], AsyncIterator[str]], key: str,
+                     served_key: Optional[Callable[[AsyncIterator[str]], Optional[str]]] = None) -> AsyncIterator[str]:
+        """
+        Streaming com retentativas e hedging até o primeiro delta
+        
+        A latência observada (e o limiar do hedge) é o tempo até o primeiro
+        delta, sob a chave '<key>:first_token' (ou a de served_key, que
+        recebe o gerador da tentativa).
+        """
+        key = f"{key}:first_token"
+        
+        def opened_key(opened) -> Optional[str]:
+            served = served_key(opened[0]) if served_key else None
+            return f"{served}:first_token" if served else None
+        generators = []
+        
+        async def _open():
+            generator = factory()
+            generators.append(generator)
+            try:
+                return generator, await generator.__anext__()
+            except StopAsyncIteration:
+                return generator, None
+        
+        try:
+            winner, first_delta = await self.call(_open, key, opened_key)
+            if first_delta is None:
+                return
+            yield first_delta
+            async for delta in winner:
+                yield delta
+        finally:
+            # Fecha o vencedor (se o cliente parou de consumir) e os perdedores
+            for generator in generators:
+                try:
+                    await generator.aclose()
+                except Exception:
+                    pass
+
+
+# Instâncias globais (compartilhadas entre instâncias do agente)
+_latency_tracker = None
+_resilience_stats = None
+
+
+def get_latency_tracker() -> ProviderLatencyTracker:
+    """Retorna instância singleton do ProviderLatencyTracker"""
+    global _latency_tracker
+    if _latency_tracker is None:
+        _latency_tracker = ProviderLatencyTracker()
+    return _latency_tracker
+
+
+def get_resilience_stats() -> ResilienceStats:
+    """Retorna instância singleton do ResilienceStats"""
+    global _resilience_stats
+    if _resilience_stats is None:
+        _resilience_stats = ResilienceStats()
+    return _resilience_stats
@@ -0,0 +1,436 @@
+"""
+Roteamento entre vários provedores LLM
+Cada backend (provedor/modelo) tem latência e taxa de erro móveis e um
+circuit breaker; as chamadas vão para o backend mais saudável ou mais
+rápido, com failover para os demais. No modo "race", dois backends são
+chamados ao mesmo tempo e a primeira resposta vence.
+Configurado por llm_routing no system_prompt.yaml.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, AsyncIterator, List, Optional
+
+from .llm_provider import BaseLLMProvider
+
+# Estados do circuit breaker
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class NoHealthyBackendError(RuntimeError):
+    """Todos os backends estão com o circuito aberto"""
+    pass
+
+
+class BackendHealth:
+    """
+    Saúde de um backend: janela de resultados, latência média móvel e circuit breaker
+    
+    O circuito abre após failure_threshold falhas seguidas ou quando a taxa
+    de erro da janela passa de error_rate (com ao menos min_calls chamadas).
+    Aberto, o backend fica fora do roteamento por cooldown segundos
+    (dobrando a cada nova abertura, até max_cooldown); depois uma única
+    chamada de teste (half-open) decide se o circuito fecha.
+    """
+    
+    def __init__(self, name: str, window: int = 20, failure_threshold: int = 5, error_rate: float = 0.5,
+                 min_calls: int = 10, cooldown: float = 30.0, max_cooldown: float = 300.0, alpha: float = 0.2):
+        """
+        Args:
+            name: Identificador do backend (provedor/modelo)
+            window: Resultados recentes considerados na taxa de erro
+            failure_threshold: Falhas seguidas que abrem o circuito
+            error_rate: Taxa de erro da janela que abre o circuito
+            min_calls: Resultados na janela antes de avaliar a taxa de erro
+            cooldown: Segundos com o circuito aberto antes do teste
+            max_cooldown: Teto do cooldown após aberturas seguidas
+            alpha: Peso da amostra nova na latência média móvel (EWMA)
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.alpha = alpha
+        
+        self._results = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.current_cooldown = cooldown
+        self.consecutive_failures = 0
+        self.probe_in_flight = False
+        # Latência média (s): resposta completa / primeiro token em streaming
+        self.latency: Optional[float] = None
+        self.first_token: Optional[float] = None
+        
+        self.calls = 0
+        self.failures = 0
+        self.trips = 0
+        self.race_wins = 0
+        self.in_flight = 0
+    
+    @property
+    def error_rate(self) -> float:
+        return sum(1 for ok in self._results if not ok) / len(self._results) if self._results else 0.0
+    
+    def available(self) -> bool:
+        """Pode receber chamadas (circuito fechado ou pronto para o teste)"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.current_cooldown:
+                self.state = HALF_OPEN
+            return self.state == HALF_OPEN and not self.probe_in_flight
+    
+    def begin(self) -> None:
+        """Marca o início de uma chamada (a primeira em half-open é o teste)"""
+        with self._lock:
+            self.in_flight += 1
+            if self.state == HALF_OPEN:
+                self.probe_in_flight = True
+    
+    def success(self, seconds: float, streaming: bool = False) -> None:
+        """Registra chamada bem-sucedida e sua latência"""
+        with self._lock:
+            self.in_flight -= 1
+            self.calls += 1
+            self._results.append(True)
+            self.consecutive_failures = 0
+            if streaming:
+                self.first_token = seconds if self.first_token is None else \
+                    self.alpha * seconds + (1 - self.alpha) * self.first_token
+            else:
+                self.latency = seconds if self.latency is None else \
+                    self.alpha * seconds + (1 - self.alpha) * self.latency
+            if self.state != CLOSED:
+                self.state = CLOSED
+                self.current_cooldown = self.cooldown
+            self.probe_in_flight = False
+    
+    def failure(self) -> None:
+        """Registra falha e abre o circuito se necessário"""
+        with self._lock:
+            self.in_flight -= 1
+            self.calls += 1
+            self.failures += 1
+            self._results.append(False)
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN:
+                # Teste falhou: reabre com cooldown maior
+                self.current_cooldown = min(self.max_cooldown, self.current_cooldown * 2)
+                self._open()
+            elif self.state == CLOSED and (
+                self.consecutive_failures >= self.failure_threshold
+                or (len(self._results) >= self.min_calls and self.error_rate >= self.error_rate_threshold)
+            ):
+                self._open()
+            self.probe_in_flight = False
+    
+    def won_race(self) -> None:
+        with self._lock:
+            self.race_wins += 1
+    
+    def cancelled(self) -> None:
+        """Chamada cancelada (perdeu a corrida ou cliente desconectou): não conta como resultado"""
+        with self._lock:
+            self.in_flight -= 1
+            self.probe_in_flight = False
+    
+    def _open(self) -> None:
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.trips += 1
+        logging.getLogger(__name__).warning(
+            f"Circuito do backend {self.name} aberto por {self.current_cooldown:.0f}s "
+            f"(falhas seguidas: {self.consecutive_failures}, taxa de erro: {self.error_rate:.0%})"
+        )
+    
+    def score(self, streaming: bool = False) -> Optional[float]:
+        """Custo estimado (latência penalizada pela taxa de erro); None sem amostras"""
+        latency = (self.first_token if streaming else self.latency)
+        if latency is None:
+            latency = self.latency if streaming else self.first_token
+        if latency is None:
+            return None
+        return latency * (1 + 4 * self.error_rate)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'state': self.state,
+                'calls': self.calls,
+                'failures': self.failures,
+                'error_rate': round(self.error_rate, 3),
+                'consecutive_failures': self.consecutive_failures,
+                'trips': self.trips,
+                'race_wins': self.race_wins,
+                'in_flight': self.in_flight,
+                'latency_ms': round(self.latency * 1000, 2) if self.latency is not None else None,
+                'first_token_ms': round(self.first_token * 1000, 2) if self.first_token is not None else None,
+                'cooldown_s': self.current_cooldown if self.state != CLOSED else None
+            }
+
+
+class BackendHealthRegistry:
+    """Saúde dos backends do processo (compartilhada entre instâncias do agente)"""
+    
+    def __init__(self):
+        self._backends: Dict[str, BackendHealth] = {}
+        self._lock = threading.Lock()
+    
+    def get(self, name: str, **options) -> BackendHealth:
+        """Saúde do backend (criada com options na primeira vez)"""
+        with self._lock:
+            health = self._backends.get(name)
+            if health is None:
+                health = self._backends[name] = BackendHealth(name, **options)
+            return health
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            backends = dict(self._backends)
+        return {name: health.get_stats() for name, health in backends.items()}
+
+
+class Backend:
+    """Um provedor/modelo roteável"""
+    
+    __slots__ = ('name', 'provider', 'health')
+    
+    def __init__(self, name: str, provider, health: BackendHealth):
+        self.name = name
+        self.provider = provider
+        self.health = health
+
+
+class RoutingProvider(BaseLLMProvider):
+    """
+    Provedor que distribui as chamadas entre vários backends
+    
+    Estratégias:
+        - latency: menor latência média penalizada pela taxa de erro
+          (backends ainda sem amostras são experimentados primeiro)
+        - priority: ordem da configuração (primário e, em falha, os seguintes)
+    
+    Uma chamada que falha é repetida no próximo backend disponível antes de
+    o erro subir; em streaming, só enquanto nenhum delta foi emitido. Esse
+    failover substitui as retentativas e o hedge do ResilientCaller (o
+    equivalente do hedge aqui é o modo race).
+    """
+    
+    fails_over = True
+    
+    def __init__(self, backends: List[Backend], strategy: str = 'latency', race: str = 'off'):
+        """
+        Args:
+            backends: Backends na ordem de prioridade (o primeiro é o primário)
+            strategy: 'latency' ou 'priority'
+            race: 'off', 'stream' (só streaming) ou 'always'; o contexto pode pedir com latency_critical
+        """
+        self.backends = backends
+        self.strategy = strategy
+        self.race = race
+        self.logger = logging.getLogger(__name__)
+        # Configuração do primário (chave do cache, parâmetros)
+        self.config = backends[0].provider.config
+    
+    def cache_key_payload(self, context: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Requisição renderizada para o primário (respostas de qualquer backend valem para ela)"""
+        return self.backends[0].provider.cache_key_payload(context)
+    
+    def served(self, context: Dict[str, Any]) -> Dict[str, str]:
+        """Backend previsto para a chamada (o primeiro da ordem atual)"""
+        ranked = self._ranked()
+        backend = ranked[0] if ranked else self.backends[0]
+        return {**backend.provider.served(context), 'backend': backend.name}
+    
+    def _mark_served(self, context: Dict[str, Any], backend: Backend) -> None:
+        """Registra em context['served_by'] o backend que atendeu a chamada"""
+        target = context.get('served_by')
+        if target is not None:
+            target.update(backend.provider.served(context), backend=backend.name)
+        if backend is not self.backends[0]:
+            self.logger.info(f"Resposta servida pelo backend {backend.name}")
+    
+    def _ranked(self, streaming: bool = False) -> List[Backend]:
+        """Backends disponíveis na ordem de preferência"""
+        available = [backend for backend in self.backends if backend.health.available()]
+        if self.strategy != 'latency':
+            return available
+        untried = [backend for backend in available if backend.health.score(streaming) is None]
+        scored = sorted(
+            (backend for backend in available if backend.health.score(streaming) is not None),
+            key=lambda backend: backend.health.score(streaming)
+        )
+        return untried + scored
+    
+    def _should_race(self, context: Dict[str, Any], streaming: bool) -> bool:
+        if context.get('latency_critical'):
+            return True
+        return self.race == 'always' or (self.race == 'stream' and streaming)
+    
+    async def _call(self, backend: Backend, context: Dict[str, Any]) -> str:
+        """Chamada a um backend, registrando o resultado na saúde dele"""
+        backend.health.begin()
+        start = time.perf_counter()
+        try:
+            result = await backend.provider.generate_response(context)
+        except asyncio.CancelledError:
+            backend.health.cancelled()
+            raise
+        except Exception:
+            backend.health.failure()
+            raise
+        backend.health.success(time.perf_counter() - start)
+        return result
+    
+    async def generate_response(self, context: Dict[str, Any]) -> str:
+        """Gera resposta no melhor backend disponível, com failover (ou corrida)"""
+        strict_context = {**context, 'raise_errors': True}
+        ranked = self._ranked()
+        if not ranked:
+            raise NoHealthyBackendError("Nenhum backend LLM disponível (circuitos abertos)")
+        
+        if len(ranked) > 1 and self._should_race(context, False):
+            try:
+                result, backend = await self._race({
+                    asyncio.ensure_future(self._call(backend, strict_context)): backend for backend in ranked[:2]
+                })
+                self._mark_served(context, backend)
+                return result
+            except Exception as e:
+                ranked = ranked[2:]
+                if not ranked:
+                    raise
+                self.logger.warning(f"Corrida entre backends falhou ({str(e)}); tentando os demais")
+        
+        error = None
+        for backend in ranked:
+            try:
+                result = await self._call(backend, strict_context)
+                self._mark_served(context, backend)
+                return result
+            except Exception as e:
+                error = e
+                self.logger.warning(f"Backend {backend.name} falhou ({type(e).__name__}: {str(e)})")
+        raise error
+    
+    async def _race(self, calls: Dict[asyncio.Future, Backend], discard=None):
+        """
+        Aguarda as chamadas em paralelo: o primeiro sucesso vence e as demais são canceladas
+        
+        Args:
+            calls: Tarefa -> backend
+            discard: Corrotina que descarta o resultado de um segundo vencedor simultâneo
+        
+        Returns:
+            (resultado do vencedor, backend vencedor)
+        """
+        pending = set(calls)
+        winner = None
+        error = None
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif winner is None:
+                        winner = task
+                    elif discard is not None:
+                        await discard(task.result())
+        finally:
+            for task in pending:
+                task.cancel()
+        if winner is None:
+            raise error
+        calls[winner].health.won_race()
+        return winner.result(), calls[winner]
+    
+    async def _open_stream(self, backend: Backend, context: Dict[str, Any]):
+        """Abre o stream de um backend e aguarda o primeiro delta"""
+        backend.health.begin()
+        start = time.perf_counter()
+        stream = backend.provider.stream_response(context)
+        try:
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            first = None
+        except asyncio.CancelledError:
+            backend.health.cancelled()
+            await stream.aclose()
+            raise
+        except Exception:
+            backend.health.failure()
+            raise
+        backend.health.success(time.perf_counter() - start, streaming=True)
+        return backend, stream, first
+    
+    async def stream_response(self, context: Dict[str, Any]) -> AsyncIterator[str]:
+        """Streaming no melhor backend disponível; failover/corrida até o primeiro delta"""
+        strict_context = {**context, 'raise_errors': True}
+        ranked = self._ranked(streaming=True)
+        if not ranked:
+            raise NoHealthyBackendError("Nenhum backend LLM disponível (circuitos abertos)")
+        
+        opened = None
+        if len(ranked) > 1 and self._should_race(context, True):
+            try:
+                opened, _ = await self._race({
+                    asyncio.ensure_future(self._open_stream(backend, strict_context)): backend for backend in ranked[:2]
+                }, discard=lambda extra: extra[1].aclose())
+            except Exception as e:
+                ranked = ranked[2:]
+                if not ranked:
+                    raise
+                self.logger.warning(f"Corrida entre backends falhou ({str(e)}); tentando os demais")
+        
+        if opened is None:
+            error = None
+            for backend in ranked:
+                try:
+                    opened = await self._open_stream(backend, strict_context)
+                    break
+                except Exception as e:
+                    error = e
+                    self.logger.warning(f"Backend {backend.name} falhou no streaming ({type(e).__name__}: {str(e)})")
+            if opened is None:
+                raise error
+        
+        backend, stream, first = opened
+        self._mark_served(context, backend)
+        try:
+            if first is None:
+                return
+            yield first
+            async for delta in stream:
+                yield delta
+        finally:
+            await stream.aclose()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Estratégia e saúde dos backends deste roteador"""
+        return {
+            'strategy': self.strategy,
+            'race': self.race,
+            'backends': {backend.name: backend.health.get_stats() for backend in self.backends}
+        }
+
+
+# Instância global (compartilhada entre instâncias do agente)
+_backend_health = None
+
+
+def get_backend_health() -> BackendHealthRegistry:
+    """Retorna instância singleton do BackendHealthRegistry"""
+    global _backend_health
+    if _backend_health is None:
+        _backend_health = BackendHealthRegistry()
+    return _backend_health
@@ -0,0 +1 @@
+# ORB Agent Memory Package
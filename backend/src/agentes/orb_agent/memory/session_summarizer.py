@@ -0,0 +1,225 @@
+"""
+Resumo incremental de sessões para o Agente ORB
+Mensagens que saem da janela de contexto são condensadas em um resumo por
+sessão, atualizado em background com um modelo mais barato
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import time
+import yaml
+from typing import Dict, Any, Optional, Set
+
+from ..llms.llm_provider import LLMProvider, DemoProvider
+
+
+class SessionSummarizer:
+    """
+    Mantém um resumo incremental por sessão
+    
+    A cada turno o agente informa quantas mensagens ficaram fora da janela
+    de contexto; quando há mensagens suficientes ainda não resumidas, uma
+    tarefa em background incorpora essas mensagens ao resumo anterior e
+    grava o resultado em session_summaries. As atualizações são limitadas
+    por sessão (intervalo mínimo) e globalmente (concorrência).
+    """
+    
+    def __init__(self, chat_memory, context_cache, base_config: Dict[str, Any], prompt_config_path: Optional[str] = None):
+        """
+        Args:
+            chat_memory: ChatMemoryManager usado para ler mensagens e gravar resumos
+            context_cache: SessionContextCache atualizado com o novo resumo
+            base_config: Configuração base do LLM (api_key, provider)
+            prompt_config_path: Caminho para summarizer.yaml
+        """
+        self.chat_memory = chat_memory
+        self.context_cache = context_cache
+        self.base_config = base_config
+        self.logger = logging.getLogger(__name__)
+        
+        if prompt_config_path is None:
+            prompt_config_path = os.path.join(os.path.dirname(__file__), "..", "prompts", "summarizer.yaml")
+        self.prompt_config = self._load_prompt_config(prompt_config_path)
+        
+        refresh = self.prompt_config.get('refresh', {}) or {}
+        self.min_new_messages = int(refresh.get('min_new_messages', 6))
+        self.max_messages_per_refresh = int(refresh.get('max_messages_per_refresh', 40))
+        self.min_interval = float(refresh.get('min_interval_seconds', 60))
+        self.max_concurrent = int(refresh.get('max_concurrent', 1))
+        
+        self._llm_provider = None
+        self._semaphore = None
+        self._running: Set[str] = set()
+        self._last_refresh: Dict[str, float] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        
+        self.refreshes = 0
+        self.failures = 0
+        self.skipped_rate_limited = 0
+    
+    def _load_prompt_config(self, config_path: str) -> Dict[str, Any]:
+        """Carrega configuração do resumo do arquivo YAML"""
+        try:
+            if os.path.exists(config_path):
+                with open(config_path, 'r', encoding='utf-8') as file:
+                    return yaml.safe_load(file) or {}
+            self.logger.warning(f"Arquivo de configuração não encontrado: {config_path}")
+        except Exception as e:
+            self.logger.error(f"Erro ao carregar configuração do resumo: {str(e)}")
+        return {}
+    
+    @property
+    def llm_provider(self) -> LLMProvider:
+        """Lazy loading do LLM de resumo"""
+        if self._llm_provider is None:
+            llm_config = self.prompt_config.get('llm_config', {}) or {}
+            provider = llm_config.get('provider', self.base_config.get('llm_provider', 'openai'))
+            config = {
+                **self.base_config,
+                'llm_provider': provider,
+                'llm_model': llm_config.get('model', 'gpt-4o-mini'),
+                'max_tokens': int(llm_config.get('max_tokens', 400)),
+                'temperature': float(llm_config.get('temperature', 0.2)),
+                'raise_errors': True
+            }
+            # A API key do agente só vale para o mesmo provedor
+            if provider != self.base_config.get('llm_provider'):
+                config.pop('api_key', None)
+            self._llm_provider = LLMProvider(config)
+        return self._llm_provider
+    
+    @property
+    def enabled(self) -> bool:
+        """Resumo só roda com banco disponível e um provedor real"""
+        if self.chat_memory is None:
+            return False
+        try:
+            return not isinstance(self.llm_provider.provider, DemoProvider)
+        except Exception as e:
+            self.logger.warning(f"Resumo de sessões desabilitado: {e}")
+            self.chat_memory = None
+            return False
+    
+    def schedule(self, session_id: str, live_messages: int) -> bool:
+        """
+        Agenda atualização do resumo se houver mensagens fora da janela
+        
+        Args:
+            session_id: ID da sessão
+            live_messages: Mensagens do histórico enviadas na janela atual
+        
+        Returns:
+            True se uma atualização foi agendada
+        """
+        if not self.enabled or session_id in self._running:
+            return False
+        
+        if len(self._last_refresh) > 4096:
+            # Descarta sessões cujo intervalo mínimo já passou
+            now = time.monotonic()
+            self._last_refresh = {
+                sid: ts for sid, ts in self._last_refresh.items() if now - ts < self.min_interval
+            }
+        
+        last = self._last_refresh.get(session_id)
+        if last is not None and time.monotonic() - last < self.min_interval:
+            self.skipped_rate_limited += 1
+            return False
+        
+        self._running.add(session_id)
+        # Contexto próprio: tempos do resumo não entram nas métricas da requisição
+        task = asyncio.get_running_loop().create_task(
+            self._refresh(session_id, live_messages),
+            context=contextvars.Context()
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+    
+    async def _refresh(self, session_id: str, live_messages: int):
+        """Incorpora ao resumo as mensagens que saíram da janela"""
+        try:
+            if self._semaphore is None:
+                self._semaphore = asyncio.Semaphore(self.max_concurrent)
+            
+            async with self._semaphore:
+                current = self.chat_memory.get_session_summary(session_id)
+                covered = current['covered_messages'] if current else 0
+                
+                # Mensagens pendentes na fila são as mais novas; o intervalo
+                # fora da janela fica sempre dentro do que já está gravado
+                aged_out = self.chat_memory.count_messages(session_id) - live_messages
+                if aged_out - covered < self.min_new_messages:
+                    return
+                
+                end = min(aged_out, covered + self.max_messages_per_refresh)
+                messages = self.chat_memory.get_messages_range(session_id, covered, end - covered)
+                if not messages:
+                    return
+                
+                prompt = self._build_prompt(current['summary'] if current else '', messages)
+                summary = (await self.llm_provider.generate_response({
+                    'system_prompt': 'Você resume conversas de forma fiel e concisa.',
+                    'user_input': prompt,
+                    'conversation_history': []
+                })).strip()
+                if not summary:
+                    return
+                
+                covered += len(messages)
+                self.chat_memory.save_session_summary(session_id, summary, covered)
+                self.context_cache.set_summary(session_id, {'summary': summary, 'covered_messages': covered})
+                
+                self._last_refresh[session_id] = time.monotonic()
+                self.refreshes += 1
+                self.logger.info(f"Resumo da sessao {session_id} atualizado: {covered} mensagens cobertas")
+        
+        except Exception as e:
+            self.failures += 1
+            self._last_refresh[session_id] = time.monotonic()
+            self.logger.warning(f"Erro ao atualizar resumo da sessao {session_id}: {e}")
+        finally:
+            self._running.discard(session_id)
+    
+    def _build_prompt(self, previous_summary: str, messages) -> str:
+        """Monta prompt de resumo incremental"""
+        template = self.prompt_config.get('summary_prompt') or (
+            "Resumo atual:\n{previous_summary}\n\nNovas mensagens:\n{new_messages}\n\nResumo atualizado:"
+        )
+        transcript = "\n".join(
+            f"{'Usuário' if msg.role == 'user' else 'Assistente'}: {msg.content}"
+            for msg in messages
+        )
+        return template.format(
+            previous_summary=previous_summary or "(nenhum)",
+            new_messages=transcript
+        )
+    
+    async def wait_idle(self, timeout: Optional[float] = None):
+        """Aguarda as atualizações em andamento (usar no shutdown)"""
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Retorna métricas do resumo"""
+        return {
+            'enabled': self.chat_memory is not None,
+            'running': len(self._running),
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+            'skipped_rate_limited': self.skipped_rate_limited
+        }
+
+
+# Instância global (compartilhada entre instâncias do agente)
+_session_summarizer = None
+
+
+def get_session_summarizer(chat_memory, context_cache, base_config: Dict[str, Any]) -> SessionSummarizer:
+    """Retorna instância singleton do SessionSummarizer"""
+    global _session_summarizer
+    if _session_summarizer is None:
+        _session_summarizer = SessionSummarizer(chat_memory, context_cache, base_config)
+    return _session_summarizer
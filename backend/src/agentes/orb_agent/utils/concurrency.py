@@ -0,0 +1,510 @@
+"""
+Controle de concorrência do Agente ORB
+- Locks por sessão: turnos da mesma conversa são processados em ordem (FIFO)
+- Limitador global de chamadas ao LLM: semáforo + fila com métricas
+- Limitadores adaptativos (AIMD) por provedor/modelo, guiados por 429,
+  cabeçalhos de rate limit e latência
+"""
+
+import asyncio
+import os
+import re
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Any, AsyncIterator, List, Mapping, Optional
+
+
+class LLMQueueFullError(RuntimeError):
+    """Fila de chamadas ao LLM cheia ou tempo de espera excedido"""
+    pass
+
+
+def _percentile(sorted_values: List[float], percentile: float) -> float:
+    """Percentil por nearest-rank de uma lista já ordenada"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(percentile / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class SessionLockRegistry:
+    """
+    Locks assíncronos por sessão
+    
+    asyncio.Lock atende os waiters em ordem de chegada, então turnos da mesma
+    sessão são processados na ordem em que chegaram, enquanto sessões
+    diferentes seguem em paralelo. Locks sem uso são descartados.
+    """
+    
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._users: Dict[str, int] = {}
+    
+    @asynccontextmanager
+    async def hold(self, session_id: str) -> AsyncIterator[None]:
+        """Mantém o lock da sessão durante o bloco"""
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[session_id] = lock
+        self._users[session_id] = self._users.get(session_id, 0) + 1
+        
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[session_id] -= 1
+            if self._users[session_id] == 0:
+                del self._users[session_id]
+                del self._locks[session_id]
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Retorna métricas dos locks"""
+        locked = sum(1 for lock in self._locks.values() if lock.locked())
+        return {
+            'active_sessions': locked,
+            'waiting_turns': sum(self._users.values()) - locked
+        }
+
+
+class LLMConcurrencyLimiter:
+    """
+    Limitador global de chamadas simultâneas ao LLM
+    
+    Chamadas acima de max_concurrency aguardam numa fila de até max_queue
+    posições; acima disso (ou após queue_timeout segundos) falham com
+    LLMQueueFullError em vez de gerar rajadas de 429 no provedor.
+    """
+    
+    def __init__(self, max_concurrency: int = 8, max_queue: int = 100, queue_timeout: float = 30.0, window: int = 1000):
+        """
+        Args:
+            max_concurrency: Chamadas simultâneas permitidas
+            max_queue: Chamadas aguardando na fila (0 = ilimitado)
+            queue_timeout: Tempo máximo de espera na fila em segundos (0 = sem limite)
+            window: Quantidade de tempos de espera mantidos para percentis
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._waits = deque(maxlen=window)
+        
+        self.in_flight = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+    
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Reserva uma vaga de chamada ao LLM durante o bloco"""
+        if self.max_queue and self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            raise LLMQueueFullError(f"Fila de chamadas ao LLM cheia ({self.queue_depth} aguardando)")
+        
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        start = time.monotonic()
+        try:
+            async with asyncio.timeout(self.queue_timeout or None):
+                await self._semaphore.acquire()
+        except TimeoutError:
+            self.timeouts += 1
+            raise LLMQueueFullError(f"Tempo de espera na fila do LLM excedido ({self.queue_timeout}s)")
+        finally:
+            self.queue_depth -= 1
+        
+        self._waits.append(time.monotonic() - start)
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._semaphore.release()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Retorna métricas do limitador (tempos de espera em ms)"""
+        waits = sorted(self._waits)
+        return {
+            'max_concurrency': self.max_concurrency,
+            'max_queue': self.max_queue,
+            'in_flight': self.in_flight,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'timeouts': self.timeouts,
+            'wait_ms': {
+                'avg': round(sum(waits) / len(waits) * 1000, 2) if waits else 0.0,
+                'p50': round(_percentile(waits, 50) * 1000, 2),
+                'p95': round(_percentile(waits, 95) * 1000, 2),
+                'max': round(waits[-1] * 1000, 2) if waits else 0.0
+            }
+        }
+
+
+# Status que indicam sobrecarga/limite do provedor (429; 529 = Anthropic overloaded)
+OVERLOAD_STATUS = {429, 529}
+
+# Marca (em response.extensions) de 429/529 já repassado ao limitador pelo hook HTTP
+OVERLOAD_OBSERVED = 'orb_overload_observed'
+
+# Concorrência sem o ajuste adaptativo: limite global padrão e ponto de
+# partida dos limitadores por provedor/modelo
+DEFAULT_LLM_CONCURRENCY = 8
+
+# Teto padrão dos limitadores adaptativos (com eles ativos, também o limite global padrão)
+DEFAULT_ADAPTIVE_MAX = 32
+
+# Cabeçalhos de rate limit (OpenAI / Anthropic): requisições restantes, limite e reset
+RATE_LIMIT_REMAINING = ('x-ratelimit-remaining-requests', 'anthropic-ratelimit-requests-remaining')
+RATE_LIMIT_RESET = ('x-ratelimit-reset-requests', 'anthropic-ratelimit-requests-reset')
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+# Limitador adaptativo da chamada em andamento (lido pelos hooks do cliente HTTP)
+_current_adaptive_limiter: ContextVar[Optional["AdaptiveLimiter"]] = ContextVar("orb_adaptive_limiter", default=None)
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """Segundos pedidos em retry-after-ms / retry-after (None se ausente ou data)"""
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """
+    Segundos até o reset do rate limit
+    
+    Aceita duração da OpenAI ('1s', '6m0s', '120ms') ou data RFC 3339 da Anthropic.
+    """
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value)
+    if parts and ''.join(number + unit for number, unit in parts) == value.strip():
+        return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+    try:
+        reset = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if reset.tzinfo is None:
+        reset = reset.replace(tzinfo=timezone.utc)
+    return max(0.0, (reset - datetime.now(timezone.utc)).total_seconds())
+
+
+class AdaptiveLimiter:
+    """
+    Limite de concorrência AIMD de um provedor/modelo
+    
+    Enquanto a latência fica perto da linha de base e o limite está sendo
+    usado, o limite cresce ~1 a cada "limite" chamadas bem-sucedidas
+    (aumento aditivo). Um 429/529 corta o limite por backoff e, com
+    Retry-After (ou requisições restantes = 0 até o reset), pausa novas
+    chamadas; latência acima de latency_tolerance vezes a linha de base
+    corta por latency_backoff. Chamadas acima do limite aguardam em fila
+    FIFO em vez de falhar.
+    """
+    
+    def __init__(self, name: str, initial: float = 4, min_limit: float = 1, max_limit: float = 32,
+                 backoff: float = 0.5, latency_backoff: float = 0.9, latency_tolerance: float = 2.0,
+                 decrease_cooldown: float = 1.0, queue_timeout: float = 0.0):
+        """
+        Args:
+            name: Provedor/modelo
+            initial: Limite inicial de chamadas simultâneas
+            min_limit: Limite mínimo
+            max_limit: Limite máximo
+            backoff: Fator de corte em 429/529
+            latency_backoff: Fator de corte quando a latência sobe
+            latency_tolerance: Razão latência recente / linha de base considerada degradada
+            decrease_cooldown: Segundos mínimos entre cortes (uma rajada de 429 corta uma vez)
+            queue_timeout: Espera máxima na fila em segundos (0 = sem limite)
+        """
+        self.name = name
+        self.limit = float(max(min_limit, min(max_limit, initial)))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_backoff = latency_backoff
+        self.latency_tolerance = latency_tolerance
+        self.decrease_cooldown = decrease_cooldown
+        self.queue_timeout = queue_timeout
+        
+        self.in_flight = 0
+        self._waiters: deque = deque()
+        self.paused_until = 0.0
+        self._wake_handle = None
+        self._last_decrease = 0.0
+        # Latência (s) por tipo ('call' ou 'first_token'): média recente e linha de base lenta
+        self._recent: Dict[str, float] = {}
+        self._baseline: Dict[str, float] = {}
+        
+        self.completed = 0
+        self.queued = 0
+        self.max_queue_depth = 0
+        self.overloads = 0
+        self.latency_decreases = 0
+        self.timeouts = 0
+    
+    def _capacity(self) -> int:
+        return max(1, int(self.limit))
+    
+    def _paused(self) -> bool:
+        return time.monotonic() < self.paused_until
+    
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator["AdaptiveLimiter"]:
+        """Reserva uma vaga (aguardando na fila se o limite estiver ocupado)"""
+        if self.in_flight < self._capacity() and not self._waiters and not self._paused():
+            self.in_flight += 1
+        else:
+            await self._wait()
+        
+        token = _current_adaptive_limiter.set(self)
+        try:
+            yield self
+        finally:
+            try:
+                _current_adaptive_limiter.reset(token)
+            except ValueError:
+                # Gerador assíncrono finalizado em outro contexto
+                _current_adaptive_limiter.set(None)
+            self.in_flight -= 1
+            self.completed += 1
+            self._wake()
+    
+    async def _wait(self) -> None:
+        """Entra na fila; a vaga é repassada por _wake"""
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        self.max_queue_depth = max(self.max_queue_depth, len(self._waiters))
+        self._wake()
+        try:
+            async with asyncio.timeout(self.queue_timeout or None):
+                await waiter
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # A vaga chegou junto com o cancelamento/timeout: devolve
+                self.in_flight -= 1
+                self._wake()
+            else:
+                waiter.cancel()
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, TimeoutError):
+                self.timeouts += 1
+                raise LLMQueueFullError(f"Tempo de espera na fila de {self.name} excedido ({self.queue_timeout}s)")
+            raise
+    
+    def _wake(self) -> None:
+        """Repassa vagas livres aos primeiros da fila (ou agenda para o fim da pausa)"""
+        if self._paused():
+            if self._waiters and self._wake_handle is None:
+                delay = self.paused_until - time.monotonic()
+                self._wake_handle = asyncio.get_running_loop().call_later(delay, self._resume)
+            return
+        while self._waiters and self.in_flight < self._capacity():
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(None)
+    
+    def _resume(self) -> None:
+        self._wake_handle = None
+        self._wake()
+    
+    def _decrease(self, factor: float) -> bool:
+        """Corte multiplicativo (no máximo um por decrease_cooldown)"""
+        now = time.monotonic()
+        if now - self._last_decrease < self.decrease_cooldown:
+            return False
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * factor)
+        return True
+    
+    def pause(self, seconds: float) -> None:
+        """Suspende novas chamadas por alguns segundos (Retry-After / reset do rate limit)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+    
+    def on_overload(self, retry_after: Optional[float] = None) -> None:
+        """Provedor respondeu 429/529: corta o limite e respeita o Retry-After"""
+        self.overloads += 1
+        self._decrease(self.backoff)
+        if retry_after:
+            self.pause(retry_after)
+    
+    def observe_response(self, status: int, headers: Mapping[str, str]) -> None:
+        """Sinais da resposta HTTP: status de sobrecarga e cabeçalhos de rate limit"""
+        if status in OVERLOAD_STATUS:
+            self.on_overload(parse_retry_after(headers))
+            return
+        remaining = next((headers.get(name) for name in RATE_LIMIT_REMAINING if headers.get(name)), None)
+        if remaining is None:
+            return
+        try:
+            remaining = int(float(remaining))
+        except ValueError:
+            return
+        if remaining <= 0:
+            reset = parse_reset(next((headers.get(name) for name in RATE_LIMIT_RESET if headers.get(name)), None))
+            if reset:
+                self.pause(reset)
+        elif remaining < self.limit:
+            # Não dispara mais chamadas do que a janela do provedor ainda comporta
+            self.limit = max(self.min_limit, float(remaining))
+    
+    def observe_latency(self, seconds: float, kind: str = 'call') -> None:
+        """
+        Chamada bem-sucedida: aumento aditivo com latência saudável, corte
+        quando a média recente passa de latency_tolerance vezes a linha de base
+        """
+        recent = self._recent.get(kind)
+        baseline = self._baseline.get(kind)
+        recent = seconds if recent is None else 0.3 * seconds + 0.7 * recent
+        baseline = seconds if baseline is None else 0.02 * seconds + 0.98 * baseline
+        self._recent[kind] = recent
+        self._baseline[kind] = baseline
+        
+        if recent > baseline * self.latency_tolerance:
+            if self._decrease(self.latency_backoff):
+                self.latency_decreases += 1
+        elif self.in_flight + len(self._waiters) >= self._capacity():
+            # Limite em uso: vale sondar mais concorrência
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._wake()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Retorna métricas do limitador (latências em ms)"""
+        return {
+            'limit': round(self.limit, 2),
+            'in_flight': self.in_flight,
+            'queue_depth': len(self._waiters),
+            'max_queue_depth': self.max_queue_depth,
+            'paused_s': round(max(0.0, self.paused_until - time.monotonic()), 2),
+            'completed': self.completed,
+            'queued': self.queued,
+            'overloads': self.overloads,
+            'latency_decreases': self.latency_decreases,
+            'timeouts': self.timeouts,
+            'latency_ms': {
+                kind: {'recent': round(self._recent[kind] * 1000, 2), 'baseline': round(self._baseline[kind] * 1000, 2)}
+                for kind in self._recent
+            }
+        }
+
+
+class AdaptiveLimiterRegistry:
+    """Limitadores adaptativos por provedor/modelo"""
+    
+    def __init__(self, enabled: bool = True, **options):
+        """
+        Args:
+            enabled: Desativado, slot() não limita (só o limitador global vale)
+            options: Parâmetros de AdaptiveLimiter
+        """
+        self.enabled = enabled
+        self.options = options
+        self._limiters: Dict[str, AdaptiveLimiter] = {}
+    
+    def get(self, name: str) -> AdaptiveLimiter:
+        limiter = self._limiters.get(name)
+        if limiter is None:
+            limiter = self._limiters[name] = AdaptiveLimiter(name, **self.options)
+        return limiter
+    
+    @asynccontextmanager
+    async def slot(self, name: str) -> AsyncIterator[Optional[AdaptiveLimiter]]:
+        """Vaga no limitador do provedor/modelo (None se desativado)"""
+        if not self.enabled:
+            yield None
+            return
+        async with self.get(name).slot() as limiter:
+            yield limiter
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {name: limiter.get_stats() for name, limiter in self._limiters.items()}
+
+
+def current_adaptive_limiter() -> Optional[AdaptiveLimiter]:
+    """Limitador adaptativo da chamada em andamento (None fora de uma chamada)"""
+    return _current_adaptive_limiter.get()
+
+
+# Instâncias globais (compartilhadas entre instâncias do agente)
+_session_locks = None
+_llm_limiter = None
+_adaptive_limiters = None
+
+
+def get_session_locks() -> SessionLockRegistry:
+    """Retorna instância singleton do SessionLockRegistry"""
+    global _session_locks
+    if _session_locks is None:
+        _session_locks = SessionLockRegistry()
+    return _session_locks
+
+
+def _adaptive_enabled() -> bool:
+    return os.getenv('LLM_ADAPTIVE_CONCURRENCY', 'true').lower() == 'true'
+
+
+def _llm_max_concurrency() -> int:
+    """
+    Limite global de chamadas simultâneas
+    
+    Com os limitadores adaptativos ativos, o padrão é o teto deles
+    (LLM_ADAPTIVE_MAX): o aumento aditivo precisa de vagas globais acima do
+    ponto de partida para ter efeito.
+    """
+    default = os.getenv('LLM_ADAPTIVE_MAX', DEFAULT_ADAPTIVE_MAX) if _adaptive_enabled() else DEFAULT_LLM_CONCURRENCY
+    return int(float(os.getenv('LLM_MAX_CONCURRENCY', default)))
+
+
+def get_llm_limiter() -> LLMConcurrencyLimiter:
+    """Retorna instância singleton do LLMConcurrencyLimiter"""
+    global _llm_limiter
+    if _llm_limiter is None:
+        _llm_limiter = LLMConcurrencyLimiter(
+            max_concurrency=_llm_max_concurrency(),
+            max_queue=int(os.getenv('LLM_MAX_QUEUE', 100)),
+            queue_timeout=float(os.getenv('LLM_QUEUE_TIMEOUT', 30))
+        )
+    return _llm_limiter
+
+
+def get_adaptive_limiters() -> AdaptiveLimiterRegistry:
+    """Retorna instância singleton do AdaptiveLimiterRegistry"""
+    global _adaptive_limiters
+    if _adaptive_limiters is None:
+        # Acima do limite global o limitador não teria vagas para usar
+        max_limit = min(float(os.getenv('LLM_ADAPTIVE_MAX', DEFAULT_ADAPTIVE_MAX)), _llm_max_concurrency())
+        _adaptive_limiters = AdaptiveLimiterRegistry(
+            enabled=_adaptive_enabled(),
+            initial=float(os.getenv('LLM_ADAPTIVE_INITIAL', min(DEFAULT_LLM_CONCURRENCY, max_limit))),
+            min_limit=float(os.getenv('LLM_ADAPTIVE_MIN', 1)),
+            max_limit=max_limit,
+            latency_tolerance=float(os.getenv('LLM_ADAPTIVE_LATENCY_TOLERANCE', 2.0)),
+            queue_timeout=float(os.getenv('LLM_ADAPTIVE_QUEUE_TIMEOUT', 0))
+        )
+    return _adaptive_limiters
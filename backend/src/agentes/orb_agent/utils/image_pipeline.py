@@ -0,0 +1,340 @@
+"""
+Pré-processamento de imagens para o Agente ORB
+Antes do envio ao provedor a imagem é reduzida à resolução que o modelo
+realmente usa, recodificada em JPEG ou WebP e recebe o nível de detalhe
+escolhido pelo custo estimado em tokens. A recodificação (CPU) roda num
+pool de processos, fora do event loop.
+"""
+
+import asyncio
+import base64
+import io
+import logging
+import math
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, Optional, Tuple, Union
+
+from database.image_store import decode_base64_image, sniff_image_type
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+# Formatos de saída aceitos (formato do Pillow, tipo MIME)
+OUTPUT_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+}
+
+# OpenAI: detail=low vê a imagem em 512x512 por 85 tokens; detail=high
+# reduz para caber em 2048x2048 e o lado menor para 768, e cobra 170 tokens
+# por bloco de 512x512 mais 85
+OPENAI_LOW_SIDE = 512
+OPENAI_MAX_SIDE = 2048
+OPENAI_SHORT_SIDE = 768
+OPENAI_TILE = 512
+OPENAI_TILE_TOKENS = 170
+OPENAI_BASE_TOKENS = 85
+
+# Anthropic: lado maior até 1568 px e ~1,15 MP; custo ~ largura*altura/750
+ANTHROPIC_MAX_SIDE = 1568
+ANTHROPIC_MAX_PIXELS = 1_150_000
+ANTHROPIC_PIXELS_PER_TOKEN = 750
+
+
+def _fit(width: int, height: int, max_side: int) -> Tuple[int, int]:
+    """Dimensões reduzidas para o lado maior caber em max_side"""
+    scale = min(1.0, max_side / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def target_size(provider: str, width: int, height: int, detail: str) -> Tuple[int, int]:
+    """Resolução útil da imagem para o provedor (acima dela o provedor reduz sozinho)"""
+    if provider == 'anthropic':
+        width, height = _fit(width, height, ANTHROPIC_MAX_SIDE)
+        if width * height > ANTHROPIC_MAX_PIXELS:
+            scale = math.sqrt(ANTHROPIC_MAX_PIXELS / (width * height))
+            width, height = max(1, int(width * scale)), max(1, int(height * scale))
+        return width, height
+    
+    if detail == 'low':
+        return _fit(width, height, OPENAI_LOW_SIDE)
+    width, height = _fit(width, height, OPENAI_MAX_SIDE)
+    short = min(width, height)
+    if short > OPENAI_SHORT_SIDE:
+        scale = OPENAI_SHORT_SIDE / short
+        width, height = max(1, round(width * scale)), max(1, round(height * scale))
+    return width, height
+
+
+def estimate_image_tokens(provider: str, width: int, height: int, detail: str = 'high') -> int:
+    """Tokens cobrados pela imagem já na resolução útil (ver target_size)"""
+    if provider == 'anthropic':
+        return math.ceil(width * height / ANTHROPIC_PIXELS_PER_TOKEN)
+    if detail == 'low':
+        return OPENAI_BASE_TOKENS
+    tiles = math.ceil(width / OPENAI_TILE) * math.ceil(height / OPENAI_TILE)
+    return OPENAI_TILE_TOKENS * tiles + OPENAI_BASE_TOKENS
+
+
+def _image_size(data: Union[bytes, memoryview]) -> Tuple[int, int]:
+    """Largura e altura lidas do cabeçalho (sem decodificar os pixels)"""
+    with Image.open(io.BytesIO(data)) as image:
+        return image.size
+
+
+def _to_base64(data: Union[bytes, memoryview]) -> str:
+    """Bytes da imagem em base64 (executado numa thread)"""
+    return base64.b64encode(data).decode('ascii')
+
+
+def _encode_image(data: Union[bytes, memoryview], size: Tuple[int, int], image_format: str, quality: int) -> bytes:
+    """
+    Reduz e recodifica a imagem (executado no pool de processos)
+    
+    Args:
+        data: Bytes da imagem original
+        size: Dimensões finais
+        image_format: Formato do Pillow ('JPEG' ou 'WEBP')
+        quality: Qualidade da compressão (1-100)
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft('RGB', size)  # JPEG: decodifica já reduzido
+        if image.mode != 'RGB':
+            # Transparência vira fundo branco (JPEG não tem canal alfa)
+            rgba = image.convert('RGBA')
+            image = Image.new('RGB', rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel('A'))
+        if image.size != size:
+            image = image.resize(size, Image.LANCZOS)
+        
+        output = io.BytesIO()
+        image.save(output, image_format, quality=quality, optimize=True)
+        return output.getvalue()
+
+
+class PreparedImage:
+    """Imagem pronta para envio ao provedor"""
+    
+    __slots__ = ('data', 'mime_type', 'detail', 'width', 'height', 'tokens', 'original_bytes', 'sent_bytes')
+    
+    def __init__(self, data: str, mime_type: str, detail: str, width: int, height: int,
+                 tokens: int, original_bytes: int, sent_bytes: int):
+        self.data = data
+        self.mime_type = mime_type
+        self.detail = detail
+        self.width = width
+        self.height = height
+        self.tokens = tokens
+        self.original_bytes = original_bytes
+        self.sent_bytes = sent_bytes
+    
+    def to_context(self) -> Dict[str, Any]:
+        """Campos do contexto do LLM (image_data, image_mime_type, image_detail)"""
+        return {
+            'image_data': self.data,
+            'image_mime_type': self.mime_type,
+            'image_detail': self.detail
+        }
+
+
+class ImagePreprocessor:
+    """
+    Prepara imagens para o provedor: resolução útil, recodificação e detalhe
+    
+    Com detail='auto' a imagem vai em detalhe baixo quando o alto não
+    acrescenta nada (já cabe em 512x512) ou passa de max_tokens; na
+    Anthropic, que não tem nível de detalhe, passar de max_tokens reduz a
+    imagem até caber.
+    """
+    
+    def __init__(self, output_format: str = 'jpeg', quality: int = 85, detail: str = 'auto',
+                 max_tokens: int = 0, workers: int = 2, pool_min_bytes: int = 256 * 1024):
+        """
+        Args:
+            output_format: 'jpeg' ou 'webp'
+            quality: Qualidade da recodificação (1-100)
+            detail: 'auto', 'low' ou 'high'
+            max_tokens: Limite de tokens por imagem em detail='auto' (0 = sem limite)
+            workers: Processos do pool de recodificação (0 = thread do asyncio)
+            pool_min_bytes: Imagens menores são recodificadas numa thread
+                (o envio ao processo custaria mais que a recodificação)
+        """
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Formato de imagem não suportado: {output_format}")
+        if detail not in ('auto', 'low', 'high'):
+            raise ValueError(f"Nível de detalhe inválido: {detail}")
+        self.output_format = output_format
+        self.quality = max(1, min(100, quality))
+        self.detail = detail
+        self.max_tokens = max_tokens
+        self.workers = workers
+        self.pool_min_bytes = pool_min_bytes
+        self.logger = logging.getLogger(__name__)
+        
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        
+        self.images = 0
+        self.reencoded = 0
+        self.passthrough = 0
+        self.low_detail = 0
+        self.original_bytes = 0
+        self.sent_bytes = 0
+        self.tokens = 0
+    
+    def choose(self, provider: str, width: int, height: int) -> Tuple[str, Tuple[int, int], int]:
+        """
+        Escolhe detalhe e resolução da imagem
+        
+        Returns:
+            (detalhe, dimensões finais, tokens estimados)
+        """
+        detail = 'high' if self.detail == 'auto' else self.detail
+        size = target_size(provider, width, height, detail)
+        tokens = estimate_image_tokens(provider, *size, detail)
+        
+        if self.detail == 'auto' and provider != 'anthropic':
+            fits_low = max(size) <= OPENAI_LOW_SIDE
+            if fits_low or (self.max_tokens and tokens > self.max_tokens):
+                detail = 'low'
+                size = target_size(provider, width, height, detail)
+                tokens = estimate_image_tokens(provider, *size, detail)
+        elif self.max_tokens and tokens > self.max_tokens and provider == 'anthropic':
+            scale = math.sqrt(self.max_tokens / tokens)
+            size = max(1, int(size[0] * scale)), max(1, int(size[1] * scale))
+            tokens = estimate_image_tokens(provider, *size, detail)
+        
+        return detail, size, tokens
+    
+    async def prepare(self, image_data: Union[str, bytes, bytearray, memoryview], provider: str = 'openai') -> PreparedImage:
+        """
+        Prepara imagem para o provedor
+        
+        Sem Pillow (ou se a imagem não puder ser lida) a imagem segue como
+        veio, só com o tipo MIME detectado pelo conteúdo. A decodificação e a
+        codificação em base64 rodam numa thread, fora do event loop.
+        
+        Args:
+            image_data: Imagem em base64 ou os próprios bytes (upload binário,
+                usados sem cópia)
+        
+        Raises:
+            ValueError: base64 inválido
+        """
+        if isinstance(image_data, str):
+            data = await asyncio.to_thread(decode_base64_image, image_data)
+        else:
+            data = image_data
+        self.images += 1
+        self.original_bytes += len(data)
+        if not PIL_AVAILABLE:
+            return await self._passthrough(data)
+        
+        try:
+            size = _image_size(data)
+            detail, target, tokens = self.choose(provider, *size)
+            pil_format, mime_type = OUTPUT_FORMATS[self.output_format]
+            encoded = await self._run_encode(data, target, pil_format)
+        except Exception as e:
+            self.logger.warning(f"Imagem enviada sem pré-processamento: {e}")
+            return await self._passthrough(data)
+        
+        if target == size and len(encoded) >= len(data):
+            # Já na resolução útil e menor que a recodificação: envia o original
+            encoded, mime_type = data, sniff_image_type(data)
+            self.passthrough += 1
+        else:
+            self.reencoded += 1
+        if detail == 'low':
+            self.low_detail += 1
+        self.tokens += tokens
+        self.sent_bytes += len(encoded)
+        return PreparedImage(
+            await asyncio.to_thread(_to_base64, encoded), mime_type, detail,
+            target[0], target[1], tokens, len(data), len(encoded)
+        )
+    
+    async def _passthrough(self, data: Union[bytes, memoryview]) -> PreparedImage:
+        """Imagem original, só com o tipo MIME detectado"""
+        self.passthrough += 1
+        self.sent_bytes += len(data)
+        return PreparedImage(
+            await asyncio.to_thread(_to_base64, data), sniff_image_type(data), self.detail,
+            0, 0, 0, len(data), len(data)
+        )
+    
+    async def _run_encode(self, data: Union[bytes, memoryview], size: Tuple[int, int], pil_format: str) -> bytes:
+        """Recodifica no pool de processos (ou numa thread, para imagens pequenas)"""
+        args = (data, size, pil_format, self.quality)
+        pool = self._get_pool() if len(data) >= self.pool_min_bytes else None
+        if pool is not None:
+            try:
+                # memoryview não é serializável para o processo
+                process_args = (bytes(data),) + args[1:] if isinstance(data, memoryview) else args
+                return await asyncio.get_running_loop().run_in_executor(pool, _encode_image, *process_args)
+            except BrokenProcessPool:
+                self.logger.warning("Pool de processos de imagem indisponível, recodificando em thread")
+                with self._pool_lock:
+                    self._pool = None
+                    self.workers = 0
+        return await asyncio.to_thread(_encode_image, *args)
+    
+    def _get_pool(self) -> Optional[ProcessPoolExecutor]:
+        """Pool de processos criado no primeiro uso"""
+        if self.workers <= 0:
+            return None
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+    
+    def shutdown(self) -> None:
+        """Encerra o pool de processos"""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Retorna métricas do pré-processamento"""
+        return {
+            'available': PIL_AVAILABLE,
+            'output_format': self.output_format,
+            'quality': self.quality,
+            'detail': self.detail,
+            'max_tokens': self.max_tokens,
+            'workers': self.workers,
+            'images': self.images,
+            'reencoded': self.reencoded,
+            'passthrough': self.passthrough,
+            'low_detail': self.low_detail,
+            'original_bytes': self.original_bytes,
+            'sent_bytes': self.sent_bytes,
+            'bytes_saved_ratio': round(1 - self.sent_bytes / self.original_bytes, 4) if self.original_bytes else 0.0,
+            'estimated_tokens': self.tokens
+        }
+
+
+# Instância global (compartilhada entre instâncias do agente)
+_image_preprocessor = None
+
+
+def get_image_preprocessor() -> ImagePreprocessor:
+    """Retorna instância singleton do ImagePreprocessor"""
+    global _image_preprocessor
+    if _image_preprocessor is None:
+        _image_preprocessor = ImagePreprocessor(
+            output_format=os.getenv('IMAGE_FORMAT', 'jpeg').lower(),
+            quality=int(os.getenv('IMAGE_QUALITY', 85)),
+            detail=os.getenv('IMAGE_DETAIL', 'auto').lower(),
+            max_tokens=int(os.getenv('IMAGE_MAX_TOKENS', 0)),
+            workers=int(os.getenv('IMAGE_WORKERS', min(2, os.cpu_count() or 1))),
+            pool_min_bytes=int(os.getenv('IMAGE_POOL_MIN_BYTES', 256 * 1024))
+        )
+    return _image_preprocessor
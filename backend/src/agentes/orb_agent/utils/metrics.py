@@ -0,0 +1,311 @@
+"""
+Métricas de tempo do pipeline do Agente ORB
+- PipelineTimer: tempos monotônicos por etapa e sub-etapa de uma requisição
+- LatencyHistograms: histogramas agregados com percentis aproximados
+- UsageTotals: tokens consumidos e tokens servidos do cache de prompt do provedor
+- track_call: uso, latência e resultado de cada chamada ao provedor, repassados
+  ao registrador de uso (contabilidade persistente)
+"""
+
+import asyncio
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, Callable, Iterator, List, Optional
+
+# Limites superiores dos buckets em ms (o último bucket é aberto)
+BUCKET_BOUNDS_MS: List[float] = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 60000]
+
+# Campos de uso de tokens reportados pelos provedores
+USAGE_FIELDS = ('prompt_tokens', 'completion_tokens', 'cached_tokens', 'cache_creation_tokens')
+
+# Timer da requisição em andamento (propagado entre awaits da mesma task)
+_current_timer: ContextVar[Optional["PipelineTimer"]] = ContextVar("orb_pipeline_timer", default=None)
+
+
+class PipelineTimer:
+    """Coleta tempos das etapas de uma requisição do pipeline"""
+    
+    def __init__(self):
+        self._start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.sub_timings: Dict[str, float] = {}
+        self.usage: Dict[str, int] = {}
+        # Origem da resposta no cache de respostas (None = gerada pelo provedor)
+        self.cache_source: Optional[str] = None
+        self.session_id: Optional[str] = None
+        self.total_ms: Optional[float] = None
+    
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Mede uma etapa principal do pipeline"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - start) * 1000
+    
+    def add(self, name: str, elapsed_ms: float) -> None:
+        """Acumula uma sub-etapa (ex: db.load_history, provider.call)"""
+        self.sub_timings[name] = self.sub_timings.get(name, 0.0) + elapsed_ms
+    
+    def add_usage(self, usage: Dict[str, int]) -> None:
+        """Acumula uso de tokens de uma chamada ao provedor"""
+        for field in USAGE_FIELDS:
+            if usage.get(field):
+                self.usage[field] = self.usage.get(field, 0) + usage[field]
+    
+    def finish(self) -> Dict[str, Any]:
+        """Encerra a medição e retorna os tempos em ms"""
+        if self.total_ms is None:
+            self.total_ms = (time.perf_counter() - self._start) * 1000
+        return self.to_dict()
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Tempos em ms, arredondados"""
+        total = self.total_ms if self.total_ms is not None else (time.perf_counter() - self._start) * 1000
+        return {
+            'total_ms': round(total, 2),
+            'stages': {name: round(ms, 2) for name, ms in self.stages.items()},
+            'sub': {name: round(ms, 2) for name, ms in self.sub_timings.items()}
+        }
+
+
+@contextmanager
+def track_pipeline(timer: PipelineTimer) -> Iterator[PipelineTimer]:
+    """Torna o timer o atual para o bloco (usado por record_timing/timed)"""
+    token = _current_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        try:
+            _current_timer.reset(token)
+        except ValueError:
+            # Gerador assíncrono finalizado em outro contexto (ex: cliente desconectou)
+            _current_timer.set(None)
+
+
+def record_timing(name: str, elapsed_ms: float) -> None:
+    """Registra sub-etapa no timer da requisição atual (no-op sem timer)"""
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.add(name, elapsed_ms)
+
+
+def record_usage(usage: Dict[str, int], call: Optional[Dict[str, int]] = None) -> None:
+    """
+    Registra uso de tokens na requisição atual, nos totais do processo e,
+    se informado, no registro da chamada ao provedor (o dict de track_call)
+    
+    O registro da chamada vem explícito e não por ContextVar: em streaming
+    a chamada começa na task da tentativa e os chunks seguintes (inclusive
+    o que traz o uso) são consumidos na task de quem lê a resposta.
+    """
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.add_usage(usage)
+    if call is not None:
+        for field in USAGE_FIELDS:
+            call[field] = call.get(field, 0) + (usage.get(field) or 0)
+    get_usage_totals().observe(usage)
+
+
+def set_usage_recorder(recorder: Optional[Callable[[Dict[str, Any]], Any]]) -> None:
+    """Define quem recebe o registro de cada chamada ao provedor (None = nenhum)"""
+    global _usage_recorder
+    _usage_recorder = recorder
+
+
+def _call_outcome(error: BaseException) -> str:
+    """Resultado de uma chamada que terminou em exceção"""
+    if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+        return 'cancelled'
+    if getattr(error, 'status_code', None) in (429, 529):
+        return 'rate_limited'
+    if isinstance(error, TimeoutError) or 'timeout' in type(error).__name__.lower():
+        return 'timeout'
+    return 'error'
+
+
+@contextmanager
+def track_call(provider: str, model: str) -> Iterator[Dict[str, int]]:
+    """
+    Mede uma chamada ao provedor e a entrega ao registrador de uso
+    
+    O registro leva provedor, modelo, sessão da requisição atual, tokens
+    (somados por record_usage(usage, call=...) no dict entregue pelo bloco),
+    latência em ms e resultado ('ok', 'error', 'rate_limited', 'timeout'
+    ou 'cancelled').
+    """
+    call: Dict[str, int] = {}
+    start = time.perf_counter()
+    outcome = 'ok'
+    try:
+        yield call
+    except BaseException as e:
+        outcome = _call_outcome(e)
+        raise
+    finally:
+        recorder = _usage_recorder
+        if recorder is not None:
+            timer = _current_timer.get()
+            try:
+                recorder({
+                    'ts': time.time(),
+                    'provider': provider,
+                    'model': model,
+                    'session_id': timer.session_id if timer is not None else None,
+                    **{field: call.get(field, 0) for field in USAGE_FIELDS},
+                    'latency_ms': (time.perf_counter() - start) * 1000,
+                    'outcome': outcome
+                })
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"Uso da chamada não registrado: {e}")
+
+
+def record_cache_source(source: Optional[str]) -> None:
+    """Registra se a resposta da requisição atual veio do cache de respostas"""
+    timer = _current_timer.get()
+    if timer is not None and source is not None:
+        timer.cache_source = source
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    """Mede um bloco como sub-etapa da requisição atual"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(name, (time.perf_counter() - start) * 1000)
+
+
+class _Histogram:
+    """Histograma de latência com buckets fixos (memória constante)"""
+    
+    __slots__ = ('counts', 'count', 'total', 'max')
+    
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def observe(self, value_ms: float) -> None:
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS_MS, value_ms)] += 1
+        self.count += 1
+        self.total += value_ms
+        self.max = max(self.max, value_ms)
+    
+    def percentile(self, percentile: float) -> float:
+        """Percentil aproximado: limite superior do bucket que o contém"""
+        if not self.count:
+            return 0.0
+        rank = percentile / 100 * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return BUCKET_BOUNDS_MS[index] if index < len(BUCKET_BOUNDS_MS) else self.max
+        return self.max
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total / self.count, 2) if self.count else 0.0,
+            'p50_ms': self.percentile(50),
+            'p90_ms': self.percentile(90),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'max_ms': round(self.max, 2)
+        }
+
+
+class LatencyHistograms:
+    """Histogramas agregados por métrica (etapas e sub-etapas do pipeline)"""
+    
+    def __init__(self):
+        self._histograms: Dict[str, _Histogram] = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, name: str, value_ms: float) -> None:
+        """Registra uma amostra"""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = _Histogram()
+                self._histograms[name] = histogram
+            histogram.observe(value_ms)
+    
+    def observe_timings(self, timings: Dict[str, Any]) -> None:
+        """Registra todos os tempos de uma requisição (saída de PipelineTimer)"""
+        self.observe('total', timings.get('total_ms', 0.0))
+        for name, value in timings.get('stages', {}).items():
+            self.observe(f"stage.{name}", value)
+        for name, value in timings.get('sub', {}).items():
+            self.observe(name, value)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Percentis de todas as métricas"""
+        with self._lock:
+            return {name: histogram.to_dict() for name, histogram in sorted(self._histograms.items())}
+    
+    def reset(self) -> None:
+        """Zera os histogramas"""
+        with self._lock:
+            self._histograms.clear()
+
+
+class UsageTotals:
+    """Totais de tokens do processo, incluindo acertos no cache de prompt"""
+    
+    def __init__(self):
+        self._totals = {field: 0 for field in USAGE_FIELDS}
+        self.calls = 0
+        self.calls_with_cache_hit = 0
+        self._lock = threading.Lock()
+    
+    def observe(self, usage: Dict[str, int]) -> None:
+        """Registra o uso de uma chamada"""
+        with self._lock:
+            self.calls += 1
+            if usage.get('cached_tokens'):
+                self.calls_with_cache_hit += 1
+            for field in USAGE_FIELDS:
+                self._totals[field] += usage.get(field) or 0
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Totais e taxa de tokens de prompt servidos do cache"""
+        with self._lock:
+            prompt_tokens = self._totals['prompt_tokens']
+            return {
+                **self._totals,
+                'calls': self.calls,
+                'calls_with_cache_hit': self.calls_with_cache_hit,
+                'cached_token_ratio': round(self._totals['cached_tokens'] / prompt_tokens, 4) if prompt_tokens else 0.0
+            }
+
+
+# Instâncias globais
+_pipeline_histograms = None
+_usage_totals = None
+_usage_recorder: Optional[Callable[[Dict[str, Any]], Any]] = None
+
+
+def get_pipeline_histograms() -> LatencyHistograms:
+    """Retorna instância singleton dos histogramas do pipeline"""
+    global _pipeline_histograms
+    if _pipeline_histograms is None:
+        _pipeline_histograms = LatencyHistograms()
+    return _pipeline_histograms
+
+
+def get_usage_totals() -> UsageTotals:
+    """Retorna instância singleton dos totais de uso de tokens"""
+    global _usage_totals
+    if _usage_totals is None:
+        _usage_totals = UsageTotals()
+    return _usage_totals
@@ -0,0 +1,158 @@
+"""
+Escolha do modelo por complexidade da requisição
+Cada turno recebe uma pontuação (tamanho da mensagem, imagem, palavras-chave,
+tipo e tamanho do histórico) e vai para a primeira faixa (tier) da tabela
+cujo max_score a comporta: mensagens simples no modelo rápido, as demais no
+modelo forte. Configurado por model_routing no system_prompt.yaml.
+"""
+
+import threading
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+# Pesos padrão dos sinais (tabelas de limiar -> pontos usam o maior limiar atingido)
+DEFAULT_WEIGHTS = {
+    'length': {200: 1, 800: 2, 2000: 3},
+    'history_chars': {4000: 1, 16000: 2},
+    'image': 2,
+    'code': 2,
+    'complex_request': 2,
+    'help_request': 1,
+    'question': 0,
+    'thanks': -2,
+    'ongoing_conversation': 1,
+}
+
+
+def _threshold_points(table: Dict[Any, float], value: int) -> float:
+    """Pontos do maior limiar atingido pelo valor (0 se nenhum)"""
+    points = 0
+    for limit, limit_points in sorted(((int(limit), limit_points) for limit, limit_points in table.items())):
+        if value >= limit:
+            points = limit_points
+    return points
+
+
+class ModelChoice:
+    """Faixa escolhida para o turno, com a pontuação e os motivos"""
+    
+    __slots__ = ('tier', 'models', 'score', 'reasons')
+    
+    def __init__(self, tier: str, models: Dict[str, str], score: float, reasons: List[str]):
+        self.tier = tier
+        # Provedor -> modelo (provedor ausente = modelo configurado em llm_config)
+        self.models = models
+        self.score = score
+        self.reasons = reasons
+    
+    def model_for(self, provider: str, default: str) -> str:
+        """Modelo da faixa para o provedor"""
+        return self.models.get(provider) or default
+    
+    def to_context(self) -> Dict[str, Any]:
+        """Campos do contexto do LLM Provider"""
+        return {'model_tier': self.tier, 'tier_models': dict(self.models)}
+
+
+class ModelRouter:
+    """Pontua a requisição e escolhe a faixa de modelo"""
+    
+    def __init__(self, tiers: List[Dict[str, Any]], weights: Optional[Dict[str, Any]] = None, enabled: bool = True):
+        """
+        Args:
+            tiers: Faixas em ordem ({'name', 'max_score', 'models': {provedor: modelo}});
+                a última (sem max_score) recebe o restante
+            weights: Pesos dos sinais (mesclados sobre DEFAULT_WEIGHTS)
+            enabled: Desativado, sempre usa a última faixa
+        """
+        self.tiers = tiers
+        self.weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+        self.enabled = enabled and len(tiers) > 1
+    
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]]) -> 'ModelRouter':
+        """Cria o roteador a partir de model_routing (sem configuração: faixa única)"""
+        config = config or {}
+        tiers = [
+            {
+                'name': str(tier.get('name', f"tier{index}")),
+                'max_score': tier.get('max_score'),
+                'models': dict(tier.get('models') or {})
+            }
+            for index, tier in enumerate(config.get('tiers') or []) if isinstance(tier, dict)
+        ] or [{'name': 'default', 'max_score': None, 'models': {}}]
+        return cls(tiers, config.get('weights'), enabled=bool(config.get('enabled', True)))
+    
+    def score(self, message: str, keywords: List[str], context_type: str, history: List[Dict[str, Any]],
+              has_image: bool) -> Tuple[float, List[str]]:
+        """
+        Pontuação de complexidade e os sinais que contribuíram
+        
+        Returns:
+            (pontuação, motivos no formato 'sinal:+pontos')
+        """
+        weights = self.weights
+        reasons = []
+        total = 0.0
+        
+        def add(signal: str, points: float) -> None:
+            nonlocal total
+            if points:
+                total += points
+                reasons.append(f"{signal}:{points:+g}")
+        
+        add(f"length={len(message)}", _threshold_points(weights['length'], len(message)))
+        if has_image:
+            add('image', weights['image'])
+        for keyword in keywords:
+            add(keyword, weights.get(keyword, 0))
+        add(context_type, weights.get(context_type, 0))
+        history_chars = sum(len(entry.get('content') or '') for entry in history)
+        add(f"history_chars={history_chars}", _threshold_points(weights['history_chars'], history_chars))
+        return total, reasons
+    
+    def select(self, message: str, keywords: List[str], context_type: str, history: List[Dict[str, Any]],
+               has_image: bool) -> ModelChoice:
+        """Escolhe a faixa do turno"""
+        if not self.enabled:
+            tier = self.tiers[-1]
+            return ModelChoice(tier['name'], tier['models'], 0.0, ['routing_disabled'])
+        
+        score, reasons = self.score(message, keywords, context_type, history, has_image)
+        tier = next(
+            (tier for tier in self.tiers[:-1] if tier['max_score'] is not None and score <= tier['max_score']),
+            self.tiers[-1]
+        )
+        choice = ModelChoice(tier['name'], tier['models'], score, reasons)
+        get_model_routing_stats().observe(choice)
+        return choice
+
+
+class ModelRoutingStats:
+    """Decisões por faixa e as mais recentes (para ajuste dos pesos)"""
+    
+    def __init__(self, recent: int = 50):
+        self._tiers: Dict[str, int] = {}
+        self._recent = deque(maxlen=recent)
+        self._lock = threading.Lock()
+    
+    def observe(self, choice: ModelChoice) -> None:
+        with self._lock:
+            self._tiers[choice.tier] = self._tiers.get(choice.tier, 0) + 1
+            self._recent.append({'tier': choice.tier, 'score': choice.score, 'reasons': choice.reasons})
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'tiers': dict(self._tiers), 'recent': list(self._recent)}
+
+
+# Instância global (compartilhada entre instâncias do agente)
+_model_routing_stats = None
+
+
+def get_model_routing_stats() -> ModelRoutingStats:
+    """Retorna instância singleton do ModelRoutingStats"""
+    global _model_routing_stats
+    if _model_routing_stats is None:
+        _model_routing_stats = ModelRoutingStats()
+    return _model_routing_stats
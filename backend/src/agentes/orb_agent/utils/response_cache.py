@@ -0,0 +1,215 @@
+"""
+Cache de respostas do LLM para o Agente ORB
+Requisições idênticas (mesmo modelo, parâmetros e mensagens renderizadas)
+reaproveitam a resposta: LRU em memória na frente de uma camada persistente
+opcional, e requisições idênticas simultâneas compartilham uma única chamada
+ao provedor
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Awaitable, Callable, Optional, Tuple
+
+
+class _InFlight:
+    """Chamada ao provedor em andamento e quantas requisições a aguardam"""
+    
+    __slots__ = ('task', 'waiters')
+    
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class ResponseCache:
+    """
+    Cache de respostas exatas em dois níveis
+    
+    A memória guarda as respostas mais usadas (limite por entradas e bytes);
+    o store (ex: ResponseCacheStore no SQLite) guarda mais respostas e é
+    compartilhado entre workers. Só respostas bem-sucedidas são gravadas.
+    """
+    
+    def __init__(self, store=None, ttl: float = 3600, max_entries: int = 1024, max_bytes: int = 16 * 1024 * 1024):
+        """
+        Args:
+            store: Camada persistente com get(key) e put(key, response, ttl, model) (opcional)
+            ttl: Validade das respostas em segundos
+            max_entries: Respostas mantidas em memória
+            max_bytes: Tamanho máximo estimado das respostas em memória
+        """
+        self.store = store
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, _InFlight] = {}
+        
+        self.memory_hits = 0
+        self.store_hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def make_key(payload: Dict[str, Any]) -> str:
+        """Hash estável de uma requisição renderizada (modelo, parâmetros e mensagens)"""
+        encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+    
+    async def get_or_generate(self, key: str, generate: Callable[[], Awaitable[str]],
+                              model: Optional[str] = None) -> Tuple[str, Optional[str]]:
+        """
+        Retorna a resposta em cache ou gera uma nova
+        
+        Args:
+            key: Chave da requisição (ver make_key)
+            generate: Chamada ao provedor (só executada em miss)
+            model: Modelo da requisição (gravado com a resposta)
+        
+        Returns:
+            (resposta, origem), com origem 'memory', 'store', 'coalesced' ou
+            None quando a resposta foi gerada por esta requisição
+        """
+        value = self._memory_get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value, 'memory'
+        
+        flight = self._inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _InFlight(asyncio.ensure_future(self._fill(key, generate, model)))
+            self._inflight[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        else:
+            self.coalesced += 1
+        
+        flight.waiters += 1
+        try:
+            value, source = await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            # Cancela a chamada só quando ninguém mais aguarda a resposta
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+                self._forget(key, flight)
+        
+        if not leader and source is None:
+            source = 'coalesced'
+        return value, source
+    
+    def _forget(self, key: str, flight: _InFlight) -> None:
+        """Remove a chamada em andamento (se ainda for a registrada para a chave)"""
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+    
+    async def _fill(self, key: str, generate: Callable[[], Awaitable[str]],
+                    model: Optional[str]) -> Tuple[str, Optional[str]]:
+        """Consulta o store e, em miss, chama o provedor e grava a resposta"""
+        if self.store is not None:
+            value = await asyncio.to_thread(self.store.get, key)
+            if value is not None:
+                self.store_hits += 1
+                self._memory_put(key, value)
+                return value, 'store'
+        
+        self.misses += 1
+        value = await generate()
+        self._memory_put(key, value)
+        if self.store is not None:
+            await asyncio.to_thread(self.store.put, key, value, self.ttl, model)
+        return value, None
+    
+    def _memory_get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if time.time() >= expires:
+                del self._entries[key]
+                self._bytes -= len(value)
+                return None
+            self._entries.move_to_end(key)
+            return value
+    
+    def _memory_put(self, key: str, value: str) -> None:
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            if len(value) > self.max_bytes:
+                return
+            
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._bytes += len(value)
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+    
+    def clear(self) -> None:
+        """Remove as respostas em memória e no store"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.store is not None:
+            self.store.clear()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Retorna métricas do cache"""
+        with self._lock:
+            hits = self.memory_hits + self.store_hits + self.coalesced
+            lookups = hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'persistent': self.store is not None,
+                'memory_hits': self.memory_hits,
+                'store_hits': self.store_hits,
+                'coalesced': self.coalesced,
+                'misses': self.misses,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'in_flight': len(self._inflight)
+            }
+
+
+# Instância global (compartilhada entre instâncias do agente)
+_response_cache = None
+
+
+def response_cache_enabled() -> bool:
+    """Cache de respostas ligado (RESPONSE_CACHE_ENABLED, padrão true)"""
+    return os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+
+
+def get_response_cache(store=None) -> ResponseCache:
+    """
+    Retorna instância singleton do ResponseCache
+    
+    Args:
+        store: Camada persistente, associada na primeira chamada que a informar
+    """
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache(
+            ttl=float(os.getenv('RESPONSE_CACHE_TTL', 3600)),
+            max_entries=int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 1024)),
+            max_bytes=int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+        )
+    if store is not None and _response_cache.store is None:
+        _response_cache.store = store
+    return _response_cache
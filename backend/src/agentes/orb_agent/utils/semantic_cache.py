@@ -0,0 +1,432 @@
+"""
+Cache semântico de respostas para o Agente ORB
+Perguntas parecidas (paráfrases) reaproveitam a resposta: a mensagem é
+convertida em vetor por um embedder plugável (hashing local por padrão,
+funciona offline) e buscada num índice NumPy persistido em arquivo mapeado
+em memória. Só vale para mensagens avulsas (sem histórico e sem imagem).
+"""
+
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from abc import ABC, abstractmethod
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+# Palavras sem conteúdo (negações ficam de fora de propósito)
+STOPWORDS = frozenset("""
+a an and are as at be by can could do does for from how i in is it me my of on or please should
+the this to was what when where which who why will with would you your
+o os as um uma uns umas de da do das dos em no na nos nas por para pelo pela com como que qual quais
+se eu me meu minha voce você e é ou ao aos à às isso isto esse essa este esta favor pode posso
+""".split())
+
+# Negações pesam mais: "não quero X" não pode reaproveitar a resposta de "quero X"
+NEGATIONS = frozenset("not no never without nao nunca sem nem".split())
+
+
+class BaseEmbedder(ABC):
+    """Converte texto em vetor normalizado (norma L2 = 1)"""
+    
+    name: str = "base"
+    dim: int = 0
+    
+    @abstractmethod
+    def embed(self, text: str) -> "np.ndarray":
+        """Vetor float32 de dimensão dim"""
+        pass
+
+
+class HashingEmbedder(BaseEmbedder):
+    """
+    Embedder local por feature hashing
+    
+    Usa palavras de conteúdo (sem acentos e stopwords, negações com peso
+    maior) e trigramas de caracteres de cada palavra, com tf sublinear. Não precisa de treino nem
+    de rede, e o mesmo texto gera o mesmo vetor em qualquer processo.
+    """
+    
+    def __init__(self, dim: int = 1024, char_weight: float = 0.5, negation_weight: float = 3.0):
+        """
+        Args:
+            dim: Dimensão do vetor
+            char_weight: Peso dos trigramas de caracteres em relação às palavras
+            negation_weight: Peso das palavras de negação
+        """
+        self.dim = dim
+        self.char_weight = char_weight
+        self.negation_weight = negation_weight
+        self.name = f"hashing:{dim}"
+    
+    def _features(self, text: str) -> Dict[str, int]:
+        """Contagem de palavras (w:) e trigramas de caracteres (c:)"""
+        text = unicodedata.normalize('NFKD', text.lower())
+        text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+        features: Dict[str, int] = {}
+        for word in _WORD.findall(text):
+            if word in STOPWORDS:
+                continue
+            features[f"w:{word}"] = features.get(f"w:{word}", 0) + 1
+            if word in NEGATIONS:
+                continue
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                gram = f"c:{padded[i:i + 3]}"
+                features[gram] = features.get(gram, 0) + 1
+        return features
+    
+    def embed(self, text: str) -> "np.ndarray":
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, count in self._features(text).items():
+            # crc32 é estável entre processos (hash() do Python não é)
+            bucket = zlib.crc32(feature.encode('utf-8'))
+            sign = 1.0 if bucket & 0x80000000 else -1.0
+            if feature.startswith('c:'):
+                scale = self.char_weight
+            elif feature[2:] in NEGATIONS:
+                scale = self.negation_weight
+            else:
+                scale = 1.0
+            weight = (1.0 + math.log(count)) * scale
+            vector[bucket % self.dim] += sign * weight
+        norm = float(np.linalg.norm(vector))
+        if norm > 0:
+            vector /= norm
+        return vector
+
+
+# Embedders disponíveis por nome (SEMANTIC_CACHE_EMBEDDER)
+_EMBEDDERS: Dict[str, Callable[[int], BaseEmbedder]] = {
+    'hashing': lambda dim: HashingEmbedder(dim)
+}
+
+
+def register_embedder(name: str, factory: Callable[[int], BaseEmbedder]) -> None:
+    """Registra um embedder (factory recebe a dimensão configurada)"""
+    _EMBEDDERS[name] = factory
+
+
+def create_embedder(name: str, dim: int) -> BaseEmbedder:
+    """Cria o embedder registrado com o nome"""
+    if name not in _EMBEDDERS:
+        raise ValueError(f"Embedder '{name}' não registrado (disponíveis: {', '.join(_EMBEDDERS)})")
+    return _EMBEDDERS[name](dim)
+
+
+class VectorIndex:
+    """
+    Índice vetorial de capacidade fixa com busca exata por produto interno
+    
+    Os vetores ficam em <path>.vec (np.memmap) e os metadados num log JSONL
+    append-only (<path>.meta), compactado na abertura e quando cresce demais.
+    O vetor é gravado antes do log, então uma interrupção no meio nunca
+    deixa metadados apontando para um vetor incompleto. Sem path, fica só em memória.
+    """
+    
+    def __init__(self, dim: int, capacity: int, path: Optional[str] = None, embedder_name: str = ""):
+        """
+        Args:
+            dim: Dimensão dos vetores
+            capacity: Número máximo de entradas
+            path: Prefixo dos arquivos do índice (None = só memória)
+            embedder_name: Nome do embedder (índice é recriado se mudar)
+        """
+        self.dim = dim
+        self.capacity = capacity
+        self.path = path
+        self.logger = logging.getLogger(__name__)
+        self._header = {'dim': dim, 'capacity': capacity, 'embedder': embedder_name}
+        
+        self.valid = np.zeros(capacity, dtype=bool)
+        self.scopes = np.zeros(capacity, dtype=np.int64)
+        self.expires = np.zeros(capacity, dtype=np.float64)
+        self.last_hit = np.zeros(capacity, dtype=np.float64)
+        self.meta: List[Optional[Dict[str, Any]]] = [None] * capacity
+        self.size = 0
+        self._log_lines = 0
+        self._log = None
+        
+        if path is None:
+            self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        else:
+            self._open(path)
+    
+    def _open(self, path: str) -> None:
+        """Abre (ou recria) os arquivos do índice"""
+        vec_path, meta_path = f"{path}.vec", f"{path}.meta"
+        expected = self.capacity * self.dim * 4
+        
+        reuse = os.path.exists(vec_path) and os.path.getsize(vec_path) == expected and os.path.exists(meta_path)
+        if reuse:
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as file:
+                    reuse = json.loads(file.readline() or '{}') == self._header
+            except (OSError, ValueError):
+                reuse = False
+        
+        os.makedirs(os.path.dirname(os.path.abspath(vec_path)), exist_ok=True)
+        self.vectors = np.memmap(vec_path, dtype=np.float32, mode='r+' if reuse else 'w+',
+                                 shape=(self.capacity, self.dim))
+        if reuse:
+            self._replay(meta_path)
+        # Compacta na abertura (também descarta uma última linha truncada)
+        self._rewrite_log()
+        self._log = open(meta_path, 'a', encoding='utf-8')
+    
+    def _replay(self, meta_path: str) -> None:
+        """Reconstrói os metadados a partir do log"""
+        with open(meta_path, 'r', encoding='utf-8') as file:
+            next(file)
+            for line in file:
+                self._log_lines += 1
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Última linha truncada por interrupção
+                    continue
+                slot = record['slot']
+                if slot >= self.capacity:
+                    continue
+                if record.get('deleted'):
+                    self.valid[slot] = False
+                    self.meta[slot] = None
+                    continue
+                self.valid[slot] = True
+                self.scopes[slot] = record['scope']
+                self.expires[slot] = record['expires']
+                self.last_hit[slot] = record['created_at']
+                self.meta[slot] = record
+                self.size = max(self.size, slot + 1)
+    
+    def _rewrite_log(self) -> None:
+        """Reescreve o log só com as entradas atuais (troca atômica)"""
+        meta_path = f"{self.path}.meta"
+        tmp_path = f"{meta_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            file.write(json.dumps(self._header) + '\n')
+            for slot in np.flatnonzero(self.valid):
+                file.write(json.dumps(self.meta[slot], ensure_ascii=False) + '\n')
+        if self._log is not None:
+            self._log.close()
+        os.replace(tmp_path, meta_path)
+        self._log_lines = int(self.valid.sum())
+        if self._log is not None:
+            self._log = open(meta_path, 'a', encoding='utf-8')
+    
+    def _append_log(self, record: Dict[str, Any]) -> None:
+        if self._log is None:
+            return
+        self._log.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._log.flush()
+        self._log_lines += 1
+        if self._log_lines > 2 * self.capacity:
+            self._rewrite_log()
+    
+    def search(self, vector: "np.ndarray", scope: int, now: float) -> Tuple[int, float]:
+        """
+        Entrada mais similar do escopo
+        
+        Returns:
+            (slot, similaridade), com slot -1 se não houver candidatas
+        """
+        if self.size == 0:
+            return -1, 0.0
+        mask = self.valid[:self.size] & (self.scopes[:self.size] == scope) & (self.expires[:self.size] > now)
+        if not mask.any():
+            return -1, 0.0
+        scores = self.vectors[:self.size] @ vector
+        scores[~mask] = -np.inf
+        slot = int(np.argmax(scores))
+        return slot, float(scores[slot])
+    
+    def add(self, vector: "np.ndarray", scope: int, expires: float, meta: Dict[str, Any], now: float) -> bool:
+        """
+        Grava uma entrada
+        
+        Returns:
+            True se outra entrada válida foi removida para abrir espaço
+        """
+        evicted = False
+        if self.size < self.capacity:
+            slot = self.size
+            self.size += 1
+        else:
+            free = np.flatnonzero(~self.valid | (self.expires <= now))
+            if free.size:
+                slot = int(free[0])
+            else:
+                # Cheio: substitui a entrada usada há mais tempo
+                slot = int(np.argmin(self.last_hit))
+                evicted = True
+        
+        if self.valid[slot]:
+            # Invalida antes de sobrescrever o vetor (metadados antigos nunca
+            # apontam para o vetor novo, mesmo com interrupção no meio)
+            self.valid[slot] = False
+            self.meta[slot] = None
+            self._append_log({'slot': slot, 'deleted': True})
+        
+        self.vectors[slot] = vector
+        if isinstance(self.vectors, np.memmap):
+            self.vectors.flush()
+        record = {**meta, 'slot': slot, 'scope': scope, 'expires': expires, 'created_at': now}
+        self.valid[slot] = True
+        self.scopes[slot] = scope
+        self.expires[slot] = expires
+        self.last_hit[slot] = now
+        self.meta[slot] = record
+        self._append_log(record)
+        return evicted
+    
+    def touch(self, slot: int, now: float) -> None:
+        """Marca uso da entrada (ordem de remoção)"""
+        self.last_hit[slot] = now
+    
+    def clear(self) -> None:
+        """Remove todas as entradas"""
+        self.valid[:] = False
+        self.meta = [None] * self.capacity
+        self.size = 0
+        if self.path is not None:
+            self._rewrite_log()
+    
+    def __len__(self) -> int:
+        return int(self.valid[:self.size].sum())
+
+
+class SemanticCache:
+    """
+    Cache de respostas por similaridade da mensagem do usuário
+    
+    Entradas são separadas por escopo (provedor, modelo, parâmetros e prompt
+    do sistema): uma resposta só é reaproveitada na mesma configuração.
+    """
+    
+    def __init__(self, embedder: BaseEmbedder, index: VectorIndex, threshold: float = 0.85, ttl: float = 86400):
+        """
+        Args:
+            embedder: Embedder da mensagem
+            index: Índice vetorial
+            threshold: Similaridade mínima (cosseno) para reaproveitar a resposta
+            ttl: Validade das respostas em segundos
+        """
+        self.embedder = embedder
+        self.index = index
+        self.threshold = threshold
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def _scope_id(scope: str) -> int:
+        """Escopo (hash hexadecimal) como inteiro de 60 bits"""
+        return int(scope[:15], 16)
+    
+    def lookup(self, text: str, scope: str) -> Optional[Tuple[str, float]]:
+        """
+        Busca resposta para mensagem parecida no mesmo escopo
+        
+        Returns:
+            (resposta, similaridade) ou None
+        """
+        vector = self.embedder.embed(text)
+        now = time.time()
+        with self._lock:
+            slot, score = self.index.search(vector, self._scope_id(scope), now)
+            if slot < 0 or score < self.threshold:
+                self.misses += 1
+                return None
+            self.index.touch(slot, now)
+            self.hits += 1
+            return self.index.meta[slot]['response'], score
+    
+    def store(self, text: str, scope: str, response: str, model: Optional[str] = None) -> None:
+        """Grava a resposta gerada para a mensagem"""
+        vector = self.embedder.embed(text)
+        if not vector.any():
+            # Mensagem só com stopwords/símbolos: vetor nulo não é comparável
+            return
+        now = time.time()
+        with self._lock:
+            if self.index.add(vector, self._scope_id(scope), now + self.ttl,
+                              {'text': text, 'response': response, 'model': model}, now):
+                self.evictions += 1
+            self.stores += 1
+    
+    def clear(self) -> None:
+        """Remove todas as entradas"""
+        with self._lock:
+            self.index.clear()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Retorna métricas do cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.index),
+                'capacity': self.index.capacity,
+                'embedder': self.embedder.name,
+                'threshold': self.threshold,
+                'ttl': self.ttl,
+                'persistent': self.index.path is not None,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'stores': self.stores,
+                'evictions': self.evictions
+            }
+
+
+# Instância global (compartilhada entre instâncias do agente)
+_semantic_cache = None
+
+
+def semantic_cache_enabled() -> bool:
+    """Cache semântico ligado (SEMANTIC_CACHE_ENABLED, padrão false)"""
+    return os.getenv('SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true'
+
+
+def get_semantic_cache(path: Optional[str] = None) -> Optional[SemanticCache]:
+    """
+    Retorna instância singleton do SemanticCache (None sem NumPy)
+    
+    Args:
+        path: Prefixo dos arquivos do índice (None = só memória). Com vários
+            workers cada processo usa o próprio arquivo (sufixo do worker)
+    """
+    global _semantic_cache
+    if _semantic_cache is None:
+        if not NUMPY_AVAILABLE:
+            logging.getLogger(__name__).warning("NumPy não está instalado; cache semântico desativado. Execute: pip install numpy")
+            return None
+        
+        dim = int(os.getenv('SEMANTIC_CACHE_DIM', 1024))
+        embedder = create_embedder(os.getenv('SEMANTIC_CACHE_EMBEDDER', 'hashing'), dim)
+        worker = os.getenv('ORB_WORKER_INDEX')
+        if path is not None and worker is not None:
+            path = f"{path}.{worker}"
+        
+        _semantic_cache = SemanticCache(
+            embedder,
+            VectorIndex(embedder.dim, int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', 10000)), path, embedder.name),
+            threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.85)),
+            ttl=float(os.getenv('SEMANTIC_CACHE_TTL', 86400))
+        )
+    return _semantic_cache
@@ -0,0 +1,303 @@
+"""
+Cache LRU de contexto de sessão para o Agente ORB
+Mantém as mensagens recentes de cada sessão em memória (janela medida em
+tokens, do tamanho do orçamento de contexto), limitado por número de
+sessões e por bytes, com contadores de hit/miss
+"""
+
+import math
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional
+
+from .token_budget import MESSAGE_OVERHEAD_TOKENS
+
+# Caracteres por token da estimativa da janela (mesma razão do estimador de token_budget)
+CHARS_PER_TOKEN = float(os.getenv('TOKEN_CHARS_PER_TOKEN', 3.5))
+
+
+def _estimate_size(value: Any) -> int:
+    """Estimativa barata do tamanho em bytes de uma mensagem (strings dominam)"""
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(str(k)) + _estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_estimate_size(v) for v in value)
+    return 8
+
+
+def estimate_tokens(message: Dict[str, Any]) -> int:
+    """Tokens de uma mensagem do histórico (contagem memorizada pelo empacotador ou estimativa)"""
+    cached = message.get('token_count')
+    if cached:
+        return cached['tokens']
+    return math.ceil(len(message.get('content') or '') / CHARS_PER_TOKEN) + MESSAGE_OVERHEAD_TOKENS
+
+
+class _CacheEntry:
+    """Mensagens de uma sessão, resumo das anteriores, versão no banco e tamanho estimado"""
+    
+    __slots__ = ('messages', 'summary', 'version', 'size', 'tokens')
+    
+    def __init__(self, messages: List[Dict[str, Any]], summary: Optional[Dict[str, Any]] = None,
+                 version: Optional[int] = None):
+        self.messages = messages
+        self.summary = summary
+        self.version = version
+        self.size = sum(_estimate_size(msg) for msg in messages) + _estimate_size(summary or {})
+        self.tokens = sum(estimate_tokens(msg) for msg in messages)
+
+
+class SessionContextCache:
+    """
+    Cache LRU write-through das mensagens recentes por sessão
+    
+    Entradas guardam, em ordem cronológica, as mensagens recentes que somam
+    até max_tokens tokens estimados (o maior orçamento de contexto, para que
+    o empacotador possa preenchê-lo mesmo com turnos curtos), com teto de
+    max_messages mensagens. Ao exceder um dos limites, as mais antigas são
+    descartadas em bloco (trim_ratio dos tokens ou trim_step mensagens), para
+    que o início do histórico (prefixo do prompt reaproveitado pelo cache do
+    provedor) não mude a cada turno. Sessões menos usadas são removidas
+    quando o total de sessões ou de bytes ultrapassa o limite.
+    """
+    
+    def __init__(self, max_sessions: int = 256, max_bytes: int = 64 * 1024 * 1024, max_messages: int = 200,
+                 trim_step: int = 1, max_tokens: int = 8000, trim_ratio: float = 0.25):
+        """
+        Args:
+            max_sessions: Número máximo de sessões em cache
+            max_bytes: Tamanho máximo estimado do cache em bytes
+            max_messages: Teto de mensagens mantidas por sessão
+            trim_step: Mensagens descartadas de uma vez ao exceder max_messages
+            max_tokens: Tokens estimados mantidos por sessão (fit_token_budget aumenta)
+            trim_ratio: Fração de max_tokens liberada de uma vez ao exceder o limite
+        """
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.trim_step = max(1, min(trim_step, max_messages))
+        self.max_tokens = max_tokens
+        self.trim_ratio = min(max(trim_ratio, 0.0), 0.9)
+        
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+    
+    def get(self, session_id: str) -> Optional[List[Dict[str, Any]]]:
+        """Retorna cópia das mensagens da sessão ou None se não estiver em cache"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            return list(entry.messages)
+    
+    def put(self, session_id: str, messages: List[Dict[str, Any]], summary: Optional[Dict[str, Any]] = None,
+            version: Optional[int] = None) -> None:
+        """Substitui as mensagens (e o resumo) da sessão (ex: após carregar do banco)"""
+        with self._lock:
+            window = self._trim(list(messages), self.max_tokens, self.max_messages)
+            self._store(session_id, window, summary, version)
+    
+    def fit_token_budget(self, tokens: int) -> None:
+        """Garante janela de ao menos tokens por sessão (o maior orçamento de contexto em uso)"""
+        with self._lock:
+            self.max_tokens = max(self.max_tokens, int(tokens))
+    
+    def window_chars(self) -> int:
+        """Caracteres de conteúdo que cabem na janela (limite da carga do banco)"""
+        return int(self.max_tokens * CHARS_PER_TOKEN)
+    
+    def get_version(self, session_id: str) -> Optional[int]:
+        """Versão do banco refletida pela entrada (None se não rastreada)"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            return entry.version if entry else None
+    
+    def advance_version(self, session_id: str, before: int, after: int) -> None:
+        """
+        Acompanha um commit local (listener da fila de escrita)
+        
+        Se a entrada estava na versão anterior ao commit, passa para a nova;
+        caso contrário outro processo escreveu no meio e a entrada é descartada.
+        """
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or entry.version is None:
+                return
+            if entry.version == before:
+                entry.version = after
+            else:
+                self._entries.pop(session_id)
+                self._bytes -= entry.size
+                self.stale += 1
+    
+    def get_summary(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Retorna o resumo da sessão em cache (sem afetar contadores/LRU)"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            return entry.summary if entry else None
+    
+    def set_summary(self, session_id: str, summary: Dict[str, Any]) -> bool:
+        """Atualiza o resumo de uma sessão em cache"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return False
+            self._store(session_id, entry.messages, summary, entry.version)
+            return True
+    
+    def append(self, session_id: str, messages: List[Dict[str, Any]], create: bool = False) -> bool:
+        """
+        Acrescenta mensagens a uma sessão em cache (write-through)
+        
+        Args:
+            session_id: ID da sessão
+            messages: Novas mensagens, em ordem cronológica
+            create: Cria a entrada se a sessão não estiver em cache. Só deve
+                ser usado quando o cache é a única fonte do histórico; caso
+                contrário a entrada ficaria incompleta
+        
+        Returns:
+            True se a sessão foi atualizada
+        """
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None and not create:
+                return False
+            updated = (entry.messages if entry else []) + list(messages)
+            tokens = (entry.tokens if entry else 0) + sum(estimate_tokens(msg) for msg in messages)
+            if len(updated) > self.max_messages or tokens > self.max_tokens:
+                # Descarta em bloco, preservando ao menos as mensagens novas
+                updated = self._trim(
+                    updated,
+                    int(self.max_tokens * (1 - self.trim_ratio)),
+                    self.max_messages - self.trim_step,
+                    keep=min(len(messages), self.max_messages)
+                )
+            self._store(session_id, updated, entry.summary if entry else None, entry.version if entry else None)
+            return True
+    
+    def invalidate(self, session_id: str, stale: bool = False) -> bool:
+        """
+        Remove a sessão do cache
+        
+        Args:
+            session_id: ID da sessão
+            stale: Entrada desatualizada por escrita de outro processo (métrica)
+        """
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is None:
+                return False
+            self._bytes -= entry.size
+            if stale:
+                self.stale += 1
+            return True
+    
+    def clear(self) -> None:
+        """Remove todas as sessões do cache"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+    
+    def sessions(self) -> Dict[str, Dict[str, Any]]:
+        """Resumo das sessões em cache (mais recente por último)"""
+        with self._lock:
+            return {
+                session_id: {
+                    'message_count': len(entry.messages),
+                    'tokens': entry.tokens,
+                    'last_activity': entry.messages[-1].get('timestamp') if entry.messages else None,
+                    'size_bytes': entry.size
+                }
+                for session_id, entry in self._entries.items()
+            }
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+    
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._entries
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Retorna métricas do cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'sessions': len(self._entries),
+                'bytes': self._bytes,
+                'max_sessions': self.max_sessions,
+                'max_bytes': self.max_bytes,
+                'max_tokens': self.max_tokens,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'stale': self.stale
+            }
+    
+    @staticmethod
+    def _trim(messages: List[Dict[str, Any]], max_tokens: int, max_messages: int, keep: int = 0) -> List[Dict[str, Any]]:
+        """Sufixo mais recente dentro dos limites de tokens e mensagens (mantendo ao menos keep)"""
+        tokens = [estimate_tokens(msg) for msg in messages]
+        total = sum(tokens)
+        start = 0
+        while len(messages) - start > keep and (total > max_tokens or len(messages) - start > max_messages):
+            total -= tokens[start]
+            start += 1
+        return messages[start:]
+    
+    def _store(self, session_id: str, messages: List[Dict[str, Any]], summary: Optional[Dict[str, Any]] = None,
+               version: Optional[int] = None) -> None:
+        """Grava entrada e aplica limites (chamar com lock)"""
+        old = self._entries.pop(session_id, None)
+        if old is not None:
+            self._bytes -= old.size
+        
+        entry = _CacheEntry(messages, summary, version)
+        if entry.size > self.max_bytes:
+            # Sessão sozinha excede o limite: não vale a pena cachear
+            self.evictions += 1
+            return
+        
+        self._entries[session_id] = entry
+        self._bytes += entry.size
+        
+        while self._entries and (len(self._entries) > self.max_sessions or self._bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            self.evictions += 1
+
+
+# Instância global (compartilhada entre instâncias do agente)
+_session_cache = None
+
+
+def get_session_cache() -> SessionContextCache:
+    """Retorna instância singleton do SessionContextCache"""
+    global _session_cache
+    if _session_cache is None:
+        _session_cache = SessionContextCache(
+            max_sessions=int(os.getenv('CONTEXT_CACHE_MAX_SESSIONS', 256)),
+            max_bytes=int(os.getenv('CONTEXT_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+            max_messages=int(os.getenv('CONTEXT_CACHE_MAX_MESSAGES', 200)),
+            trim_step=int(os.getenv('CONTEXT_CACHE_TRIM_STEP', 8)),
+            max_tokens=int(os.getenv('CONTEXT_CACHE_MAX_TOKENS', 8000)),
+            trim_ratio=float(os.getenv('CONTEXT_CACHE_TRIM_RATIO', 0.25))
+        )
+    return _session_cache
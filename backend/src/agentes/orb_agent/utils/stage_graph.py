@@ -0,0 +1,275 @@
+"""
+Executor de etapas do pipeline do Agente ORB
+As etapas declaram entradas e saída; o executor monta o grafo de dependências
+e inicia concorrentemente as etapas independentes, cada uma com timeout,
+política de retentativa e cache de resultado próprios
+"""
+
+import asyncio
+import inspect
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Iterable, List, Optional, Sequence, Set, Tuple
+
+
+class StageTimeoutError(RuntimeError):
+    """Etapa excedeu o tempo limite"""
+    pass
+
+
+class Stage:
+    """
+    Etapa do pipeline
+    
+    func recebe as entradas declaradas como argumentos nomeados e retorna o
+    valor da saída (pode ser síncrona ou assíncrona). Entradas são nomes de
+    valores iniciais do grafo ou saídas de outras etapas.
+    """
+    
+    def __init__(self, name: str, func: Callable[..., Any], inputs: Sequence[str] = (),
+                 output: Optional[str] = None, timeout: Optional[float] = None,
+                 retries: int = 0, retry_delay: float = 0.0,
+                 retry_on: Tuple[type, ...] = (Exception,),
+                 cache_ttl: Optional[float] = None, cache_size: int = 256,
+                 cache_key: Optional[Callable[[Dict[str, Any]], Any]] = None):
+        """
+        Args:
+            name: Nome da etapa (usado nas métricas)
+            func: Função da etapa
+            inputs: Nomes dos valores de entrada
+            output: Nome do valor produzido (padrão: nome da etapa)
+            timeout: Tempo limite por tentativa em segundos (None = sem limite)
+            retries: Tentativas extras após falha ou timeout
+            retry_delay: Espera antes da primeira retentativa (dobra a cada tentativa)
+            retry_on: Exceções que disparam retentativa
+            cache_ttl: Validade do resultado em cache em segundos (None = sem cache)
+            cache_size: Entradas mantidas no cache da etapa
+            cache_key: Chave do cache a partir das entradas (padrão: tupla das entradas)
+        """
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.output = output or name
+        self.timeout = timeout
+        self.retries = max(0, retries)
+        self.retry_delay = retry_delay
+        self.retry_on = retry_on
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.cache_key = cache_key
+        
+        self._cache: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self.runs = 0
+        self.failures = 0
+        self.retried = 0
+        self.timeouts = 0
+        self.cache_hits = 0
+    
+    def _key(self, kwargs: Dict[str, Any]) -> Any:
+        if self.cache_key is not None:
+            return self.cache_key(kwargs)
+        return tuple(kwargs[name] for name in self.inputs)
+    
+    def _cache_get(self, key: Any) -> Tuple[bool, Any]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return False, None
+        expires, value = entry
+        if time.monotonic() >= expires:
+            del self._cache[key]
+            return False, None
+        self._cache.move_to_end(key)
+        return True, value
+    
+    def _cache_put(self, key: Any, value: Any) -> None:
+        self._cache[key] = (time.monotonic() + self.cache_ttl, value)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+    
+    async def _call(self, kwargs: Dict[str, Any]) -> Any:
+        result = self.func(**kwargs)
+        if inspect.isawaitable(result):
+            if self.timeout:
+                try:
+                    async with asyncio.timeout(self.timeout):
+                        return await result
+                except TimeoutError:
+                    self.timeouts += 1
+                    raise StageTimeoutError(f"Etapa '{self.name}' excedeu {self.timeout}s")
+            return await result
+        return result
+    
+    async def execute(self, kwargs: Dict[str, Any]) -> Any:
+        """Executa a etapa aplicando cache, timeout e retentativas"""
+        key = None
+        if self.cache_ttl:
+            try:
+                key = self._key(kwargs)
+                hit, value = self._cache_get(key)
+            except TypeError:
+                # Entradas não hasheáveis: executa sem cache
+                key, hit, value = None, False, None
+            if hit:
+                self.cache_hits += 1
+                return value
+        
+        self.runs += 1
+        delay = self.retry_delay
+        attempt = 0
+        while True:
+            try:
+                value = await self._call(kwargs)
+                break
+            except self.retry_on as e:
+                if attempt >= self.retries:
+                    self.failures += 1
+                    raise
+                attempt += 1
+                self.retried += 1
+                logging.getLogger(__name__).warning(
+                    f"Etapa '{self.name}' falhou ({e}), tentativa {attempt + 1}/{self.retries + 1}"
+                )
+                if delay:
+                    await asyncio.sleep(delay)
+                    delay *= 2
+        
+        if key is not None:
+            self._cache_put(key, value)
+        return value
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Retorna métricas da etapa"""
+        return {
+            'inputs': list(self.inputs),
+            'runs': self.runs,
+            'failures': self.failures,
+            'retries': self.retried,
+            'timeouts': self.timeouts,
+            'cache_hits': self.cache_hits
+        }
+
+
+class StageGraph:
+    """
+    Grafo de etapas executado com concorrência máxima
+    
+    Cada etapa começa assim que suas entradas estão disponíveis; etapas sem
+    dependência entre si rodam em paralelo. Se uma etapa falhar, as demais
+    em andamento são canceladas e a exceção é propagada.
+    """
+    
+    def __init__(self, stages: Iterable[Stage]):
+        self.stages: Dict[str, Stage] = {}
+        self._producers: Dict[str, Stage] = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"Etapa duplicada: {stage.name}")
+            if stage.output in self._producers:
+                raise ValueError(f"Saída '{stage.output}' produzida por mais de uma etapa")
+            self.stages[stage.name] = stage
+            self._producers[stage.output] = stage
+        self._order = self._topological_order()
+    
+    def _topological_order(self) -> List[Stage]:
+        """Ordena etapas por dependência (rejeita ciclos)"""
+        order: List[Stage] = []
+        state: Dict[str, int] = {}
+        
+        def visit(stage: Stage, path: Tuple[str, ...]):
+            if state.get(stage.name) == 2:
+                return
+            if state.get(stage.name) == 1:
+                raise ValueError(f"Ciclo entre etapas: {' -> '.join(path + (stage.name,))}")
+            state[stage.name] = 1
+            for name in stage.inputs:
+                producer = self._producers.get(name)
+                if producer is not None:
+                    visit(producer, path + (stage.name,))
+            state[stage.name] = 2
+            order.append(stage)
+        
+        for stage in self.stages.values():
+            visit(stage, ())
+        return order
+    
+    def _required(self, targets: Optional[Iterable[str]]) -> List[Stage]:
+        """Etapas necessárias para produzir os alvos, em ordem topológica"""
+        if targets is None:
+            return list(self._order)
+        
+        needed: Set[str] = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            producer = self._producers.get(name) or self.stages.get(name)
+            if producer is None or producer.name in needed:
+                continue
+            needed.add(producer.name)
+            pending.extend(producer.inputs)
+        return [stage for stage in self._order if stage.name in needed]
+    
+    async def run(self, inputs: Dict[str, Any], targets: Optional[Iterable[str]] = None, timer=None) -> Dict[str, Any]:
+        """
+        Executa o grafo
+        
+        Args:
+            inputs: Valores iniciais
+            targets: Saídas (ou etapas) desejadas; None executa todas as etapas
+            timer: PipelineTimer que recebe o tempo de cada etapa (opcional)
+        
+        Returns:
+            Valores iniciais mais as saídas das etapas executadas
+        """
+        stages = self._required(targets)
+        for stage in stages:
+            missing = [name for name in stage.inputs if name not in inputs and name not in self._producers]
+            if missing:
+                raise ValueError(f"Etapa '{stage.name}' sem entradas: {', '.join(missing)}")
+        
+        values = dict(inputs)
+        tasks: Dict[str, asyncio.Task] = {}
+        
+        async def run_stage(stage: Stage) -> Any:
+            kwargs = {}
+            for name in stage.inputs:
+                if name in values:
+                    kwargs[name] = values[name]
+                else:
+                    kwargs[name] = await tasks[self._producers[name].name]
+            if timer is not None:
+                with timer.stage(stage.name):
+                    return await stage.execute(kwargs)
+            return await stage.execute(kwargs)
+        
+        # Ordem topológica: produtores são criados antes dos consumidores
+        for stage in stages:
+            tasks[stage.name] = asyncio.create_task(run_stage(stage))
+        
+        if not tasks:
+            return values
+        
+        try:
+            await asyncio.wait(tasks.values(), return_when=asyncio.FIRST_EXCEPTION)
+            # Propaga a falha da etapa mais a montante (consumidores repetem a exceção do produtor)
+            for stage in stages:
+                task = tasks[stage.name]
+                if task.done() and not task.cancelled() and task.exception() is not None:
+                    raise task.exception()
+        finally:
+            for task in tasks.values():
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    # Marca a exceção repetida pelos consumidores como lida
+                    # (evita o aviso "Task exception was never retrieved")
+                    task.exception()
+        
+        for stage in stages:
+            values[stage.output] = tasks[stage.name].result()
+        return values
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Métricas por etapa"""
+        return {name: stage.get_stats() for name, stage in self.stages.items()}
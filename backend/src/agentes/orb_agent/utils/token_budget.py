@@ -0,0 +1,162 @@
+"""
+Orçamento de tokens do contexto para o Agente ORB
+Conta tokens (tiktoken quando disponível, estimador calibrável como fallback)
+e empacota o histórico da conversa dentro do orçamento do modelo
+"""
+
+import math
+import os
+import logging
+from typing import Dict, List, Any, Optional, Tuple
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+# Overhead aproximado por mensagem no formato de chat (role, separadores)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Estimativa de tokens por imagem enviada na mensagem atual
+IMAGE_TOKEN_ESTIMATE = int(os.getenv('IMAGE_TOKEN_ESTIMATE', 1000))
+
+
+class TokenCounter:
+    """Contador de tokens por modelo"""
+    
+    def __init__(self, model: str, chars_per_token: Optional[float] = None):
+        """
+        Args:
+            model: Nome do modelo (usado para escolher o encoding do tiktoken)
+            chars_per_token: Razão caracteres/token do estimador (fallback)
+        """
+        self.model = model
+        self.chars_per_token = chars_per_token or float(os.getenv('TOKEN_CHARS_PER_TOKEN', 3.5))
+        self.logger = logging.getLogger(__name__)
+        
+        self._encoding = self._load_encoding(model)
+        if self._encoding is not None:
+            self.name = f"tiktoken:{self._encoding.name}"
+        else:
+            self.name = f"estimate:{self.chars_per_token}"
+    
+    def _load_encoding(self, model: str):
+        """Carrega encoding do tiktoken para o modelo (None se indisponível)"""
+        if not TIKTOKEN_AVAILABLE:
+            return None
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            # Modelos não-OpenAI (ex: Claude): o encoding mais recente é uma boa aproximação
+            pass
+        except Exception as e:
+            self.logger.warning(f"Erro ao carregar tokenizer para {model}: {e}, usando estimador")
+            return None
+        
+        try:
+            return tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            # Ex: sem rede para baixar o arquivo do encoding
+            self.logger.warning(f"Erro ao carregar tokenizer o200k_base para {model}: {e}, usando estimador")
+            return None
+    
+    def count_text(self, text: str) -> int:
+        """Conta tokens de um texto"""
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return math.ceil(len(text) / self.chars_per_token)
+    
+    def count_message(self, message: Dict[str, Any]) -> int:
+        """
+        Conta tokens de uma mensagem do histórico
+        
+        O resultado é memorizado na própria mensagem ('token_count'), então
+        mensagens mantidas no cache de contexto são contadas uma única vez.
+        """
+        cached = message.get('token_count')
+        if cached and cached.get('counter') == self.name:
+            return cached['tokens']
+        
+        tokens = self.count_text(message.get('content') or '') + MESSAGE_OVERHEAD_TOKENS
+        message['token_count'] = {'counter': self.name, 'tokens': tokens}
+        return tokens
+
+
+class ContextPacker:
+    """
+    Empacota o histórico dentro do orçamento de tokens do modelo
+    
+    Reserva espaço para o prompt do sistema, a mensagem atual (e imagem) e
+    max_tokens da resposta; o restante é preenchido com o histórico, da
+    mensagem mais recente para a mais antiga, parando na primeira que não
+    couber (o histórico enviado é sempre um sufixo contíguo da conversa).
+    """
+    
+    def __init__(self, counter: TokenCounter, budget: int, reserve_output: int, safety_margin: int = 64):
+        """
+        Args:
+            counter: Contador de tokens do modelo
+            budget: Orçamento total de tokens por requisição
+            reserve_output: Tokens reservados para a resposta (max_tokens)
+            safety_margin: Folga para erros de estimativa
+        """
+        self.counter = counter
+        self.budget = budget
+        self.reserve_output = reserve_output
+        self.safety_margin = safety_margin
+    
+    def pack(self, history: List[Dict[str, Any]], system_prompt: str, user_input: str,
+             image_count: int = 0, image_tokens: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Seleciona o histórico que cabe no orçamento
+        
+        Args:
+            image_tokens: Custo estimado das imagens (padrão: image_count * IMAGE_TOKEN_ESTIMATE)
+        
+        Returns:
+            (histórico empacotado em ordem cronológica, estatísticas)
+        """
+        fixed_tokens = (
+            self.counter.count_text(system_prompt) + MESSAGE_OVERHEAD_TOKENS
+            + self.counter.count_text(user_input) + MESSAGE_OVERHEAD_TOKENS
+            + (image_tokens if image_tokens is not None else image_count * IMAGE_TOKEN_ESTIMATE)
+        )
+        available = self.budget - self.reserve_output - self.safety_margin - fixed_tokens
+        
+        packed = []
+        history_tokens = 0
+        for message in reversed(history):
+            tokens = self.counter.count_message(message)
+            if history_tokens + tokens > available:
+                break
+            packed.append(message)
+            history_tokens += tokens
+        packed.reverse()
+        
+        stats = {
+            'counter': self.counter.name,
+            'budget': self.budget,
+            'reserved_output': self.reserve_output,
+            'fixed_tokens': fixed_tokens,
+            'history_tokens': history_tokens,
+            'prompt_tokens': fixed_tokens + history_tokens,
+            'messages_included': len(packed),
+            'messages_dropped': len(history) - len(packed)
+        }
+        return packed, stats
+
+
+# Contadores por modelo (carregar encodings é caro)
+_token_counters: Dict[str, TokenCounter] = {}
+
+
+def get_token_counter(model: str) -> TokenCounter:
+    """Retorna contador de tokens do modelo (cacheado)"""
+    counter = _token_counters.get(model)
+    if counter is None:
+        counter = TokenCounter(model)
+        _token_counters[model] = counter
+    return counter
@@ -5,8 +5,10 @@ ORB API - Aplicação principal FastAPI
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+import asyncio
 import logging
 import os
+from typing import List
 
 # Importa routers
 from .routers import health, agent, websocket, system, history, config
@@ -99,6 +101,17 @@ app.include_router(system.router, prefix="/api/v1")
 app.include_router(history.router, prefix="/api/v1")
 app.include_router(config.router, prefix="/api/v1")
 
+def _configured_llm_providers() -> List[str]:
+    """Provedor ativo no banco, se tiver API key (mesma fonte usada pelo agente)"""
+    try:
+        from database.config_manager import ConfigManager
+        llm_config = ConfigManager().get_llm_config()
+        if llm_config.get('api_key'):
+            return [llm_config.get('provider', 'openai')]
+    except Exception as e:
+        logger.warning(f"Configuração do LLM indisponível para aquecimento: {str(e)}")
+    return []
+
 @app.on_event("startup")
 async def startup_event():
     """
@@ -106,6 +119,17 @@ async def startup_event():
     """
     try:
         logger.info("Iniciando ORB Backend API...")
+        
+        # Imagens base64 de mensagens antigas vão para image_blobs em background
+        # (só um worker migra quando há vários)
+        if os.getenv("ORB_WORKER_INDEX", "0") == "0":
+            asyncio.get_running_loop().run_in_executor(None, history.chat_memory.migrate_inline_images)
+        
+        # Abre conexões com os provedores configurados antes do primeiro turno
+        # (o ativo no banco, onde o agente busca a chave, e os com chave no ambiente)
+        from agentes.orb_agent.llms.http_clients import register_configured_providers
+        register_configured_providers(await asyncio.to_thread(_configured_llm_providers))
+        
         logger.info("API pronta para receber conexões")
         
     except Exception as e:
@@ -118,6 +142,53 @@ async def shutdown_event():
     Evento de encerramento da aplicação
     """
     logger.info("Encerrando ORB Backend API...")
+    
+    # Aguarda atualizações de resumo em andamento
+    try:
+        from agentes.orb_agent.memory import session_summarizer
+        if session_summarizer._session_summarizer is not None:
+            await session_summarizer._session_summarizer.wait_idle(timeout=5.0)
+    except Exception as e:
+        logger.error(f"Erro ao aguardar resumos de sessão: {str(e)}")
+    
+    # Grava turnos de chat ainda pendentes na fila write-behind
+    try:
+        from database.chat_memory import close_write_queues
+        if not close_write_queues(timeout=10.0):
+            logger.warning("Fila de escrita do chat não esvaziou no shutdown")
+    except Exception as e:
+        logger.error(f"Erro ao gravar turnos pendentes: {str(e)}")
+    
+    # Grava registros de uso do LLM ainda pendentes
+    try:
+        from database.usage_store import close_usage_stores
+        if not close_usage_stores(timeout=10.0):
+            logger.warning("Contabilidade de uso não esvaziou no shutdown")
+    except Exception as e:
+        logger.error(f"Erro ao gravar uso pendente: {str(e)}")
+    
+    # Encerra o pool de processos de recodificação de imagens
+    try:
+        from agentes.orb_agent.utils import image_pipeline
+        if image_pipeline._image_preprocessor is not None:
+            image_pipeline._image_preprocessor.shutdown()
+    except Exception as e:
+        logger.error(f"Erro ao encerrar pool de imagens: {str(e)}")
+    
+    try:
+        from . import screen_capture
+        if screen_capture._screen_capture is not None:
+            screen_capture._screen_capture.shutdown()
+    except Exception as e:
+        logger.error(f"Erro ao encerrar captura de tela: {str(e)}")
+    
+    # Fecha o pool de conexões compartilhado dos provedores LLM
+    try:
+        from agentes.orb_agent.llms import http_clients
+        if http_clients._provider_clients is not None:
+            await http_clients._provider_clients.aclose()
+    except Exception as e:
+        logger.error(f"Erro ao fechar clientes HTTP dos provedores: {str(e)}")
 
 # Endpoint raiz
 @app.get("/")
@@ -2,9 +2,14 @@
 Router do Agente ORB
 """
 
-from fastapi import APIRouter, HTTPException, Depends
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, Any, List, Union
+import asyncio
+from contextlib import aclosing
+import hashlib
+import json
 import uuid
 from datetime import datetime
 
@@ -15,6 +20,9 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 
 router = APIRouter(prefix="/agent", tags=["agent"])
 
+# Tamanho máximo das imagens enviadas em binário
+IMAGE_UPLOAD_MAX_BYTES = int(os.getenv("IMAGE_UPLOAD_MAX_BYTES", 20 * 1024 * 1024))
+
 # Instância global do agente (singleton para performance)
 _agente_instance = None
 
@@ -50,10 +58,25 @@ class MessageResponse(BaseModel):
     session_id: str
     timestamp: str
     model_used: Optional[str] = None
+    model_tier: Optional[str] = None
     provider: Optional[str] = None
     tool_used: Optional[str] = None
     reasoning: Optional[str] = None
     error: Optional[str] = None
+    timings: Optional[Dict[str, Any]] = None
+    usage: Optional[Dict[str, int]] = None
+    cache_hit: bool = False
+
+class BatchItem(BaseModel):
+    id: Optional[Union[str, int]] = None
+    message: str
+    session_id: Optional[str] = None
+    image_data: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem] = Field(..., max_length=10000)
+    concurrency: Optional[int] = Field(None, ge=1, le=64)
+    batch_id: Optional[str] = None
 
 class AgentStatusResponse(BaseModel):
     name: str
@@ -66,6 +89,53 @@ class AgentStatusResponse(BaseModel):
     active_sessions: int
     timestamp: str
     components: Dict[str, bool]
+    context_cache: Optional[Dict[str, Any]] = None
+
+def _message_response(response: Dict[str, Any], session_id: str) -> MessageResponse:
+    """Resposta da API a partir do resultado do agente"""
+    return MessageResponse(
+        content=response.get('content', ''),
+        session_id=session_id,
+        timestamp=response.get('timestamp', datetime.now().isoformat()),
+        model_used=response.get('model_used'),
+        model_tier=response.get('model_tier'),
+        provider=response.get('provider'),
+        tool_used=response.get('tool_used'),
+        reasoning=response.get('reasoning'),
+        error=response.get('error'),
+        timings=response.get('timings'),
+        usage=response.get('usage'),
+        cache_hit=response.get('cache_hit', False)
+    )
+
+async def _read_image_body(request: Request) -> 'ImageBlob':
+    """
+    Lê o corpo da requisição (bytes da imagem) em blocos, calculando o
+    SHA-256 durante a leitura: a imagem fica numa única cópia em memória,
+    repassada ao pipeline como memoryview
+    """
+    from database.image_store import ImageBlob
+    
+    declared = request.headers.get('content-length')
+    if declared:
+        try:
+            declared_size = int(declared)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Content-Length inválido")
+        if declared_size > IMAGE_UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"Imagem maior que {IMAGE_UPLOAD_MAX_BYTES} bytes")
+    
+    digest = hashlib.sha256()
+    buffer = bytearray()
+    async for chunk in request.stream():
+        if len(buffer) + len(chunk) > IMAGE_UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"Imagem maior que {IMAGE_UPLOAD_MAX_BYTES} bytes")
+        digest.update(chunk)
+        buffer += chunk
+    
+    if not buffer:
+        raise HTTPException(status_code=400, detail="Corpo da requisição vazio (envie os bytes da imagem)")
+    return ImageBlob(memoryview(buffer), sha256=digest.hexdigest())
 
 @router.post("/message", response_model=MessageResponse)
 async def send_message(
@@ -87,19 +157,47 @@ async def send_message(
         )
         
         # Formata resposta
-        return MessageResponse(
-            content=response.get('content', ''),
+        return _message_response(response, session_id)
+        
+    except ValueError as e:
+        # Erro de configuração (ex: API key não configurada)
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Erro ao processar mensagem: {str(e)}"
+        )
+
+@router.post("/message/image", response_model=MessageResponse)
+async def send_message_with_image(
+    request: Request,
+    message: str,
+    session_id: Optional[str] = None,
+    agente = Depends(get_agente)
+):
+    """
+    Envia mensagem com imagem em binário (sem base64)
+    
+    O corpo da requisição são os bytes da imagem (Content-Type image/png,
+    image/jpeg, image/webp ou application/octet-stream; o tipo real é
+    detectado pelo conteúdo); message e session_id vão na query string.
+    A imagem não é copiada para JSON nem base64 no caminho até o pipeline
+    e o histórico.
+    """
+    image = await _read_image_body(request)
+    try:
+        session_id = session_id or str(uuid.uuid4())
+        response = await agente.process_message(
+            message=message,
             session_id=session_id,
-            timestamp=response.get('timestamp', datetime.now().isoformat()),
-            model_used=response.get('model_used'),
-            provider=response.get('provider'),
-            tool_used=response.get('tool_used'),
-            reasoning=response.get('reasoning'),
-            error=response.get('error')
+            image_data=image
         )
+        return _message_response(response, session_id)
         
     except ValueError as e:
-        # Erro de configuração (ex: API key não configurada)
         raise HTTPException(
             status_code=400,
             detail=str(e)
@@ -110,6 +208,90 @@ async def send_message(
             detail=f"Erro ao processar mensagem: {str(e)}"
         )
 
+@router.post("/message/stream")
+async def stream_message(
+    request: MessageRequest,
+    agente = Depends(get_agente)
+):
+    """
+    Envia mensagem para o agente e recebe a resposta via Server-Sent Events
+    
+    Eventos emitidos:
+        delta: {"content": "..."} para cada trecho gerado
+        response: mesmo formato de MessageResponse, ao final
+    """
+    # Gera session_id se não fornecido
+    session_id = request.session_id or str(uuid.uuid4())
+    
+    async def event_stream():
+        async with aclosing(agente.stream_message(
+            message=request.message,
+            session_id=session_id,
+            image_data=request.image_data
+        )) as events:
+            async for event in events:
+                if event['type'] == 'delta':
+                    payload = {'content': event['content'], 'session_id': session_id}
+                else:
+                    response = event['response']
+                    payload = _message_response(response, session_id).model_dump()
+                yield f"event: {event['type']}\ndata: {json.dumps(payload)}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/batch")
+async def process_batch(
+    request: BatchRequest,
+    agente = Depends(get_agente)
+):
+    """
+    Processa várias mensagens com concorrência limitada
+    
+    Resposta em NDJSON: uma linha por entrada, na ordem em que terminam,
+    com o id da entrada (posição na lista se não informado). Com batch_id,
+    resultados concluídos são gravados no banco; reenviar o mesmo lote com
+    o mesmo batch_id devolve os já concluídos (resumed: true) e processa
+    apenas o restante.
+    """
+    from agentes.orb_agent.batch import BatchRunner, normalize_item
+    
+    store = None
+    completed: Dict[str, Dict[str, Any]] = {}
+    if request.batch_id and agente.chat_memory:
+        from database.batch_store import BatchCheckpointStore
+        store = BatchCheckpointStore(agente.chat_memory.db_path)
+        completed = await asyncio.to_thread(store.completed, request.batch_id)
+    
+    items = [normalize_item(item.model_dump(), index) for index, item in enumerate(request.items)]
+    runner = BatchRunner(agente, request.concurrency)
+    
+    async def result_stream():
+        for item in items:
+            result = completed.get(str(item['id']))
+            if result is not None:
+                yield json.dumps({**result, 'resumed': True}) + "\n"
+        
+        buffer = []
+        try:
+            async for result in runner.run(items, set(completed)):
+                if store is not None and not result.get('error'):
+                    buffer.append((str(result['id']), result))
+                    if len(buffer) >= 32:
+                        await asyncio.to_thread(store.save, request.batch_id, buffer)
+                        buffer = []
+                yield json.dumps(result) + "\n"
+        finally:
+            # Checkpoint do que terminou, mesmo se o cliente desconectar (a gravação
+            # segue na thread mesmo que esta espera seja cancelada)
+            if store is not None and buffer:
+                await asyncio.to_thread(store.save, request.batch_id, buffer)
+    
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
+
 @router.get("/status", response_model=AgentStatusResponse)
 async def get_agent_status(
     agente = Depends(get_agente)
@@ -127,6 +309,94 @@ async def get_agent_status(
             detail=f"Erro ao obter status: {str(e)}"
         )
 
+@router.get("/metrics")
+async def get_agent_metrics(
+    agente = Depends(get_agente)
+):
+    """
+    Retorna métricas do pipeline: percentis de tempo por etapa (ms),
+    retentativas/timeouts/cache por etapa, uso de tokens (incluindo cache de prompt do provedor), concorrência (incluindo limites adaptativos por provedor/modelo), caches, conexões, tentativas (retentativas/hedge) e saúde dos backends dos provedores e escolhas de modelo por faixa
+    """
+    try:
+        from agentes.orb_agent.utils.concurrency import get_llm_limiter, get_adaptive_limiters
+        from agentes.orb_agent.utils.metrics import get_pipeline_histograms, get_usage_totals
+        from agentes.orb_agent.utils.image_pipeline import get_image_preprocessor
+        from agentes.orb_agent.llms.http_clients import get_provider_clients
+        from agentes.orb_agent.llms.resilience import get_resilience_stats, get_latency_tracker
+        from agentes.orb_agent.llms.router import get_backend_health
+        from agentes.orb_agent.utils.model_router import get_model_routing_stats
+        
+        return {
+            "pipeline_timings": get_pipeline_histograms().snapshot(),
+            "token_usage": get_usage_totals().snapshot(),
+            "pipeline_stages": agente.pipeline.get_stats(),
+            "llm_limiter": get_llm_limiter().get_stats(),
+            "adaptive_limits": get_adaptive_limiters().get_stats(),
+            "session_locks": agente.session_locks.get_stats(),
+            "context_cache": agente.context_cache.get_stats(),
+            "response_cache": agente.llm_provider.response_cache.get_stats() if agente.llm_provider.response_cache else None,
+            "semantic_cache": agente.llm_provider.semantic_cache.get_stats() if agente.llm_provider.semantic_cache else None,
+            "image_pipeline": get_image_preprocessor().get_stats(),
+            "provider_http": get_provider_clients().get_stats(),
+            "llm_backends": get_backend_health().get_stats(),
+            "model_routing": get_model_routing_stats().get_stats(),
+            "provider_attempts": {
+                **get_resilience_stats().get_stats(),
+                "latency": get_latency_tracker().get_stats()
+            },
+            "worker": os.getenv("ORB_WORKER_INDEX"),
+            "timestamp": datetime.now().isoformat()
+        }
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Erro ao obter métricas: {str(e)}"
+        )
+
+@router.get("/usage")
+async def get_usage(
+    granularity: str = "hour",
+    buckets: int = 24,
+    provider: Optional[str] = None,
+    model: Optional[str] = None,
+    session_id: Optional[str] = None,
+    agente = Depends(get_agente)
+):
+    """
+    Uso do LLM (tokens, chamadas, erros e latência) por minuto, hora ou dia
+    
+    Lê os rollups mantidos a cada chamada, sem varrer os eventos.
+    
+    Args:
+        granularity: minute, hour ou day (buckets em UTC)
+        buckets: Número de buckets até o atual (1-1000)
+        provider: Filtra por provedor
+        model: Filtra por modelo
+        session_id: Inclui os totais da sessão
+    """
+    if not agente.chat_memory:
+        raise HTTPException(status_code=503, detail="Banco de dados indisponível")
+    if not 1 <= buckets <= 1000:
+        raise HTTPException(status_code=400, detail="buckets deve estar entre 1 e 1000")
+    try:
+        from database.usage_store import get_usage_store
+        
+        store = get_usage_store(agente.chat_memory.db_path)
+        usage = await asyncio.to_thread(store.rollups, granularity, buckets, None, provider, model)
+        if session_id:
+            usage["session"] = await asyncio.to_thread(store.session_usage, session_id)
+        usage["timestamp"] = datetime.now().isoformat()
+        return usage
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Erro ao obter uso: {str(e)}"
+        )
+
 @router.post("/reset")
 async def reset_agent(
     session_id: str,
@@ -136,9 +406,8 @@ async def reset_agent(
     Reseta o contexto de uma sessão específica
     """
     try:
-        # Remove histórico da sessão
-        if hasattr(agente, 'conversation_history') and session_id in agente.conversation_history:
-            del agente.conversation_history[session_id]
+        # Remove histórico da sessão do cache de contexto
+        agente.context_cache.invalidate(session_id)
         
         return {
             "message": f"Contexto da sessão {session_id} resetado com sucesso",
@@ -160,17 +429,12 @@ async def get_active_sessions(
     Retorna lista de sessões ativas
     """
     try:
-        sessions = {}
-        if hasattr(agente, 'conversation_history'):
-            for session_id, history in agente.conversation_history.items():
-                sessions[session_id] = {
-                    "message_count": len(history),
-                    "last_activity": history[-1]['timestamp'] if history else None
-                }
+        sessions = agente.context_cache.sessions()
         
         return {
             "active_sessions": sessions,
             "total_sessions": len(sessions),
+            "cache": agente.context_cache.get_stats(),
             "timestamp": datetime.now().isoformat()
         }
         
@@ -189,8 +453,7 @@ async def delete_session(
     Remove uma sessão específica
     """
     try:
-        if hasattr(agente, 'conversation_history') and session_id in agente.conversation_history:
-            del agente.conversation_history[session_id]
+        if agente.context_cache.invalidate(session_id):
             message = f"Sessão {session_id} removida com sucesso"
         else:
             message = f"Sessão {session_id} não encontrada"
@@ -2,9 +2,10 @@
 Router de Histórico de Conversas
 Endpoints para gerenciar sessões e mensagens
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Response
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
+import asyncio
 import sys
 from pathlib import Path
 
@@ -14,6 +15,7 @@ if str(database_path) not in sys.path:
     sys.path.insert(0, str(database_path))
 
 from database.chat_memory import ChatMemoryManager, ChatMessage
+from agentes.orb_agent.utils.session_cache import get_session_cache
 
 router = APIRouter(prefix="/history", tags=["history"])
 
@@ -91,19 +93,23 @@ async def get_session(session_id: str):
 
 
 @router.get("/sessions/{session_id}/messages", response_model=List[MessageResponse])
-async def get_session_messages(session_id: str, limit: Optional[int] = None):
+async def get_session_messages(session_id: str, limit: Optional[int] = None, include_images: bool = True):
     """
     Obtém todas as mensagens de uma sessão
     
     Args:
         session_id: ID da sessão
         limit: Limite de mensagens (None = todas)
+        include_images: Inclui as imagens em base64 (additional_kwargs.image_data);
+            com False, só a referência (additional_kwargs.image_ref, ver /history/images)
     
     Returns:
         Lista de mensagens
     """
     try:
         messages = chat_memory.get_messages(session_id, limit=limit)
+        if include_images:
+            messages = chat_memory.resolve_images(messages)
         
         # Converter ChatMessage para dict
         messages_dict = []
@@ -121,13 +127,14 @@ async def get_session_messages(session_id: str, limit: Optional[int] = None):
 
 
 @router.get("/sessions/{session_id}/full", response_model=SessionWithMessagesResponse)
-async def get_session_with_messages(session_id: str, limit: Optional[int] = None):
+async def get_session_with_messages(session_id: str, limit: Optional[int] = None, include_images: bool = True):
     """
     Obtém sessão completa com todas as mensagens
     
     Args:
         session_id: ID da sessão
         limit: Limite de mensagens (None = todas)
+        include_images: Inclui as imagens em base64 (additional_kwargs.image_data)
     
     Returns:
         Sessão com suas mensagens
@@ -141,6 +148,8 @@ async def get_session_with_messages(session_id: str, limit: Optional[int] = None
         
         # Obter mensagens
         messages = chat_memory.get_messages(session_id, limit=limit)
+        if include_images:
+            messages = chat_memory.resolve_images(messages)
         
         # Converter ChatMessage para dict
         messages_dict = []
@@ -162,6 +171,29 @@ async def get_session_with_messages(session_id: str, limit: Optional[int] = None
         raise HTTPException(status_code=500, detail=f"Erro ao obter sessão completa: {str(e)}")
 
 
+@router.get("/images/{sha256}")
+async def get_image(sha256: str):
+    """
+    Obtém os bytes de uma imagem do histórico
+    
+    Args:
+        sha256: Hash da imagem (additional_kwargs.image_ref.sha256)
+    
+    Returns:
+        Imagem no formato original
+    """
+    blob = chat_memory.get_image(sha256)
+    if blob is None:
+        raise HTTPException(status_code=404, detail="Imagem não encontrada")
+    
+    # Conteúdo endereçado pelo hash nunca muda
+    return Response(
+        content=blob.data,
+        media_type=blob.mime_type,
+        headers={"Cache-Control": "public, max-age=31536000, immutable", "ETag": f'"{sha256}"'}
+    )
+
+
 @router.delete("/sessions/{session_id}")
 async def delete_session(session_id: str):
     """
@@ -174,7 +206,9 @@ async def delete_session(session_id: str):
         Confirmação de deleção
     """
     try:
-        success = chat_memory.delete_session(session_id)
+        # Aguarda a fila de escrita e apaga fora do event loop
+        success = await asyncio.to_thread(chat_memory.delete_session, session_id)
+        get_session_cache().invalidate(session_id)
         
         if not success:
             raise HTTPException(status_code=500, detail="Erro ao deletar sessão")
@@ -198,7 +232,8 @@ async def clear_session_messages(session_id: str):
         Confirmação de limpeza
     """
     try:
-        success = chat_memory.clear_all_messages(session_id)
+        success = await asyncio.to_thread(chat_memory.clear_all_messages, session_id)
+        get_session_cache().invalidate(session_id)
         
         if not success:
             raise HTTPException(status_code=500, detail="Erro ao limpar mensagens")
@@ -2,20 +2,52 @@
 Router para funcionalidades do sistema (screenshot, hot corner, etc.)
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Response
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import base64
-import io
+import time
 from datetime import datetime
 import logging
 
+from ..screen_capture import CapturedImage, get_screen_capture
+
 router = APIRouter(prefix="/system", tags=["system"])
 
 # Modelos Pydantic
+class ScreenshotRegion(BaseModel):
+    left: int = 0
+    top: int = 0
+    width: int
+    height: int
+
+class ScreenshotRequest(BaseModel):
+    monitor: int = 1                       # 0 = todos os monitores numa imagem
+    monitors: Optional[List[int]] = None   # vários monitores capturados em paralelo
+    region: Optional[ScreenshotRegion] = None  # relativa ao monitor
+    format: str = "png"                    # png | webp | jpeg
+    compress_level: int = 6                # PNG: 0-9; WebP: 0-6
+    quality: int = 80                      # WebP e JPEG
+
+class ScreenshotCapture(BaseModel):
+    monitor: int
+    image_data: str
+    mime_type: str
+    width: int
+    height: int
+    capture_ms: float
+    encode_ms: float
+
 class ScreenshotResponse(BaseModel):
     success: bool
     image_data: Optional[str] = None
+    mime_type: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    capture_ms: Optional[float] = None
+    encode_ms: Optional[float] = None
+    captures: Optional[List[ScreenshotCapture]] = None
+    total_ms: Optional[float] = None
     error: Optional[str] = None
     timestamp: str
 
@@ -33,51 +65,57 @@ class SystemStatusResponse(BaseModel):
     orb_visible: bool
     timestamp: str
 
+def _to_capture(image: CapturedImage) -> ScreenshotCapture:
+    return ScreenshotCapture(
+        monitor=image.monitor,
+        image_data=base64.b64encode(image.data).decode(),
+        mime_type=image.mime_type,
+        width=image.width,
+        height=image.height,
+        capture_ms=image.capture_ms,
+        encode_ms=image.encode_ms
+    )
+
 @router.post("/screenshot", response_model=ScreenshotResponse)
-async def capture_screenshot():
+async def capture_screenshot(request: Optional[ScreenshotRequest] = None):
     """
     Captura screenshot da tela
+    
+    Captura e codificação rodam fora do event loop. Sem corpo, captura o
+    monitor principal em PNG; com monitors, captura os monitores em
+    paralelo e devolve cada um em captures (image_data = primeiro).
     """
+    request = request or ScreenshotRequest()
+    start = time.perf_counter()
     try:
-        # Tenta usar mss para captura rápida
-        try:
-            import mss
-            with mss.mss() as sct:
-                # Captura a tela principal
-                monitor = sct.monitors[1]  # Monitor principal
-                screenshot = sct.grab(monitor)
-                
-                # Converte para base64
-                from PIL import Image
-                img = Image.frombytes("RGB", screenshot.size, screenshot.bgra, "raw", "BGRX")
-                
-                # Converte para base64
-                buffer = io.BytesIO()
-                img.save(buffer, format="PNG")
-                img_str = base64.b64encode(buffer.getvalue()).decode()
-                
-                return ScreenshotResponse(
-                    success=True,
-                    image_data=img_str,
-                    timestamp=datetime.now().isoformat()
-                )
-                
-        except ImportError:
-            # Fallback para pyautogui
-            import pyautogui
-            screenshot = pyautogui.screenshot()
-            
-            # Converte para base64
-            buffer = io.BytesIO()
-            screenshot.save(buffer, format="PNG")
-            img_str = base64.b64encode(buffer.getvalue()).decode()
-            
-            return ScreenshotResponse(
-                success=True,
-                image_data=img_str,
-                timestamp=datetime.now().isoformat()
+        service = get_screen_capture()
+        if request.monitors:
+            images = await service.capture_many(
+                request.monitors, request.format, request.compress_level, request.quality
             )
-            
+        else:
+            region = request.region.dict() if request.region else None
+            images = [await service.capture(
+                request.monitor, region, request.format, request.compress_level, request.quality
+            )]
+        
+        captures = [_to_capture(image) for image in images]
+        first = captures[0]
+        return ScreenshotResponse(
+            success=True,
+            image_data=first.image_data,
+            mime_type=first.mime_type,
+            width=first.width,
+            height=first.height,
+            capture_ms=first.capture_ms,
+            encode_ms=first.encode_ms,
+            captures=captures if request.monitors else None,
+            total_ms=round((time.perf_counter() - start) * 1000, 2),
+            timestamp=datetime.now().isoformat()
+        )
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logging.error(f"Erro ao capturar screenshot: {str(e)}")
         return ScreenshotResponse(
@@ -86,26 +124,69 @@ async def capture_screenshot():
             timestamp=datetime.now().isoformat()
         )
 
+@router.get("/screenshot/raw")
+async def capture_screenshot_raw(monitor: int = 1, format: str = "png", compress_level: int = 6, quality: int = 80,
+                                 left: Optional[int] = None, top: Optional[int] = None,
+                                 width: Optional[int] = None, height: Optional[int] = None):
+    """
+    Captura screenshot e devolve os bytes da imagem (sem base64)
+    
+    A região é informada por left/top/width/height (relativos ao monitor).
+    Tempos e dimensões vão nos cabeçalhos X-Capture-Ms, X-Encode-Ms,
+    X-Image-Width e X-Image-Height.
+    """
+    region = None
+    if width is not None or height is not None:
+        if width is None or height is None:
+            raise HTTPException(status_code=400, detail="Região requer width e height")
+        region = {'left': left or 0, 'top': top or 0, 'width': width, 'height': height}
+    
+    try:
+        image = await get_screen_capture().capture(monitor, region, format, compress_level, quality)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Erro ao capturar screenshot: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erro ao capturar screenshot: {str(e)}")
+    
+    return Response(
+        content=image.data,
+        media_type=image.mime_type,
+        headers={
+            "Cache-Control": "no-store",
+            "X-Capture-Ms": str(image.capture_ms),
+            "X-Encode-Ms": str(image.encode_ms),
+            "X-Image-Width": str(image.width),
+            "X-Image-Height": str(image.height)
+        }
+    )
+
+@router.get("/monitors")
+async def list_monitors():
+    """
+    Lista os monitores disponíveis para captura (índice 0 = todos)
+    """
+    try:
+        monitors = await get_screen_capture().monitors()
+        return {
+            "monitors": [{"index": index, **monitor} for index, monitor in enumerate(monitors)],
+            "timestamp": datetime.now().isoformat()
+        }
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Erro ao listar monitores: {str(e)}"
+        )
+
 @router.get("/status", response_model=SystemStatusResponse)
 async def get_system_status():
     """
     Retorna status do sistema
     """
     try:
-        # Verifica disponibilidade de screenshot
-        screenshot_available = False
-        try:
-            import mss
-            screenshot_available = True
-        except ImportError:
-            try:
-                import pyautogui
-                screenshot_available = True
-            except ImportError:
-                pass
-        
         return SystemStatusResponse(
-            screenshot_available=screenshot_available,
+            screenshot_available=get_screen_capture().available(),
             hot_corner_enabled=False,  # Implementar futuramente
             orb_visible=False,  # Implementar futuramente
             timestamp=datetime.now().isoformat()
@@ -3,7 +3,9 @@ Router WebSocket para comunicação em tempo real com o ORB
 """
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Coroutine
+import asyncio
+from contextlib import aclosing
 import json
 import uuid
 from datetime import datetime
@@ -14,6 +16,13 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 
+from ..screen_watch import FrameDiffer, ScreenWatch, get_screen_watch_manager
+from database.image_store import ImageBlob
+
+# Imagens recebidas em frames binários aguardando a mensagem que as usa
+MAX_PENDING_IMAGES = int(os.getenv("WS_MAX_PENDING_IMAGES", 4))
+IMAGE_UPLOAD_MAX_BYTES = int(os.getenv("IMAGE_UPLOAD_MAX_BYTES", 20 * 1024 * 1024))
+
 router = APIRouter(tags=["websocket"])
 
 def get_agente():
@@ -25,6 +34,10 @@ def get_agente():
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, WebSocket] = {}
+        # Gerações em andamento por cliente: request_id -> task
+        self.active_requests: Dict[str, Dict[str, asyncio.Task]] = {}
+        # Imagens de frames binários por cliente: sha256 -> ImageBlob
+        self.pending_images: Dict[str, Dict[str, ImageBlob]] = {}
         self.logger = logging.getLogger(__name__)
     
     async def connect(self, websocket: WebSocket, client_id: str):
@@ -42,10 +55,58 @@ class ConnectionManager:
         })
     
     def disconnect(self, client_id: str):
-        """Remove conexão WebSocket"""
+        """Remove conexão WebSocket e cancela as gerações e observações de tela do cliente"""
+        cancelled = self.cancel_requests(client_id)
+        get_screen_watch_manager().stop(client_id)
+        self.pending_images.pop(client_id, None)
         if client_id in self.active_connections:
             del self.active_connections[client_id]
-            self.logger.info(f"Cliente {client_id} desconectado")
+            self.logger.info(f"Cliente {client_id} desconectado ({cancelled} requisições canceladas)")
+    
+    def start_request(self, client_id: str, request_id: str, coro: Coroutine) -> asyncio.Task:
+        """Executa o processamento de uma mensagem como task cancelável"""
+        task = asyncio.create_task(coro)
+        requests = self.active_requests.setdefault(client_id, {})
+        requests[request_id] = task
+        
+        def _done(_task: asyncio.Task):
+            current = self.active_requests.get(client_id)
+            if current is not None and current.get(request_id) is _task:
+                del current[request_id]
+                if not current:
+                    del self.active_requests[client_id]
+        
+        task.add_done_callback(_done)
+        return task
+    
+    def cancel_requests(self, client_id: str, request_id: Optional[str] = None) -> int:
+        """
+        Cancela gerações em andamento do cliente
+        
+        Args:
+            client_id: ID do cliente
+            request_id: Requisição a cancelar (None = todas do cliente)
+        
+        Returns:
+            Número de requisições canceladas
+        """
+        requests = self.active_requests.get(client_id, {})
+        targets = [requests[request_id]] if request_id in requests else ([] if request_id else list(requests.values()))
+        for task in targets:
+            task.cancel()
+        return len(targets)
+    
+    def add_image(self, client_id: str, image: ImageBlob) -> None:
+        """Guarda imagem recebida em frame binário (descarta a mais antiga acima do limite)"""
+        images = self.pending_images.setdefault(client_id, {})
+        images.pop(image.sha256, None)
+        images[image.sha256] = image
+        while len(images) > MAX_PENDING_IMAGES:
+            del images[next(iter(images))]
+    
+    def take_image(self, client_id: str, sha256: str) -> Optional[ImageBlob]:
+        """Retira a imagem pendente do cliente (None se não houver)"""
+        return self.pending_images.get(client_id, {}).pop(sha256, None)
     
     async def send_message(self, client_id: str, message: Dict[str, Any]):
         """Envia mensagem para cliente específico"""
@@ -68,10 +129,15 @@ manager = ConnectionManager()
 @router.websocket("/ws")
 async def websocket_endpoint(
     websocket: WebSocket,
+    session_id: Optional[str] = None,
     agente = Depends(get_agente)
 ):
     """
     Endpoint WebSocket principal para comunicação em tempo real
+    
+    Com session_id na URL (/ws?session_id=...) a conexão fica presa à
+    sessão: mensagens sem session_id usam a da conexão e mensagens de outra
+    sessão são recusadas. Com vários workers o roteador exige o parâmetro.
     """
     client_id = str(uuid.uuid4())
     
@@ -80,15 +146,48 @@ async def websocket_endpoint(
         await manager.connect(websocket, client_id)
         
         while True:
-            # Recebe mensagem do cliente
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
+            # Recebe mensagem do cliente (texto JSON ou frame binário com imagem)
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            if frame.get("bytes") is not None:
+                await handle_image_frame(client_id, frame["bytes"])
+                continue
+            message_data = json.loads(frame["text"])
             
             message_type = message_data.get("type", "message")
             
+            if session_id:
+                if message_data.get("session_id") not in (None, "", session_id):
+                    await manager.send_message(client_id, {
+                        "type": "error",
+                        "message": "session_id da mensagem difere do da conexão",
+                        "request_id": message_data.get("request_id"),
+                        "timestamp": datetime.now().isoformat()
+                    })
+                    continue
+                message_data["session_id"] = session_id
+            
             if message_type == "message":
-                # Processa mensagem do agente
-                await handle_agent_message(client_id, message_data, agente)
+                # Processa mensagem do agente em background, para que o loop
+                # continue recebendo (cancelamentos, pings) durante a geração
+                request_id = str(message_data.get("request_id") or uuid.uuid4())
+                manager.start_request(
+                    client_id,
+                    request_id,
+                    handle_agent_message(client_id, message_data, agente, request_id)
+                )
+            
+            elif message_type == "cancel":
+                # Cancela a geração indicada (ou todas as do cliente)
+                request_id = message_data.get("request_id")
+                cancelled = manager.cancel_requests(client_id, request_id)
+                await manager.send_message(client_id, {
+                    "type": "cancelled",
+                    "request_id": request_id,
+                    "cancelled": cancelled,
+                    "timestamp": datetime.now().isoformat()
+                })
             
             elif message_type == "ping":
                 # Responde ping
@@ -105,6 +204,21 @@ async def websocket_endpoint(
                 # Comando para capturar tela
                 await handle_screenshot(client_id, message_data)
             
+            elif message_type == "watch_start":
+                # Observação contínua da tela (mudanças encaminhadas ao agente)
+                await handle_watch_start(client_id, message_data, agente)
+            
+            elif message_type == "watch_stop":
+                # Interrompe a observação indicada (ou todas as do cliente)
+                watch_id = message_data.get("watch_id")
+                stopped = get_screen_watch_manager().stop(client_id, watch_id)
+                await manager.send_message(client_id, {
+                    "type": "watch_stopping",
+                    "watch_id": watch_id,
+                    "stopped": stopped,
+                    "timestamp": datetime.now().isoformat()
+                })
+            
             else:
                 # Tipo de mensagem não reconhecido
                 await manager.send_message(client_id, {
@@ -119,13 +233,19 @@ async def websocket_endpoint(
         logging.error(f"Erro no WebSocket {client_id}: {str(e)}")
         manager.disconnect(client_id)
 
-async def handle_agent_message(client_id: str, message_data: Dict[str, Any], agente):
-    """Processa mensagem do agente via WebSocket"""
+async def handle_agent_message(client_id: str, message_data: Dict[str, Any], agente, request_id: str):
+    """
+    Processa mensagem do agente via WebSocket
+    
+    Roda como task registrada em manager.active_requests: um 'cancel' ou a
+    desconexão do cliente cancela a task, abortando a chamada ao provedor.
+    """
     try:
-        # Envia indicador de processamento
+        # Envia indicador de processamento (com o request_id usado para cancelar)
         await manager.send_message(client_id, {
             "type": "processing",
             "message": "Processando sua mensagem...",
+            "request_id": request_id,
             "timestamp": datetime.now().isoformat()
         })
         
@@ -134,30 +254,62 @@ async def handle_agent_message(client_id: str, message_data: Dict[str, Any], age
         session_id = message_data.get("session_id", str(uuid.uuid4()))
         image_data = message_data.get("image_data")
         
+        # Imagem enviada antes em frame binário (ou já gravada no histórico),
+        # referenciada pelo SHA-256
+        image_sha256 = message_data.get("image_sha256")
+        if image_sha256:
+            image_data = manager.take_image(client_id, image_sha256)
+            if image_data is None and agente.chat_memory:
+                image_data = agente.chat_memory.get_image(image_sha256)
+            if image_data is None:
+                await manager.send_message(client_id, {
+                    "type": "error",
+                    "message": f"Imagem não encontrada: {image_sha256}",
+                    "request_id": request_id,
+                    "timestamp": datetime.now().isoformat()
+                })
+                return
+        
         if not user_message:
             await manager.send_message(client_id, {
                 "type": "error",
                 "message": "Mensagem vazia",
+                "request_id": request_id,
                 "timestamp": datetime.now().isoformat()
             })
             return
         
-        # Processa mensagem com o agente
-        response = await agente.process_message(
+        # Processa mensagem com o agente em streaming, enviando cada delta
+        response = {}
+        async with aclosing(agente.stream_message(
             message=user_message,
             session_id=session_id,
             image_data=image_data
-        )
+        )) as events:
+            async for event in events:
+                if event["type"] == "delta":
+                    await manager.send_message(client_id, {
+                        "type": "response_delta",
+                        "content": event["content"],
+                        "session_id": session_id,
+                        "request_id": request_id
+                    })
+                elif event["type"] == "response":
+                    response = event["response"]
         
-        # Envia resposta
+        # Envia resposta completa
         await manager.send_message(client_id, {
             "type": "response",
             "content": response.get("content", ""),
             "session_id": session_id,
+            "request_id": request_id,
             "model_used": response.get("model_used"),
+            "model_tier": response.get("model_tier"),
             "provider": response.get("provider"),
             "tool_used": response.get("tool_used"),
             "reasoning": response.get("reasoning"),
+            "timings": response.get("timings"),
+            "usage": response.get("usage"),
             "timestamp": response.get("timestamp", datetime.now().isoformat())
         })
         
@@ -166,9 +318,33 @@ async def handle_agent_message(client_id: str, message_data: Dict[str, Any], age
         await manager.send_message(client_id, {
             "type": "error",
             "message": f"Erro ao processar mensagem: {str(e)}",
+            "request_id": request_id,
             "timestamp": datetime.now().isoformat()
         })
 
+async def handle_image_frame(client_id: str, data: bytes):
+    """
+    Recebe imagem em frame binário
+    
+    Os bytes ficam pendentes (sem base64) até a mensagem que os referencia
+    com image_sha256; o cliente recebe o hash em 'image_received'.
+    """
+    if len(data) > IMAGE_UPLOAD_MAX_BYTES:
+        await manager.send_message(client_id, {
+            "type": "error",
+            "message": f"Imagem maior que {IMAGE_UPLOAD_MAX_BYTES} bytes",
+            "timestamp": datetime.now().isoformat()
+        })
+        return
+    
+    image = ImageBlob(data)
+    manager.add_image(client_id, image)
+    await manager.send_message(client_id, {
+        "type": "image_received",
+        **image.ref,
+        "timestamp": datetime.now().isoformat()
+    })
+
 async def handle_toggle_orb(client_id: str, message_data: Dict[str, Any]):
     """Processa comando para alternar visibilidade do orb"""
     try:
@@ -209,11 +385,67 @@ async def handle_screenshot(client_id: str, message_data: Dict[str, Any]):
             "timestamp": datetime.now().isoformat()
         })
 
+async def handle_watch_start(client_id: str, message_data: Dict[str, Any], agente):
+    """
+    Inicia observação contínua da tela
+    
+    A tela é amostrada a cada `interval` segundos; quadros cuja fração de
+    blocos alterados passa de `change_threshold` geram eventos
+    'screen_change' e, respeitado `min_forward_interval`, a região alterada
+    é enviada ao agente com `prompt` (resposta em 'watch_response').
+    """
+    try:
+        session_id = message_data.get("session_id") or str(uuid.uuid4())
+        
+        async def emit(event: Dict[str, Any]):
+            event["timestamp"] = datetime.now().isoformat()
+            await manager.send_message(client_id, event)
+        
+        async def forward(message: str, image_data: str) -> Dict[str, Any]:
+            return await agente.process_message(message=message, session_id=session_id, image_data=image_data)
+        
+        prompt = message_data.get("prompt", "")
+        watch = ScreenWatch(
+            emit,
+            forward=forward if prompt else None,
+            prompt=prompt,
+            monitor=int(message_data.get("monitor", 1)),
+            region=message_data.get("region"),
+            interval=float(message_data.get("interval", 1.0)),
+            change_threshold=float(message_data.get("change_threshold", 0.02)),
+            min_forward_interval=float(message_data.get("min_forward_interval", 10.0)),
+            crop=bool(message_data.get("crop", True)),
+            include_frames=bool(message_data.get("include_frames", False)),
+            differ=FrameDiffer(
+                block=int(message_data.get("block_size", 32)),
+                pixel_threshold=float(message_data.get("pixel_threshold", 12.0))
+            ),
+            max_duration=float(message_data.get("max_duration", 3600.0))
+        )
+        get_screen_watch_manager().start(client_id, watch)
+        
+        await manager.send_message(client_id, {
+            "type": "watch_started",
+            "watch_id": watch.watch_id,
+            "session_id": session_id,
+            "timestamp": datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        logging.error(f"Erro ao iniciar observação da tela: {str(e)}")
+        await manager.send_message(client_id, {
+            "type": "error",
+            "message": f"Erro ao iniciar observação da tela: {str(e)}",
+            "timestamp": datetime.now().isoformat()
+        })
+
 @router.get("/connections")
 async def get_active_connections():
     """Retorna informações sobre conexões WebSocket ativas"""
     return {
         "active_connections": len(manager.active_connections),
         "client_ids": list(manager.active_connections.keys()),
+        "active_requests": sum(len(requests) for requests in manager.active_requests.values()),
+        "screen_watches": get_screen_watch_manager().get_stats(),
         "timestamp": datetime.now().isoformat()
     }
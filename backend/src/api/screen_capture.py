@@ -0,0 +1,219 @@
+"""
+Captura de tela fora do event loop
+Captura (mss, com pyautogui como fallback) e codificação rodam num pool de
+threads; cada thread mantém sua própria instância do mss, que não pode ser
+compartilhada entre threads. Vários monitores são capturados em paralelo.
+"""
+
+import asyncio
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+try:
+    import mss
+    MSS_AVAILABLE = True
+except ImportError:
+    MSS_AVAILABLE = False
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+# Formatos de saída: (formato do Pillow, tipo MIME)
+CAPTURE_FORMATS = {
+    'png': ('PNG', 'image/png'),
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+
+
+class CapturedImage:
+    """Imagem capturada e codificada, com os tempos de cada fase"""
+    
+    __slots__ = ('data', 'mime_type', 'width', 'height', 'monitor', 'capture_ms', 'encode_ms')
+    
+    def __init__(self, data: bytes, mime_type: str, width: int, height: int, monitor: int,
+                 capture_ms: float, encode_ms: float):
+        self.data = data
+        self.mime_type = mime_type
+        self.width = width
+        self.height = height
+        self.monitor = monitor
+        self.capture_ms = capture_ms
+        self.encode_ms = encode_ms
+
+
+def encode_image(image: 'Image.Image', image_format: str = 'png', compress_level: int = 6, quality: int = 80) -> bytes:
+    """
+    Codifica a imagem capturada
+    
+    Args:
+        image: Imagem RGB
+        image_format: 'png', 'webp' ou 'jpeg'
+        compress_level: Esforço de compressão (PNG: zlib 0-9; WebP: method 0-6)
+        quality: Qualidade (WebP e JPEG, 1-100)
+    """
+    pil_format, _ = CAPTURE_FORMATS[image_format]
+    buffer = io.BytesIO()
+    if image_format == 'png':
+        image.save(buffer, format=pil_format, compress_level=max(0, min(9, compress_level)))
+    elif image_format == 'webp':
+        image.save(buffer, format=pil_format, quality=quality, method=max(0, min(6, compress_level)))
+    else:
+        image.save(buffer, format=pil_format, quality=quality)
+    return buffer.getvalue()
+
+
+class ScreenCapture:
+    """Serviço de captura de tela com pool de threads dedicado"""
+    
+    def __init__(self, workers: int = 4):
+        """
+        Args:
+            workers: Threads de captura/codificação (monitores capturados em paralelo)
+        """
+        self.workers = max(1, workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='screen-capture')
+        self._local = threading.local()
+    
+    @staticmethod
+    def available() -> bool:
+        """Há backend de captura disponível"""
+        if MSS_AVAILABLE:
+            return True
+        try:
+            import pyautogui  # noqa: F401
+            return True
+        except Exception:
+            return False
+    
+    def _mss(self):
+        """Instância do mss da thread atual"""
+        sct = getattr(self._local, 'sct', None)
+        if sct is None:
+            sct = mss.mss()
+            self._local.sct = sct
+        return sct
+    
+    def list_monitors(self) -> List[Dict[str, int]]:
+        """Monitores (índice 0 = área virtual com todos os monitores)"""
+        if not MSS_AVAILABLE:
+            return []
+        return [dict(monitor) for monitor in self._mss().monitors]
+    
+    def _area(self, monitor: int, region: Optional[Dict[str, int]]) -> Dict[str, int]:
+        """
+        Área absoluta a capturar
+        
+        Args:
+            monitor: Índice do monitor (0 = todos)
+            region: left/top/width/height relativos ao monitor (None = monitor inteiro)
+        
+        Raises:
+            ValueError: monitor inexistente ou região fora do monitor
+        """
+        monitors = self._mss().monitors
+        if not 0 <= monitor < len(monitors):
+            raise ValueError(f"Monitor inválido: {monitor} (disponíveis: 0-{len(monitors) - 1})")
+        bounds = monitors[monitor]
+        if region is None:
+            return dict(bounds)
+        
+        left, top = region['left'], region['top']
+        width = min(region['width'], bounds['width'] - left)
+        height = min(region['height'], bounds['height'] - top)
+        if left < 0 or top < 0 or width <= 0 or height <= 0:
+            raise ValueError(f"Região fora do monitor {monitor}: {region}")
+        return {'left': bounds['left'] + left, 'top': bounds['top'] + top, 'width': width, 'height': height}
+    
+    def grab(self, monitor: int = 1, region: Optional[Dict[str, int]] = None) -> Tuple[bytes, Tuple[int, int]]:
+        """
+        Captura os pixels crus (BGRA) da área (síncrono, chamar no pool)
+        
+        Returns:
+            (bytes BGRA, (largura, altura))
+        """
+        shot = self._mss().grab(self._area(monitor, region))
+        return shot.bgra, shot.size
+    
+    def _capture_sync(self, monitor: int, region: Optional[Dict[str, int]], image_format: str,
+                      compress_level: int, quality: int) -> CapturedImage:
+        """Captura e codifica (executado no pool de threads)"""
+        start = time.perf_counter()
+        if MSS_AVAILABLE:
+            bgra, size = self.grab(monitor, region)
+            image = Image.frombytes('RGB', size, bgra, 'raw', 'BGRX')
+        else:
+            # Fallback: pyautogui só captura o monitor principal
+            import pyautogui
+            if monitor != 1:
+                raise ValueError("Seleção de monitor requer mss")
+            box = (region['left'], region['top'], region['width'], region['height']) if region else None
+            image = pyautogui.screenshot(region=box).convert('RGB')
+        capture_ms = (time.perf_counter() - start) * 1000
+        
+        start = time.perf_counter()
+        data = encode_image(image, image_format, compress_level, quality)
+        encode_ms = (time.perf_counter() - start) * 1000
+        
+        return CapturedImage(
+            data, CAPTURE_FORMATS[image_format][1], image.width, image.height, monitor,
+            round(capture_ms, 2), round(encode_ms, 2)
+        )
+    
+    async def capture(self, monitor: int = 1, region: Optional[Dict[str, int]] = None, image_format: str = 'png',
+                      compress_level: int = 6, quality: int = 80) -> CapturedImage:
+        """
+        Captura um monitor (ou região dele) sem bloquear o event loop
+        
+        Raises:
+            ValueError: opções inválidas
+            RuntimeError: nenhum backend de captura disponível
+        """
+        if image_format not in CAPTURE_FORMATS:
+            raise ValueError(f"Formato não suportado: {image_format} (use {', '.join(CAPTURE_FORMATS)})")
+        if not PIL_AVAILABLE:
+            raise RuntimeError("Captura de tela requer Pillow")
+        if not self.available():
+            raise RuntimeError("Nenhum backend de captura disponível (instale mss)")
+        
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._capture_sync, monitor, region, image_format, compress_level, quality
+        )
+    
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        """Executa func no pool de captura (onde vivem as instâncias do mss)"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+    
+    async def monitors(self) -> List[Dict[str, int]]:
+        """Lista os monitores (consulta feita no pool de captura)"""
+        return await self.run(self.list_monitors)
+    
+    async def capture_many(self, monitors: List[int], image_format: str = 'png', compress_level: int = 6,
+                           quality: int = 80) -> List[CapturedImage]:
+        """Captura vários monitores em paralelo (na ordem informada)"""
+        return list(await asyncio.gather(*(
+            self.capture(monitor, None, image_format, compress_level, quality) for monitor in monitors
+        )))
+    
+    def shutdown(self) -> None:
+        """Encerra o pool de threads"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Instância global
+_screen_capture = None
+
+
+def get_screen_capture() -> ScreenCapture:
+    """Retorna instância singleton do ScreenCapture"""
+    global _screen_capture
+    if _screen_capture is None:
+        _screen_capture = ScreenCapture(workers=int(os.getenv('SCREENSHOT_WORKERS', 4)))
+    return _screen_capture
@@ -0,0 +1,364 @@
+"""
+Observação contínua da tela (screen-watch)
+Amostra a tela numa taxa configurável e compara cada quadro com o último
+encaminhado, por diferença média em blocos (NumPy, em escala de cinza e
+subamostrada). Só quando a fração de blocos alterados passa do limiar a
+região alterada (ou o quadro inteiro) é encaminhada ao agente, com
+intervalo mínimo entre encaminhamentos; os eventos de mudança são emitidos
+para o cliente (WebSocket).
+"""
+
+import asyncio
+import base64
+import logging
+import os
+import time
+import uuid
+from typing import Dict, Any, Awaitable, Callable, Optional, Tuple
+
+from .screen_capture import MSS_AVAILABLE, PIL_AVAILABLE, encode_image, get_screen_capture
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+if PIL_AVAILABLE:
+    from PIL import Image
+
+# Margem (px) em volta da região alterada enviada ao agente
+CROP_PADDING = 16
+
+
+class FrameDiffer:
+    """
+    Diferença entre quadros por blocos
+    
+    O quadro BGRA vira luminância subamostrada (1 a cada `step` pixels) e é
+    dividido em blocos de `block` pixels; um bloco mudou quando a diferença
+    absoluta média passa de pixel_threshold (0-255).
+    """
+    
+    def __init__(self, block: int = 32, step: int = 2, pixel_threshold: float = 12.0):
+        """
+        Args:
+            block: Lado do bloco em pixels do quadro original
+            step: Subamostragem (1 = todos os pixels)
+            pixel_threshold: Diferença média de luminância para o bloco contar como alterado
+        """
+        self.step = max(1, step)
+        self.block = max(self.step, block)
+        self.pixel_threshold = pixel_threshold
+    
+    def luma(self, bgra: bytes, size: Tuple[int, int]) -> 'np.ndarray':
+        """Luminância subamostrada (aproximação inteira de B + 2G + R)"""
+        width, height = size
+        pixels = np.frombuffer(bgra, dtype=np.uint8).reshape(height, width, 4)[::self.step, ::self.step]
+        luma = pixels[..., 0].astype(np.int16) + pixels[..., 2]
+        luma += pixels[..., 1].astype(np.int16) * 2
+        return luma >> 2
+    
+    def compare(self, previous: 'np.ndarray', current: 'np.ndarray',
+                size: Tuple[int, int]) -> Tuple[float, Optional[Tuple[int, int, int, int]]]:
+        """
+        Compara dois quadros de luminância
+        
+        Returns:
+            (fração de blocos alterados, região alterada (left, top, width, height)
+            em pixels do quadro original, ou None sem mudança)
+        """
+        width, height = size
+        if previous is None or previous.shape != current.shape:
+            return 1.0, (0, 0, width, height)
+        
+        cells = self.block // self.step
+        diff = np.abs(current - previous)
+        rows = np.arange(0, diff.shape[0], cells)
+        cols = np.arange(0, diff.shape[1], cells)
+        sums = np.add.reduceat(np.add.reduceat(diff, rows, axis=0, dtype=np.int64), cols, axis=1)
+        counts = np.outer(np.diff(np.append(rows, diff.shape[0])), np.diff(np.append(cols, diff.shape[1])))
+        changed = (sums / counts) > self.pixel_threshold
+        
+        if not changed.any():
+            return 0.0, None
+        changed_rows = np.flatnonzero(changed.any(axis=1))
+        changed_cols = np.flatnonzero(changed.any(axis=0))
+        left = int(changed_cols[0]) * self.block
+        top = int(changed_rows[0]) * self.block
+        right = min(width, (int(changed_cols[-1]) + 1) * self.block)
+        bottom = min(height, (int(changed_rows[-1]) + 1) * self.block)
+        return float(changed.mean()), (left, top, right - left, bottom - top)
+
+
+class ScreenWatch:
+    """Sessão de observação da tela"""
+    
+    def __init__(self, emit: Callable[[Dict[str, Any]], Awaitable[None]],
+                 forward: Optional[Callable[[str, str], Awaitable[Dict[str, Any]]]] = None,
+                 prompt: str = "", monitor: int = 1, region: Optional[Dict[str, int]] = None,
+                 interval: float = 1.0, change_threshold: float = 0.02, min_forward_interval: float = 10.0,
+                 crop: bool = True, include_frames: bool = False, image_format: str = 'jpeg',
+                 quality: int = 80, differ: Optional[FrameDiffer] = None, max_duration: float = 3600.0):
+        """
+        Args:
+            emit: Envia um evento ao cliente
+            forward: Encaminha (mensagem, imagem em base64) ao agente e retorna a resposta
+                (None = só emite os eventos de mudança)
+            prompt: Instrução enviada ao agente junto de cada mudança
+            monitor: Monitor observado (0 = todos)
+            region: Região do monitor observada (None = monitor inteiro)
+            interval: Intervalo entre amostras em segundos
+            change_threshold: Fração de blocos alterados para contar como mudança (0-1)
+            min_forward_interval: Intervalo mínimo entre encaminhamentos ao agente em segundos
+            crop: Envia só a região alterada (False = quadro inteiro)
+            include_frames: Inclui a imagem nos eventos de mudança
+            image_format: Formato da imagem encaminhada ('jpeg', 'webp' ou 'png')
+            quality: Qualidade da imagem encaminhada
+            differ: Comparador de quadros
+            max_duration: Duração máxima da sessão em segundos
+        """
+        self.watch_id = str(uuid.uuid4())
+        self.emit = emit
+        self.forward = forward
+        self.prompt = prompt
+        self.monitor = monitor
+        self.region = region
+        self.interval = max(0.1, interval)
+        self.change_threshold = change_threshold
+        self.min_forward_interval = min_forward_interval
+        self.crop = crop
+        self.include_frames = include_frames
+        self.image_format = image_format
+        self.quality = quality
+        self.differ = differ or FrameDiffer()
+        self.max_duration = max_duration
+        self.logger = logging.getLogger(__name__)
+        
+        self._reference = None
+        self._previous = None
+        self._last_forward = 0.0
+        self._task: Optional[asyncio.Task] = None
+        
+        self.samples = 0
+        self.changes = 0
+        self.forwards = 0
+        self.sample_ms = 0.0
+    
+    def _sample(self) -> Tuple[bytes, Tuple[int, int], 'np.ndarray', float, Optional[Tuple[int, int, int, int]], bool]:
+        """
+        Captura um quadro e compara com a referência (executado no pool de captura)
+        
+        Returns:
+            (bgra, tamanho, luminância, fração alterada, região alterada,
+            se o quadro também mudou em relação à amostra anterior)
+        """
+        bgra, size = get_screen_capture().grab(self.monitor, self.region)
+        luma = self.differ.luma(bgra, size)
+        ratio, box = self.differ.compare(self._reference, luma, size)
+        moved = ratio >= self.change_threshold and self.differ.compare(self._previous, luma, size)[0] >= self.change_threshold
+        self._previous = luma
+        return bgra, size, luma, ratio, box, moved
+    
+    def _encode(self, bgra: bytes, size: Tuple[int, int], box: Optional[Tuple[int, int, int, int]]) -> Tuple[str, Tuple[int, int, int, int]]:
+        """Recorta (com margem) e codifica a região alterada (executado no pool de captura)"""
+        width, height = size
+        if not self.crop or box is None:
+            box = (0, 0, width, height)
+        left, top = max(0, box[0] - CROP_PADDING), max(0, box[1] - CROP_PADDING)
+        right = min(width, box[0] + box[2] + CROP_PADDING)
+        bottom = min(height, box[1] + box[3] + CROP_PADDING)
+        
+        image = Image.frombytes('RGB', size, bgra, 'raw', 'BGRX')
+        if (left, top, right, bottom) != (0, 0, width, height):
+            image = image.crop((left, top, right, bottom))
+        data = encode_image(image, self.image_format, quality=self.quality)
+        return base64.b64encode(data).decode('ascii'), (left, top, right - left, bottom - top)
+    
+    def start(self) -> asyncio.Task:
+        """Inicia a amostragem em background"""
+        self._task = asyncio.create_task(self._run())
+        return self._task
+    
+    def stop(self) -> None:
+        """Interrompe a sessão"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+    
+    async def _run(self) -> None:
+        capture = get_screen_capture()
+        deadline = time.monotonic() + self.max_duration
+        try:
+            while time.monotonic() < deadline:
+                started = time.monotonic()
+                bgra, size, luma, ratio, box, moved = await capture.run(self._sample)
+                self.samples += 1
+                self.sample_ms += (time.monotonic() - started) * 1000
+                
+                if self._reference is None:
+                    # Primeiro quadro é só a referência
+                    self._reference = luma
+                elif ratio >= self.change_threshold:
+                    await self._on_change(capture, bgra, size, luma, ratio, box, moved)
+                
+                await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.error(f"Erro na observação da tela {self.watch_id}: {str(e)}")
+            await self.emit({'type': 'watch_error', 'watch_id': self.watch_id, 'message': str(e)})
+        finally:
+            await self._emit_stopped()
+    
+    async def _on_change(self, capture, bgra: bytes, size: Tuple[int, int], luma, ratio: float,
+                         box: Tuple[int, int, int, int], moved: bool) -> None:
+        """
+        Emite a mudança e, fora do intervalo mínimo, encaminha ao agente
+        
+        Durante o intervalo mínimo a tela continua diferente da referência;
+        o evento só é repetido quando ela muda de novo (moved).
+        """
+        now = time.monotonic()
+        forward = self.forward is not None and now - self._last_forward >= self.min_forward_interval
+        if not forward and not moved:
+            return
+        self.changes += 1
+        
+        image_data, crop_box = None, None
+        if forward or self.include_frames:
+            image_data, crop_box = await capture.run(self._encode, bgra, size, box)
+        
+        await self.emit({
+            'type': 'screen_change',
+            'watch_id': self.watch_id,
+            'changed_ratio': round(ratio, 4),
+            'region': dict(zip(('left', 'top', 'width', 'height'), box)),
+            'forwarded': forward,
+            'image_data': image_data if self.include_frames else None
+        })
+        if not forward:
+            # Com encaminhamento, a referência continua sendo o último quadro
+            # encaminhado: mudanças durante o intervalo mínimo são
+            # encaminhadas depois, acumuladas
+            if self.forward is None:
+                self._reference = luma
+            return
+        
+        self._reference = luma
+        self._last_forward = now
+        self.forwards += 1
+        region = dict(zip(('left', 'top', 'width', 'height'), crop_box))
+        message = (
+            f"{self.prompt}\n\n[Observação da tela: {round(ratio * 100, 1)}% da área mudou; "
+            f"imagem da região {region['width']}x{region['height']} em ({region['left']}, {region['top']})]"
+        )
+        response = await self.forward(message, image_data)
+        await self.emit({
+            'type': 'watch_response',
+            'watch_id': self.watch_id,
+            'content': response.get('content', ''),
+            'region': region,
+            'usage': response.get('usage'),
+            'timings': response.get('timings')
+        })
+    
+    async def _emit_stopped(self) -> None:
+        try:
+            await self.emit({'type': 'watch_stopped', 'watch_id': self.watch_id, **self.get_stats()})
+        except Exception:
+            pass
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Retorna métricas da sessão"""
+        return {
+            'samples': self.samples,
+            'changes': self.changes,
+            'forwards': self.forwards,
+            'avg_sample_ms': round(self.sample_ms / self.samples, 2) if self.samples else 0.0
+        }
+
+
+class ScreenWatchManager:
+    """Sessões de observação por cliente"""
+    
+    def __init__(self, max_per_client: int = 2):
+        """
+        Args:
+            max_per_client: Sessões simultâneas por cliente
+        """
+        self.max_per_client = max_per_client
+        self.watches: Dict[str, Dict[str, ScreenWatch]] = {}
+    
+    @staticmethod
+    def available() -> Optional[str]:
+        """Motivo pelo qual a observação não está disponível (None = disponível)"""
+        if not NUMPY_AVAILABLE:
+            return "Observação da tela requer numpy"
+        if not MSS_AVAILABLE or not PIL_AVAILABLE:
+            return "Observação da tela requer mss e Pillow"
+        return None
+    
+    def start(self, client_id: str, watch: ScreenWatch) -> ScreenWatch:
+        """
+        Registra e inicia a sessão do cliente
+        
+        Raises:
+            RuntimeError: dependências ausentes ou limite de sessões do cliente
+        """
+        reason = self.available()
+        if reason:
+            raise RuntimeError(reason)
+        watches = self.watches.setdefault(client_id, {})
+        if len(watches) >= self.max_per_client:
+            raise RuntimeError(f"Limite de {self.max_per_client} observações simultâneas atingido")
+        
+        watches[watch.watch_id] = watch
+        task = watch.start()
+        
+        def _done(_task: asyncio.Task):
+            current = self.watches.get(client_id)
+            if current is not None and current.get(watch.watch_id) is watch:
+                del current[watch.watch_id]
+                if not current:
+                    del self.watches[client_id]
+        
+        task.add_done_callback(_done)
+        return watch
+    
+    def stop(self, client_id: str, watch_id: Optional[str] = None) -> int:
+        """
+        Interrompe sessões do cliente
+        
+        Args:
+            watch_id: Sessão a interromper (None = todas do cliente)
+        
+        Returns:
+            Número de sessões interrompidas
+        """
+        watches = self.watches.get(client_id, {})
+        targets = [watches[watch_id]] if watch_id in watches else ([] if watch_id else list(watches.values()))
+        for watch in targets:
+            watch.stop()
+        return len(targets)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Sessões ativas e métricas de cada uma"""
+        return {
+            'active': sum(len(watches) for watches in self.watches.values()),
+            'watches': {
+                watch_id: watch.get_stats()
+                for watches in self.watches.values() for watch_id, watch in watches.items()
+            }
+        }
+
+
+# Instância global
+_screen_watch_manager = None
+
+
+def get_screen_watch_manager() -> ScreenWatchManager:
+    """Retorna instância singleton do ScreenWatchManager"""
+    global _screen_watch_manager
+    if _screen_watch_manager is None:
+        _screen_watch_manager = ScreenWatchManager(int(os.getenv('SCREEN_WATCH_MAX_PER_CLIENT', 2)))
+    return _screen_watch_manager
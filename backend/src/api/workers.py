@@ -0,0 +1,273 @@
+"""
+Modo multi-worker do ORB Backend
+Sobe N processos uvicorn em portas internas e um roteador na porta pública
+que encaminha cada requisição ao worker responsável pela sessão (hash do
+session_id), mantendo quentes os caches em memória de cada processo.
+Todo o estado persistente da sessão fica no SQLite (WAL), mas o lock que
+ordena os turnos de uma sessão e o cache de contexto são de cada processo:
+o roteamento é o que mantém os turnos de uma sessão em ordem.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import re
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+
+import httpx
+import uvicorn
+import websockets
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from starlette.background import BackgroundTask
+from starlette.responses import JSONResponse, StreamingResponse
+
+# Cabeçalhos hop-by-hop (não são repassados entre cliente e worker)
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailers', 'transfer-encoding', 'upgrade', 'host'
+}
+
+# Prefixo do corpo JSON inspecionado em busca de session_id (o resto segue em streaming)
+MAX_ROUTING_BODY_BYTES = 64 * 1024
+
+# Fechamento de WebSocket sem session_id na URL (violação de política)
+WS_POLICY_VIOLATION = 1008
+
+_SESSION_PATH = re.compile(r"/sessions/([^/?#]+)")
+_SESSION_BODY = re.compile(rb'"session_id"\s*:\s*"([^"]+)"')
+
+
+def session_worker(session_id: str, workers: int) -> int:
+    """Worker responsável pela sessão (hash estável entre processos e execuções)"""
+    return zlib.crc32(session_id.encode('utf-8')) % workers
+
+
+def _session_from_request(path: str, query_session: Optional[str], header_session: Optional[str]) -> Optional[str]:
+    """Extrai o session_id de cabeçalho, query ou caminho (sem ler o corpo)"""
+    if header_session:
+        return header_session
+    if query_session:
+        return query_session
+    match = _SESSION_PATH.search(path)
+    if match:
+        return match.group(1)
+    return None
+
+
+def _session_from_body(prefix: bytes) -> Optional[str]:
+    """Extrai o session_id do início de um corpo JSON"""
+    match = _SESSION_BODY.search(prefix[:MAX_ROUTING_BODY_BYTES])
+    if match:
+        try:
+            return json.loads(b'"' + match.group(1) + b'"')
+        except ValueError:
+            return None
+    return None
+
+
+async def _sniff_body(chunks: AsyncIterator[bytes]) -> Tuple[bytes, AsyncIterator[bytes]]:
+    """
+    Lê do corpo só o prefixo usado no roteamento (até MAX_ROUTING_BODY_BYTES)
+    
+    Returns:
+        (prefixo, corpo completo): o corpo reemite o prefixo e depois repassa
+        o restante em streaming, sem acumular em memória
+    """
+    prefix = bytearray()
+    finished = True
+    async for chunk in chunks:
+        prefix += chunk
+        if len(prefix) >= MAX_ROUTING_BODY_BYTES:
+            finished = False
+            break
+    head = bytes(prefix)
+    
+    async def body() -> AsyncIterator[bytes]:
+        if head:
+            yield head
+        if not finished:
+            async for chunk in chunks:
+                yield chunk
+    
+    return head, body()
+
+
+def create_router_app(worker_ports: List[int]) -> FastAPI:
+    """
+    Roteador com afinidade de sessão na frente dos workers
+    
+    Requisições e respostas HTTP (incluindo SSE e uploads de imagem) são
+    repassadas em streaming; só corpos JSON sem session_id no cabeçalho,
+    query ou caminho têm o prefixo lido para achar a sessão. Conexões
+    WebSocket exigem session_id na query (a conexão fica presa à sessão)
+    e os frames são copiados nos dois sentidos.
+    """
+    logger = logging.getLogger(__name__)
+    app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
+    round_robin = itertools.cycle(range(len(worker_ports)))
+    state = {'client': None}
+    
+    def pick_worker(session_id: Optional[str]) -> int:
+        if session_id:
+            return worker_ports[session_worker(session_id, len(worker_ports))]
+        return worker_ports[next(round_robin)]
+    
+    @app.on_event("startup")
+    async def startup():
+        state['client'] = httpx.AsyncClient(
+            timeout=httpx.Timeout(connect=5.0, read=None, write=None, pool=None),
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=64)
+        )
+    
+    @app.on_event("shutdown")
+    async def shutdown():
+        if state['client'] is not None:
+            await state['client'].aclose()
+    
+    @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "HEAD"])
+    async def proxy_http(path: str, request: Request):
+        session_id = _session_from_request(
+            request.url.path,
+            request.query_params.get('session_id'),
+            request.headers.get('x-session-id')
+        )
+        has_body = 'transfer-encoding' in request.headers or request.headers.get('content-length', '0') != '0'
+        body: Optional[AsyncIterator[bytes]] = request.stream() if has_body else None
+        if body is not None and session_id is None and 'json' in request.headers.get('content-type', ''):
+            prefix, body = await _sniff_body(body)
+            session_id = _session_from_body(prefix)
+        port = pick_worker(session_id)
+        
+        headers = [(k, v) for k, v in request.headers.raw if k.decode('latin-1').lower() not in HOP_BY_HOP_HEADERS]
+        upstream_request = state['client'].build_request(
+            request.method,
+            f"http://127.0.0.1:{port}{request.url.path}",
+            params=request.url.query,
+            headers=headers,
+            content=body if body is not None else b''
+        )
+        try:
+            upstream = await state['client'].send(upstream_request, stream=True)
+        except httpx.HTTPError as e:
+            logger.error(f"Worker na porta {port} indisponível: {e}")
+            return JSONResponse(status_code=503, content={"error": "Worker indisponível"})
+        
+        response_headers = {
+            k: v for k, v in upstream.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS
+        }
+        return StreamingResponse(
+            upstream.aiter_raw(),
+            status_code=upstream.status_code,
+            headers=response_headers,
+            background=BackgroundTask(upstream.aclose)
+        )
+    
+    @app.websocket("/{path:path}")
+    async def proxy_websocket(websocket: WebSocket, path: str):
+        session_id = websocket.query_params.get('session_id')
+        await websocket.accept()
+        if not session_id:
+            # Sem a sessão na URL as mensagens de uma sessão iriam para
+            # workers diferentes (locks e caches de sessão são por processo)
+            await websocket.send_text(json.dumps({
+                "type": "error",
+                "message": "Com vários workers, conecte em /ws?session_id=<id>",
+                "timestamp": datetime.now().isoformat()
+            }))
+            await websocket.close(code=WS_POLICY_VIOLATION)
+            return
+        
+        port = pick_worker(session_id)
+        query = f"?{websocket.url.query}"
+        try:
+            async with websockets.connect(f"ws://127.0.0.1:{port}/{path}{query}", max_size=None) as upstream:
+                async def client_to_worker():
+                    while True:
+                        message = await websocket.receive()
+                        if message['type'] == 'websocket.disconnect':
+                            return
+                        if message.get('text') is not None:
+                            await upstream.send(message['text'])
+                        elif message.get('bytes') is not None:
+                            await upstream.send(message['bytes'])
+                
+                async def worker_to_client():
+                    async for message in upstream:
+                        if isinstance(message, bytes):
+                            await websocket.send_bytes(message)
+                        else:
+                            await websocket.send_text(message)
+                
+                # O primeiro lado a encerrar fecha o outro (desconexão cancela a geração no worker)
+                tasks = [asyncio.create_task(client_to_worker()), asyncio.create_task(worker_to_client())]
+                try:
+                    await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    for task in tasks:
+                        task.cancel()
+        except (OSError, websockets.exceptions.WebSocketException, WebSocketDisconnect) as e:
+            logger.warning(f"Conexão WebSocket com worker na porta {port} encerrada: {e}")
+        finally:
+            try:
+                await websocket.close()
+            except RuntimeError:
+                pass
+    
+    return app
+
+
+def _run_worker(index: int, workers: int, port: int, log_level: str):
+    """Processo worker: app completo numa porta interna"""
+    os.environ['ORB_WORKERS'] = str(workers)
+    os.environ['ORB_WORKER_INDEX'] = str(index)
+    uvicorn.run(
+        "api.main:app",
+        host="127.0.0.1",
+        port=port,
+        reload=False,
+        log_level=log_level
+    )
+
+
+def run_workers(workers: int, host: str, port: int, log_level: str = "warning",
+                base_port: Optional[int] = None, log_config: Optional[dict] = None):
+    """
+    Sobe os workers e o roteador (bloqueia até o roteador encerrar)
+    
+    Args:
+        workers: Número de processos worker
+        host: Host público do roteador
+        port: Porta pública do roteador
+        log_level: Nível de log do uvicorn
+        base_port: Primeira porta interna dos workers (padrão: port + 1)
+        log_config: Configuração de logging do uvicorn para o roteador
+    """
+    base_port = base_port or int(os.getenv('ORB_WORKER_BASE_PORT', port + 1))
+    worker_ports = [base_port + index for index in range(workers)]
+    
+    processes = []
+    for index, worker_port in enumerate(worker_ports):
+        process = multiprocessing.Process(
+            target=_run_worker,
+            args=(index, workers, worker_port, log_level),
+            name=f"orb-worker-{index}",
+            daemon=False
+        )
+        process.start()
+        processes.append(process)
+    
+    try:
+        kwargs = {'log_config': log_config} if log_config else {}
+        uvicorn.run(create_router_app(worker_ports), host=host, port=port, log_level=log_level, **kwargs)
+    finally:
+        # Workers gravam a fila de escrita no próprio shutdown
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join(timeout=15)
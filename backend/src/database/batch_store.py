@@ -0,0 +1,74 @@
+"""
+Checkpoint de lotes do ORB
+Guarda resultados concluídos de cada lote para que uma execução interrompida
+possa ser retomada com o mesmo batch_id
+"""
+
+import json
+import sqlite3
+from typing import List, Dict, Any, Tuple
+
+from database.chat_memory import configure_connection
+
+
+class BatchCheckpointStore:
+    """Resultados de lotes por (batch_id, item_id) no SQLite"""
+    
+    def __init__(self, db_path: str):
+        """
+        Args:
+            db_path: Caminho para o banco SQLite (o mesmo do chat)
+        """
+        self.db_path = db_path
+    
+    def completed(self, batch_id: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Resultados já gravados do lote
+        
+        Returns:
+            Dict item_id -> resultado
+        """
+        try:
+            with configure_connection(sqlite3.connect(self.db_path)) as conn:
+                rows = conn.execute(
+                    "SELECT item_id, result FROM batch_results WHERE batch_id = ?",
+                    (batch_id,)
+                ).fetchall()
+            return {item_id: json.loads(result) for item_id, result in rows}
+        
+        except Exception as e:
+            print(f"ERRO: Erro ao ler checkpoint do lote {batch_id}: {e}")
+            return {}
+    
+    def save(self, batch_id: str, results: List[Tuple[str, Dict[str, Any]]]) -> bool:
+        """
+        Grava resultados concluídos numa única transação
+        
+        Args:
+            batch_id: ID do lote
+            results: Pares (item_id, resultado)
+        """
+        if not results:
+            return True
+        try:
+            with configure_connection(sqlite3.connect(self.db_path)) as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO batch_results (batch_id, item_id, result) VALUES (?, ?, ?)",
+                    [(batch_id, item_id, json.dumps(result, ensure_ascii=False)) for item_id, result in results]
+                )
+            return True
+        
+        except Exception as e:
+            print(f"ERRO: Erro ao gravar checkpoint do lote {batch_id}: {e}")
+            return False
+    
+    def delete(self, batch_id: str) -> bool:
+        """Remove o checkpoint do lote"""
+        try:
+            with configure_connection(sqlite3.connect(self.db_path)) as conn:
+                conn.execute("DELETE FROM batch_results WHERE batch_id = ?", (batch_id,))
+            return True
+        
+        except Exception as e:
+            print(f"ERRO: Erro ao remover checkpoint do lote {batch_id}: {e}")
+            return False
@@ -5,11 +5,24 @@ Implementa o padrão de memória do LangChain usando SQLite
 import sqlite3
 import json
 import os
+import atexit
+import queue
+import threading
 from pathlib import Path
-from typing import List, Dict, Any, Optional
-from datetime import datetime
+from typing import List, Dict, Any, Callable, Optional, Union
+from datetime import datetime, timezone
 import uuid
 
+from database.image_store import ImageBlob, write_blob, read_blob, release_session_blobs
+
+# Espera máxima (segundos) pela fila de escrita antes de apagar mensagens de uma sessão
+DELETE_FLUSH_TIMEOUT = float(os.getenv('CHAT_DELETE_FLUSH_TIMEOUT', 10))
+
+
+def _sqlite_timestamp() -> str:
+    """Timestamp UTC no mesmo formato de CURRENT_TIMESTAMP do SQLite"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
 
 class ChatMessage:
     """Representa uma mensagem de chat compatível com LangChain"""
@@ -19,7 +32,7 @@ class ChatMessage:
         Args:
             role: 'user' | 'assistant' | 'system'
             content: Conteúdo da mensagem
-            additional_kwargs: Dados adicionais (ex: image_data)
+            additional_kwargs: Dados adicionais (ex: image_ref, referência da imagem em image_blobs)
             created_at: Timestamp ISO da criação da mensagem
         """
         self.role = role
@@ -56,6 +69,320 @@ class ChatMessage:
         return cls.from_dict(json.loads(json_str))
 
 
+def configure_connection(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """
+    Ajusta a conexão para acesso concorrente (vários workers no mesmo banco)
+    
+    WAL permite leituras durante a escrita; busy_timeout faz o escritor
+    aguardar o lock em vez de falhar com "database is locked".
+    """
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA busy_timeout = 5000")
+    return conn
+
+
+class TurnRecord:
+    """Turno de conversa aguardando persistência na fila write-behind"""
+    
+    def __init__(self, session_id: str, messages: List[ChatMessage], title: Optional[str] = None,
+                 blobs: Optional[List[ImageBlob]] = None):
+        """
+        Args:
+            session_id: ID da sessão
+            messages: Mensagens do turno, em ordem cronológica
+            title: Título a aplicar se a sessão ainda não tiver mensagens
+            blobs: Imagens referenciadas pelas mensagens (gravadas na mesma transação)
+        """
+        self.session_id = session_id
+        self.messages = messages
+        self.title = title
+        self.blobs = blobs or []
+        # Versão da sessão com o turno gravado, definida antes do commit
+        # (None enquanto não há transação em andamento com o turno)
+        self.version: Optional[int] = None
+
+
+class ChatWriteQueue:
+    """
+    Fila write-behind para turnos de chat
+    
+    Recebe turnos sem bloquear o chamador e os grava em lotes, cada lote em
+    uma única transação, numa thread dedicada com conexão própria. Mensagens
+    ainda não gravadas ficam visíveis via pending_messages (read-your-writes).
+    
+    Leitores não esperam a transação do lote: cada turno recebe, antes do
+    commit, a versão que a sessão terá com ele gravado, e unwritten_messages
+    descarta os turnos que a leitura do banco (na versão lida) já contém.
+    
+    Após cada commit, os listeners registrados recebem (session_id,
+    versão anterior, versão nova) de cada sessão gravada; caches em memória
+    usam isso para acompanhar a versão sem reler o banco.
+    """
+    
+    _STOP = object()
+    
+    def __init__(self, db_path: str, batch_size: int = 64):
+        """
+        Args:
+            db_path: Caminho para o banco SQLite
+            batch_size: Número máximo de turnos por transação
+        """
+        self.db_path = db_path
+        self.batch_size = batch_size
+        
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._pending: Dict[str, List[TurnRecord]] = {}
+        self._pending_blobs: Dict[str, ImageBlob] = {}
+        self._unfinished = 0
+        self._state = threading.Condition()
+        self._closed = False
+        
+        self._commit_listeners: List[Callable[[str, int, int], Any]] = []
+        
+        self._thread = threading.Thread(target=self._run, name="chat-write-queue", daemon=True)
+        self._thread.start()
+    
+    def enqueue(self, record: TurnRecord) -> None:
+        """Enfileira um turno para gravação (retorna imediatamente)"""
+        with self._state:
+            if self._closed:
+                raise RuntimeError("Fila de escrita encerrada")
+            self._pending.setdefault(record.session_id, []).append(record)
+            for blob in record.blobs:
+                self._pending_blobs[blob.sha256] = blob
+            self._unfinished += 1
+        self._queue.put(record)
+    
+    def add_commit_listener(self, listener: Callable[[str, int, int], Any]) -> None:
+        """Registra callback chamado (na thread de escrita) após cada commit"""
+        if listener not in self._commit_listeners:
+            self._commit_listeners.append(listener)
+    
+    def pending_messages(self, session_id: str) -> List[ChatMessage]:
+        """Mensagens da sessão ainda não gravadas, em ordem cronológica"""
+        with self._state:
+            return [msg for record in self._pending.get(session_id, ()) for msg in record.messages]
+    
+    def pending_records(self, session_id: str) -> List[TurnRecord]:
+        """Turnos da sessão ainda não gravados (tomar antes de ler o banco)"""
+        with self._state:
+            return list(self._pending.get(session_id, ()))
+    
+    def unwritten_messages(self, records: List[TurnRecord], db_version: int) -> List[ChatMessage]:
+        """
+        Mensagens dos turnos que a leitura do banco não contém
+        
+        Args:
+            records: Turnos tomados com pending_records antes da leitura
+            db_version: Versão da sessão lida no mesmo comando das mensagens
+        """
+        with self._state:
+            return [
+                msg for record in records
+                if record.version is None or record.version > db_version
+                for msg in record.messages
+            ]
+    
+    def pending_blob(self, sha256: str) -> Optional[ImageBlob]:
+        """Imagem de um turno ainda não gravado (read-your-writes)"""
+        with self._state:
+            return self._pending_blobs.get(sha256)
+    
+    def pending_count(self) -> int:
+        """Número de turnos ainda não gravados"""
+        with self._state:
+            return self._unfinished
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Aguarda até que todos os turnos enfileirados sejam gravados
+        
+        Returns:
+            True se a fila esvaziou dentro do timeout
+        """
+        with self._state:
+            return self._state.wait_for(lambda: self._unfinished == 0, timeout)
+    
+    def close(self, timeout: Optional[float] = None) -> bool:
+        """Grava os turnos pendentes e encerra a thread de escrita"""
+        with self._state:
+            if self._closed:
+                return self._unfinished == 0
+            self._closed = True
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+    
+    def _run(self):
+        """Loop da thread de escrita: drena a fila em lotes"""
+        conn = configure_connection(sqlite3.connect(self.db_path, check_same_thread=False))
+        
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is self._STOP:
+                break
+            
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            
+            self._write_batch(conn, batch)
+        
+        conn.close()
+    
+    def _write_batch(self, conn: sqlite3.Connection, batch: List[TurnRecord]):
+        """Grava um lote numa única transação (com fallback turno a turno)"""
+        try:
+            versions = self._commit_records(conn, batch)
+        except Exception as e:
+            print(f"ERRO: Erro ao gravar lote de {len(batch)} turnos: {e}")
+        else:
+            self._mark_done(batch)
+            self._notify_commit(versions)
+            return
+        
+        # Lote falhou: tenta turno a turno para não perder os demais
+        for record in batch:
+            try:
+                versions = self._commit_records(conn, [record])
+            except Exception as e:
+                print(f"ERRO: Turno descartado para sessão {record.session_id}: {e}")
+                self._mark_done([record])
+                continue
+            self._mark_done([record])
+            self._notify_commit(versions)
+    
+    def _commit_records(self, conn: sqlite3.Connection, records: List[TurnRecord]) -> Dict[str, List[int]]:
+        """
+        Grava turnos numa transação, sem lock compartilhado com os leitores
+        
+        A versão de cada turno fica definida antes do commit; se a transação
+        falhar, as versões são limpas antes do rollback (ainda com o lock de
+        escrita do SQLite), e os turnos voltam a contar como não gravados.
+        """
+        versions: Dict[str, List[int]] = {}
+        try:
+            for record in records:
+                self._write_record(conn, record, versions)
+            conn.commit()
+        except Exception:
+            with self._state:
+                for record in records:
+                    record.version = None
+            conn.rollback()
+            raise
+        return versions
+    
+    def _write_record(self, conn: sqlite3.Connection, record: TurnRecord, versions: Dict[str, List[int]]):
+        """Executa os comandos de um turno (sem commit), registrando a versão da sessão antes/depois"""
+        if record.session_id not in versions:
+            versions[record.session_id] = [_session_version(conn, record.session_id), 0]
+        for blob in record.blobs:
+            write_blob(conn, record.session_id, blob)
+        conn.execute(
+            "INSERT OR IGNORE INTO chat_sessions (session_id, title) VALUES (?, ?)",
+            (record.session_id, record.title or 'Nova Conversa')
+        )
+        if record.title:
+            # Título só é aplicado na primeira mensagem da sessão
+            conn.execute(
+                "UPDATE chat_sessions SET title = ? WHERE session_id = ? AND message_count = 0",
+                (record.title, record.session_id)
+            )
+        conn.executemany(
+            "INSERT INTO message_store (session_id, message, created_at) VALUES (?, ?, ?)",
+            [(record.session_id, msg.to_json(), msg.created_at) for msg in record.messages]
+        )
+        version = _session_version(conn, record.session_id)
+        versions[record.session_id][1] = version
+        with self._state:
+            record.version = version
+    
+    def _notify_commit(self, versions: Dict[str, List[int]]):
+        """Repassa as versões gravadas aos listeners"""
+        for listener in self._commit_listeners:
+            for session_id, (before, after) in versions.items():
+                try:
+                    listener(session_id, before, after)
+                except Exception as e:
+                    print(f"ERRO: Listener de commit falhou para sessão {session_id}: {e}")
+    
+    def _mark_done(self, batch: List[TurnRecord]):
+        """Remove turnos gravados da visão pendente"""
+        with self._state:
+            for record in batch:
+                pending = self._pending.get(record.session_id, [])
+                pending[:] = [item for item in pending if item is not record]
+                if not pending:
+                    self._pending.pop(record.session_id, None)
+                for blob in record.blobs:
+                    self._pending_blobs.pop(blob.sha256, None)
+                self._unfinished -= 1
+            self._state.notify_all()
+
+
+def _to_blob(image_data: Optional[Union[str, ImageBlob]]) -> Optional[ImageBlob]:
+    """Imagem em base64 (ou já decodificada) como ImageBlob (None se ausente ou inválida)"""
+    if not image_data:
+        return None
+    if isinstance(image_data, ImageBlob):
+        return image_data
+    try:
+        return ImageBlob.from_base64(image_data)
+    except ValueError as e:
+        # A mensagem é gravada mesmo assim, sem a imagem
+        print(f"AVISO: Imagem descartada: {e}")
+        return None
+
+
+def _session_version(conn: sqlite3.Connection, session_id: str) -> int:
+    """Versão atual da sessão (0 se nunca gravada)"""
+    row = conn.execute(
+        "SELECT version FROM session_versions WHERE session_id = ?",
+        (session_id,)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+# Filas de escrita compartilhadas por banco (todas as instâncias veem os pendentes)
+_write_queues: Dict[str, ChatWriteQueue] = {}
+_write_queues_lock = threading.Lock()
+
+
+def get_write_queue(db_path: str) -> ChatWriteQueue:
+    """Retorna a fila write-behind do banco, criando-a se necessário"""
+    with _write_queues_lock:
+        write_queue = _write_queues.get(db_path)
+        if write_queue is None:
+            write_queue = ChatWriteQueue(db_path)
+            _write_queues[db_path] = write_queue
+        return write_queue
+
+
+def close_write_queues(timeout: Optional[float] = 10.0) -> bool:
+    """Grava todos os turnos pendentes e encerra as filas (usar no shutdown)"""
+    with _write_queues_lock:
+        queues = list(_write_queues.values())
+        _write_queues.clear()
+    
+    ok = True
+    for write_queue in queues:
+        ok = write_queue.close(timeout) and ok
+    return ok
+
+
+atexit.register(close_write_queues)
+
+
 class ChatMemoryManager:
     """
     Gerenciador de memória de chat compatível com LangChain
@@ -85,10 +412,60 @@ class ChatMemoryManager:
     def connection(self):
         """Retorna connection persistente (pooling pattern)"""
         if self._connection is None:
-            self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._connection = configure_connection(sqlite3.connect(self.db_path, check_same_thread=False))
             self._connection.row_factory = sqlite3.Row
         return self._connection
     
+    @property
+    def write_queue(self) -> ChatWriteQueue:
+        """Fila write-behind compartilhada deste banco"""
+        return get_write_queue(self.db_path)
+    
+    def enqueue_turn(self, session_id: str, user_content: str, assistant_content: str,
+                     image_data: Optional[Union[str, ImageBlob]] = None, title: Optional[str] = None,
+                     assistant_kwargs: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Enfileira um turno completo (usuário + assistente) para gravação assíncrona
+        
+        Retorna imediatamente; a sessão é criada e o título aplicado (se for a
+        primeira mensagem) na mesma transação das mensagens.
+        
+        Args:
+            session_id: ID da sessão
+            user_content: Mensagem do usuário
+            assistant_content: Resposta do assistente
+            image_data: Imagem enviada pelo usuário, em base64 ou já decodificada (opcional).
+                É gravada em image_blobs e a mensagem guarda só a referência
+            title: Título da sessão caso ainda não tenha mensagens
+            assistant_kwargs: Metadados da resposta (ex: {'truncated': True})
+            
+        Returns:
+            True se enfileirado
+        """
+        try:
+            additional_kwargs = {}
+            blobs = []
+            blob = _to_blob(image_data)
+            if blob is not None:
+                additional_kwargs['image_ref'] = blob.ref
+                blobs.append(blob)
+            
+            timestamp = _sqlite_timestamp()
+            messages = [
+                ChatMessage('user', user_content, additional_kwargs, created_at=timestamp),
+                ChatMessage('assistant', assistant_content, assistant_kwargs, created_at=timestamp)
+            ]
+            self.write_queue.enqueue(TurnRecord(session_id, messages, title, blobs))
+            return True
+        
+        except Exception as e:
+            print(f"ERRO: Erro ao enfileirar turno: {e}")
+            return False
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Aguarda a gravação de todos os turnos enfileirados"""
+        return self.write_queue.flush(timeout)
+    
     def create_session(self, session_id: Optional[str] = None, title: Optional[str] = None) -> str:
         """
         Cria uma nova sessão de chat
@@ -135,6 +512,14 @@ class ChatMemoryManager:
             # Garantir que a sessão existe
             self.create_session(session_id)
             
+            # Imagem inline vai para image_blobs; a mensagem guarda a referência
+            blob = _to_blob(message.additional_kwargs.get('image_data'))
+            if blob is not None:
+                additional_kwargs = {k: v for k, v in message.additional_kwargs.items() if k != 'image_data'}
+                additional_kwargs['image_ref'] = blob.ref
+                message = ChatMessage(message.role, message.content, additional_kwargs, message.created_at)
+                write_blob(self.connection, session_id, blob)
+            
             # Adicionar mensagem
             self.connection.execute(
                 """
@@ -165,46 +550,297 @@ class ChatMemoryManager:
         message = ChatMessage('assistant', content)
         return self.add_message(session_id, message)
     
-    def get_messages(self, session_id: str, limit: Optional[int] = None) -> List[ChatMessage]:
+    def get_messages(self, session_id: str, limit: Optional[int] = None,
+                     max_chars: Optional[int] = None) -> List[ChatMessage]:
         """
         Obtém mensagens da sessão (padrão LangChain)
         
         Args:
             session_id: ID da sessão
             limit: Limite de mensagens (None = todas)
+            max_chars: Com limit, para nas mensagens recentes cujo conteúdo soma
+                até max_chars caracteres (a que cruza o limite é incluída)
             
         Returns:
             Lista de ChatMessage
         """
         try:
-            if limit:
-                query = """
-                    SELECT message, created_at FROM message_store
+            write_queue = self.write_queue
+            
+            # Pendentes tomados antes da leitura; a versão da sessão vem no
+            # mesmo comando das mensagens (mesmo snapshot do WAL) e separa os
+            # turnos que o writer gravou enquanto o banco era lido
+            records = write_queue.pending_records(session_id)
+            version_column = "(SELECT version FROM session_versions WHERE session_id = ?)"
+            if limit and max_chars:
+                # Soma acumulada do conteúdo, das mais recentes para as mais antigas
+                content_length = "LENGTH(COALESCE(json_extract(message, '$.content'), ''))"
+                query = f"""
+                    SELECT message, created_at, {version_column} FROM (
+                        SELECT message, created_at, id, {content_length} AS chars,
+                               SUM({content_length}) OVER (ORDER BY created_at DESC, id DESC) AS total_chars
+                        FROM message_store
+                        WHERE session_id = ?
+                    )
+                    WHERE total_chars - chars < ?
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT ?
+                """
+                cursor = self.connection.execute(query, (session_id, session_id, max_chars, limit))
+            elif limit:
+                query = f"""
+                    SELECT message, created_at, {version_column} FROM message_store
                     WHERE session_id = ?
-                    ORDER BY created_at DESC
+                    ORDER BY created_at DESC, id DESC
                     LIMIT ?
                 """
-                cursor = self.connection.execute(query, (session_id, limit))
+                cursor = self.connection.execute(query, (session_id, session_id, limit))
             else:
-                query = """
-                    SELECT message, created_at FROM message_store
+                query = f"""
+                    SELECT message, created_at, {version_column} FROM message_store
                     WHERE session_id = ?
-                    ORDER BY created_at ASC
+                    ORDER BY created_at ASC, id ASC
                 """
-                cursor = self.connection.execute(query, (session_id,))
+                cursor = self.connection.execute(query, (session_id, session_id))
+            rows = cursor.fetchall()
+            pending = write_queue.unwritten_messages(records, rows[0][2] or 0 if rows else 0)
             
             messages = []
-            for row in cursor.fetchall():
+            for row in rows:
                 message = ChatMessage.from_json(row[0])
                 message.created_at = row[1]  # Usar timestamp do banco
                 messages.append(message)
             
+            # Mensagens ainda na fila (read-your-writes), mantendo a ordenação da query
+            if limit:
+                messages = (list(reversed(pending)) + messages)[:limit]
+            else:
+                messages.extend(pending)
+            
             return messages
         
         except Exception as e:
             print(f"ERRO: Erro ao obter mensagens: {e}")
             return []
     
+    def count_messages(self, session_id: str) -> int:
+        """Número de mensagens da sessão, incluindo as ainda na fila de escrita"""
+        try:
+            write_queue = self.write_queue
+            records = write_queue.pending_records(session_id)
+            cursor = self.connection.execute(
+                """
+                SELECT COUNT(*), (SELECT version FROM session_versions WHERE session_id = ?)
+                FROM message_store WHERE session_id = ?
+                """,
+                (session_id, session_id)
+            )
+            stored, version = cursor.fetchone()
+            pending = len(write_queue.unwritten_messages(records, version or 0))
+            return stored + pending
+        
+        except Exception as e:
+            print(f"ERRO: Erro ao contar mensagens: {e}")
+            return 0
+    
+    def get_messages_range(self, session_id: str, offset: int, limit: int) -> List[ChatMessage]:
+        """
+        Obtém mensagens gravadas da sessão em ordem cronológica, a partir de offset
+        
+        Args:
+            session_id: ID da sessão
+            offset: Quantidade de mensagens mais antigas a pular
+            limit: Número máximo de mensagens
+            
+        Returns:
+            Lista de ChatMessage
+        """
+        try:
+            cursor = self.connection.execute(
+                """
+                SELECT message, created_at FROM message_store
+                WHERE session_id = ?
+                ORDER BY created_at ASC, id ASC
+                LIMIT ? OFFSET ?
+                """,
+                (session_id, limit, offset)
+            )
+            
+            messages = []
+            for row in cursor.fetchall():
+                message = ChatMessage.from_json(row[0])
+                message.created_at = row[1]
+                messages.append(message)
+            
+            return messages
+        
+        except Exception as e:
+            print(f"ERRO: Erro ao obter intervalo de mensagens: {e}")
+            return []
+    
+    def get_image(self, sha256: str) -> Optional[ImageBlob]:
+        """
+        Bytes de uma imagem referenciada por mensagem (additional_kwargs['image_ref'])
+        
+        Returns:
+            ImageBlob ou None se não existir
+        """
+        try:
+            blob = self.write_queue.pending_blob(sha256)
+            if blob is not None:
+                return blob
+            return read_blob(self.connection, sha256)
+        
+        except Exception as e:
+            print(f"ERRO: Erro ao ler imagem {sha256}: {e}")
+            return None
+    
+    def resolve_images(self, messages: List[ChatMessage]) -> List[ChatMessage]:
+        """
+        Cópias das mensagens com a imagem em base64 em additional_kwargs['image_data']
+        (formato esperado por clientes que exibem o histórico)
+        """
+        resolved = []
+        for message in messages:
+            ref = message.additional_kwargs.get('image_ref')
+            if ref and 'image_data' not in message.additional_kwargs:
+                blob = self.get_image(ref['sha256'])
+                if blob is not None:
+                    message = ChatMessage(
+                        message.role,
+                        message.content,
+                        {**message.additional_kwargs, 'image_data': blob.to_base64()},
+                        message.created_at
+                    )
+            resolved.append(message)
+        return resolved
+    
+    def migrate_inline_images(self, batch_size: int = 50) -> int:
+        """
+        Move imagens base64 de mensagens antigas para image_blobs
+        
+        Processa em transações de batch_size mensagens, para não segurar o
+        lock de escrita por muito tempo.
+        
+        Returns:
+            Número de mensagens migradas
+        """
+        migrated = 0
+        try:
+            with configure_connection(sqlite3.connect(self.db_path)) as conn:
+                last_id = 0
+                while True:
+                    rows = conn.execute(
+                        """
+                        SELECT id, session_id, message FROM message_store
+                        WHERE id > ? AND message LIKE '%"image_data"%'
+                        ORDER BY id
+                        LIMIT ?
+                        """,
+                        (last_id, batch_size)
+                    ).fetchall()
+                    if not rows:
+                        break
+                    
+                    with conn:
+                        for message_id, session_id, raw in rows:
+                            last_id = message_id
+                            message = ChatMessage.from_json(raw)
+                            blob = _to_blob(message.additional_kwargs.pop('image_data', None))
+                            if blob is None:
+                                continue
+                            write_blob(conn, session_id, blob)
+                            message.additional_kwargs['image_ref'] = blob.ref
+                            conn.execute(
+                                "UPDATE message_store SET message = ? WHERE id = ?",
+                                (message.to_json(), message_id)
+                            )
+                            migrated += 1
+            
+            if migrated:
+                print(f"OK: {migrated} imagens migradas para image_blobs")
+            return migrated
+        
+        except Exception as e:
+            print(f"ERRO: Erro ao migrar imagens: {e}")
+            return migrated
+    
+    def get_session_version(self, session_id: str) -> int:
+        """
+        Versão do estado da sessão no banco (incrementada a cada escrita de
+        mensagens ou resumo, por qualquer processo)
+        
+        Returns:
+            Versão atual, ou -1 em caso de erro (nunca coincide com o cache)
+        """
+        try:
+            return _session_version(self.connection, session_id)
+        except Exception as e:
+            print(f"ERRO: Erro ao obter versão da sessão: {e}")
+            return -1
+    
+    def get_session_summary(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Obtém o resumo incremental da sessão
+        
+        Returns:
+            Dict com summary, covered_messages e updated_at, ou None
+        """
+        try:
+            cursor = self.connection.execute(
+                """
+                SELECT summary, covered_messages, updated_at
+                FROM session_summaries
+                WHERE session_id = ?
+                """,
+                (session_id,)
+            )
+            row = cursor.fetchone()
+            
+            if row:
+                return {
+                    'summary': row[0],
+                    'covered_messages': row[1],
+                    'updated_at': row[2]
+                }
+            return None
+        
+        except Exception as e:
+            print(f"ERRO: Erro ao obter resumo da sessão: {e}")
+            return None
+    
+    def save_session_summary(self, session_id: str, summary: str, covered_messages: int) -> bool:
+        """
+        Salva o resumo incremental da sessão
+        
+        Args:
+            session_id: ID da sessão
+            summary: Texto do resumo
+            covered_messages: Quantidade de mensagens mais antigas cobertas pelo resumo
+            
+        Returns:
+            True se sucesso
+        """
+        try:
+            self.connection.execute(
+                """
+                INSERT INTO session_summaries (session_id, summary, covered_messages, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(session_id) DO UPDATE SET
+                    summary = excluded.summary,
+                    covered_messages = excluded.covered_messages,
+                    updated_at = CURRENT_TIMESTAMP
+                """,
+                (session_id, summary, covered_messages)
+            )
+            self.connection.commit()
+            
+            return True
+        
+        except Exception as e:
+            print(f"ERRO: Erro ao salvar resumo da sessão: {e}")
+            return False
+    
     def update_session_title(self, session_id: str, title: str) -> bool:
         """
         Atualiza o título de uma sessão
@@ -313,17 +949,29 @@ class ChatMemoryManager:
             True se sucesso
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            # Garante que turnos pendentes não recriem a sessão depois
+            if not self.flush(DELETE_FLUSH_TIMEOUT):
+                print(f"ERRO: Fila de escrita não esvaziou; sessão {session_id} não deletada")
+                return False
+            
+            with configure_connection(sqlite3.connect(self.db_path)) as conn:
                 # Deletar mensagens
                 conn.execute(
                     "DELETE FROM message_store WHERE session_id = ?",
                     (session_id,)
                 )
+                # Deletar resumo
+                conn.execute(
+                    "DELETE FROM session_summaries WHERE session_id = ?",
+                    (session_id,)
+                )
                 # Deletar sessão
                 conn.execute(
                     "DELETE FROM chat_sessions WHERE session_id = ?",
                     (session_id,)
                 )
+                # Imagens que só esta sessão referenciava
+                release_session_blobs(conn, session_id)
                 conn.commit()
             
             print(f"OK: Sessão deletada: {session_id}")
@@ -344,16 +992,25 @@ class ChatMemoryManager:
             True se sucesso
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            if not self.flush(DELETE_FLUSH_TIMEOUT):
+                print(f"ERRO: Fila de escrita não esvaziou; mensagens da sessão {session_id} mantidas")
+                return False
+            
+            with configure_connection(sqlite3.connect(self.db_path)) as conn:
                 conn.execute(
                     "DELETE FROM message_store WHERE session_id = ?",
                     (session_id,)
                 )
+                conn.execute(
+                    "DELETE FROM session_summaries WHERE session_id = ?",
+                    (session_id,)
+                )
                 # Resetar contador
                 conn.execute(
                     "UPDATE chat_sessions SET message_count = 0 WHERE session_id = ?",
                     (session_id,)
                 )
+                release_session_blobs(conn, session_id)
                 conn.commit()
             
             return True
@@ -0,0 +1,132 @@
+"""
+Imagens do chat endereçadas por conteúdo
+A imagem em base64 é decodificada uma única vez e gravada como bytes na
+tabela image_blobs, com o SHA-256 do conteúdo como chave (screenshots
+idênticos ocupam espaço uma vez só). As mensagens guardam apenas a
+referência ({'sha256', 'mime_type', 'size'}) e os bytes são lidos sob demanda.
+"""
+
+import base64
+import binascii
+import hashlib
+import sqlite3
+from typing import Dict, Any, Optional, Union
+
+# Assinaturas (magic bytes) dos formatos aceitos
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+
+def sniff_image_type(data: Union[bytes, bytearray, memoryview], default: str = 'image/jpeg') -> str:
+    """Tipo MIME da imagem pelos primeiros bytes"""
+    head = bytes(data[:16])
+    for signature, mime_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return default
+
+
+def _strip_data_url(image_data: str) -> str:
+    """Conteúdo base64 de uma data URL ("data:image/png;base64,...") ou a própria string"""
+    if image_data.startswith('data:') and ',' in image_data:
+        return image_data.split(',', 1)[1]
+    return image_data
+
+
+def decode_base64_image(image_data: str) -> bytes:
+    """
+    Decodifica imagem em base64 (aceita data URL "data:image/png;base64,...")
+
+    Raises:
+        ValueError: base64 inválido
+    """
+    try:
+        return base64.b64decode(_strip_data_url(image_data))
+    except binascii.Error as e:
+        raise ValueError(f"Imagem em base64 inválida: {e}")
+
+
+def sniff_base64_image_type(image_data: str, default: str = 'image/jpeg') -> str:
+    """Tipo MIME de uma imagem em base64, decodificando só o início"""
+    try:
+        return sniff_image_type(base64.b64decode(_strip_data_url(image_data)[:24]), default)
+    except binascii.Error:
+        return default
+
+
+class ImageBlob:
+    """Imagem decodificada com o hash do conteúdo"""
+
+    __slots__ = ('sha256', 'mime_type', 'data')
+
+    def __init__(self, data: Union[bytes, bytearray, memoryview], mime_type: Optional[str] = None, sha256: Optional[str] = None):
+        """
+        Args:
+            data: Bytes da imagem (aceita memoryview de um upload, sem cópia)
+            mime_type: Tipo MIME (detectado pelo conteúdo se None)
+            sha256: Hash já calculado (opcional)
+        """
+        self.data = data
+        self.mime_type = mime_type or sniff_image_type(data)
+        self.sha256 = sha256 or hashlib.sha256(data).hexdigest()
+
+    @classmethod
+    def from_base64(cls, image_data: str) -> 'ImageBlob':
+        """
+        Decodifica imagem em base64 (aceita data URL "data:image/png;base64,...")
+
+        Raises:
+            ValueError: base64 inválido
+        """
+        return cls(decode_base64_image(image_data))
+
+    @property
+    def ref(self) -> Dict[str, Any]:
+        """Referência guardada na mensagem (additional_kwargs['image_ref'])"""
+        return {'sha256': self.sha256, 'mime_type': self.mime_type, 'size': len(self.data)}
+
+    def to_base64(self) -> str:
+        """Imagem em base64 (formato antigo de additional_kwargs['image_data'])"""
+        return base64.b64encode(self.data).decode('ascii')
+
+
+def write_blob(conn: sqlite3.Connection, session_id: str, blob: ImageBlob) -> None:
+    """Grava a imagem (se ainda não existir) e a referência da sessão, sem commit"""
+    conn.execute(
+        "INSERT OR IGNORE INTO image_blobs (sha256, data, mime_type, size) VALUES (?, ?, ?, ?)",
+        (blob.sha256, sqlite3.Binary(blob.data), blob.mime_type, len(blob.data))
+    )
+    conn.execute(
+        "INSERT OR IGNORE INTO image_refs (session_id, sha256) VALUES (?, ?)",
+        (session_id, blob.sha256)
+    )
+
+
+def read_blob(conn: sqlite3.Connection, sha256: str) -> Optional[ImageBlob]:
+    """Lê a imagem pelo hash (None se não existir)"""
+    row = conn.execute(
+        "SELECT data, mime_type FROM image_blobs WHERE sha256 = ?",
+        (sha256,)
+    ).fetchone()
+    if row is None:
+        return None
+    return ImageBlob(bytes(row[0]), row[1], sha256)
+
+
+def release_session_blobs(conn: sqlite3.Connection, session_id: str) -> int:
+    """
+    Remove as referências da sessão e as imagens que ficaram sem referência, sem commit
+
+    Returns:
+        Número de imagens removidas
+    """
+    conn.execute("DELETE FROM image_refs WHERE session_id = ?", (session_id,))
+    return conn.execute(
+        "DELETE FROM image_blobs WHERE sha256 NOT IN (SELECT sha256 FROM image_refs)"
+    ).rowcount
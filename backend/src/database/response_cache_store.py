@@ -0,0 +1,104 @@
+"""
+Camada persistente do cache de respostas do LLM
+Respostas por chave (hash da requisição renderizada) com validade e limite
+de tamanho; compartilhada entre workers e reinícios do processo
+"""
+
+import sqlite3
+import time
+from typing import Optional
+
+from database.chat_memory import configure_connection
+
+
+class ResponseCacheStore:
+    """Respostas do LLM no SQLite, com expiração e remoção das menos usadas"""
+    
+    def __init__(self, db_path: str, max_bytes: int = 256 * 1024 * 1024, evict_every: int = 64):
+        """
+        Args:
+            db_path: Caminho para o banco SQLite (o mesmo do chat)
+            max_bytes: Tamanho máximo somado das respostas gravadas
+            evict_every: Gravações entre rodadas de limpeza
+        """
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.evict_every = max(1, evict_every)
+        self._puts = 0
+    
+    def get(self, key: str) -> Optional[str]:
+        """Resposta válida para a chave ou None"""
+        try:
+            now = time.time()
+            with configure_connection(sqlite3.connect(self.db_path)) as conn:
+                row = conn.execute(
+                    "SELECT response FROM llm_response_cache WHERE key = ? AND expires_at > ?",
+                    (key, now)
+                ).fetchone()
+                if row is None:
+                    return None
+                conn.execute("UPDATE llm_response_cache SET last_hit_at = ? WHERE key = ?", (now, key))
+            return row[0]
+        
+        except Exception as e:
+            print(f"ERRO: Erro ao ler cache de respostas: {e}")
+            return None
+    
+    def put(self, key: str, response: str, ttl: float, model: Optional[str] = None) -> bool:
+        """
+        Grava a resposta (substitui a anterior da mesma chave)
+        
+        Args:
+            key: Chave da requisição
+            response: Texto da resposta
+            ttl: Validade em segundos
+            model: Modelo que gerou a resposta (informativo)
+        """
+        try:
+            now = time.time()
+            with configure_connection(sqlite3.connect(self.db_path)) as conn:
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO llm_response_cache
+                        (key, response, model, size, created_at, expires_at, last_hit_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (key, response, model, len(response.encode('utf-8')), now, now + ttl, now)
+                )
+                self._puts += 1
+                if self._puts % self.evict_every == 0:
+                    self._evict(conn, now)
+            return True
+        
+        except Exception as e:
+            print(f"ERRO: Erro ao gravar cache de respostas: {e}")
+            return False
+    
+    def _evict(self, conn: sqlite3.Connection, now: float) -> int:
+        """Remove expiradas e, acima do limite de tamanho, as menos usadas"""
+        removed = conn.execute("DELETE FROM llm_response_cache WHERE expires_at <= ?", (now,)).rowcount
+        
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_response_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return removed
+        
+        excess = total - self.max_bytes
+        keys = []
+        for key, size in conn.execute("SELECT key, size FROM llm_response_cache ORDER BY last_hit_at ASC"):
+            keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM llm_response_cache WHERE key = ?", keys)
+        return removed + len(keys)
+    
+    def clear(self) -> bool:
+        """Remove todas as respostas gravadas"""
+        try:
+            with configure_connection(sqlite3.connect(self.db_path)) as conn:
+                conn.execute("DELETE FROM llm_response_cache")
+            return True
+        
+        except Exception as e:
+            print(f"ERRO: Erro ao limpar cache de respostas: {e}")
+            return False
@@ -3,6 +3,9 @@
 -- Compatível com LangChain memory pattern
 -- Criação incremental, sem quebrar funcionalidades existentes
 
+-- WAL: leitores não bloqueiam o escritor (vários workers no mesmo banco)
+PRAGMA journal_mode = WAL;
+
 -- Tabela de configurações gerais
 CREATE TABLE IF NOT EXISTS settings (
     key TEXT PRIMARY KEY,
@@ -45,6 +48,158 @@ CREATE TABLE IF NOT EXISTS chat_sessions (
     message_count INTEGER DEFAULT 0
 );
 
+-- Resumo incremental das mensagens que saíram da janela de contexto
+CREATE TABLE IF NOT EXISTS session_summaries (
+    session_id TEXT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    covered_messages INTEGER NOT NULL DEFAULT 0,  -- mensagens mais antigas já resumidas
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Imagens enviadas no chat, endereçadas pelo SHA-256 dos bytes decodificados
+-- (imagens repetidas são gravadas uma vez; mensagens guardam só a referência)
+CREATE TABLE IF NOT EXISTS image_blobs (
+    sha256 TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    mime_type TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Sessões que referenciam cada imagem (imagens sem referência são removidas
+-- junto com a sessão)
+CREATE TABLE IF NOT EXISTS image_refs (
+    session_id TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (session_id, sha256)
+);
+
+CREATE INDEX IF NOT EXISTS idx_image_refs_sha256
+ON image_refs(sha256);
+
+-- Resultados de lotes (/agent/batch) concluídos sem erro, usados para
+-- retomar execuções interrompidas com o mesmo batch_id
+CREATE TABLE IF NOT EXISTS batch_results (
+    batch_id TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    result TEXT NOT NULL,             -- JSON do resultado
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (batch_id, item_id)
+);
+
+-- Cache de respostas do LLM por hash de modelo, parâmetros e mensagens
+-- renderizadas (tempos em epoch; expiração por TTL e remoção por tamanho)
+CREATE TABLE IF NOT EXISTS llm_response_cache (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    model TEXT,
+    size INTEGER NOT NULL,            -- bytes da resposta
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    last_hit_at REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_llm_response_cache_expires
+ON llm_response_cache(expires_at);
+
+CREATE INDEX IF NOT EXISTS idx_llm_response_cache_last_hit
+ON llm_response_cache(last_hit_at);
+
+-- Contabilidade de uso do LLM: uma linha por chamada ao provedor (só inserção;
+-- tempo em epoch, latência em ms, resultado ok/error/rate_limited/timeout/cancelled)
+CREATE TABLE IF NOT EXISTS llm_usage_events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    provider TEXT NOT NULL,
+    model TEXT NOT NULL,
+    session_id TEXT,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    cache_creation_tokens INTEGER NOT NULL DEFAULT 0,
+    latency_ms INTEGER NOT NULL,
+    outcome TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_llm_usage_events_ts
+ON llm_usage_events(ts);
+
+-- Totais por minuto/hora/dia (bucket = início em epoch UTC) e provedor/modelo,
+-- atualizados na mesma transação que grava os eventos
+CREATE TABLE IF NOT EXISTS llm_usage_rollups (
+    granularity TEXT NOT NULL,        -- minute, hour ou day
+    bucket INTEGER NOT NULL,
+    provider TEXT NOT NULL,
+    model TEXT NOT NULL,
+    calls INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    rate_limited INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    cache_creation_tokens INTEGER NOT NULL DEFAULT 0,
+    latency_ms_total INTEGER NOT NULL DEFAULT 0,
+    latency_ms_max INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (granularity, bucket, provider, model)
+) WITHOUT ROWID;
+
+-- Totais de uso por sessão, atualizados junto com os rollups
+CREATE TABLE IF NOT EXISTS llm_usage_sessions (
+    session_id TEXT PRIMARY KEY,
+    calls INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    cache_creation_tokens INTEGER NOT NULL DEFAULT 0,
+    latency_ms_total INTEGER NOT NULL DEFAULT 0,
+    first_at REAL NOT NULL,
+    last_at REAL NOT NULL
+);
+
+-- Versão do estado de cada sessão (mensagens + resumo), incrementada a cada
+-- escrita. Caches em memória de cada worker comparam a versão antes de usar
+-- a entrada, o que invalida o cache entre processos
+CREATE TABLE IF NOT EXISTS session_versions (
+    session_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS bump_version_message_insert
+AFTER INSERT ON message_store
+BEGIN
+    INSERT INTO session_versions (session_id, version) VALUES (NEW.session_id, 1)
+    ON CONFLICT(session_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS bump_version_message_delete
+AFTER DELETE ON message_store
+BEGIN
+    INSERT INTO session_versions (session_id, version) VALUES (OLD.session_id, 1)
+    ON CONFLICT(session_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS bump_version_summary_insert
+AFTER INSERT ON session_summaries
+BEGIN
+    INSERT INTO session_versions (session_id, version) VALUES (NEW.session_id, 1)
+    ON CONFLICT(session_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS bump_version_summary_update
+AFTER UPDATE ON session_summaries
+BEGIN
+    INSERT INTO session_versions (session_id, version) VALUES (NEW.session_id, 1)
+    ON CONFLICT(session_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS bump_version_summary_delete
+AFTER DELETE ON session_summaries
+BEGIN
+    INSERT INTO session_versions (session_id, version) VALUES (OLD.session_id, 1)
+    ON CONFLICT(session_id) DO UPDATE SET version = version + 1;
+END;
+
 -- Trigger para atualizar updated_at quando nova mensagem é adicionada
 CREATE TRIGGER IF NOT EXISTS update_session_timestamp
 AFTER INSERT ON message_store
@@ -0,0 +1,384 @@
+"""
+Contabilidade de uso do LLM
+Cada chamada ao provedor vira uma linha em llm_usage_events (só inserção) e
+atualiza, na mesma transação, os totais por minuto/hora/dia e provedor/modelo
+(llm_usage_rollups) e por sessão (llm_usage_sessions). As consultas leem só
+os rollups, então o custo não cresce com o número de chamadas gravadas.
+"""
+
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from database.chat_memory import configure_connection
+
+# Tamanho do bucket de cada granularidade em segundos (buckets alinhados em UTC)
+GRANULARITIES = {'minute': 60, 'hour': 3600, 'day': 86400}
+
+# Contadores somados nos rollups
+TOKEN_FIELDS = ('prompt_tokens', 'completion_tokens', 'cached_tokens', 'cache_creation_tokens')
+
+
+class UsageStore:
+    """
+    Gravação write-behind do uso do LLM
+    
+    record() só enfileira; uma thread dedicada grava em lotes, cada lote numa
+    transação que insere os eventos e soma os rollups (os eventos do lote são
+    agregados antes, um UPSERT por bucket). Eventos e rollups finos antigos
+    são removidos conforme a retenção.
+    """
+    
+    _STOP = object()
+    
+    def __init__(self, db_path: str, batch_size: int = 256, event_retention_days: float = 30,
+                 minute_retention_hours: float = 48, hour_retention_days: float = 90, prune_every: int = 200):
+        """
+        Args:
+            db_path: Caminho para o banco SQLite (o mesmo do chat)
+            batch_size: Número máximo de eventos por transação
+            event_retention_days: Dias de eventos individuais mantidos
+            minute_retention_hours: Horas de rollups por minuto mantidas
+            hour_retention_days: Dias de rollups por hora mantidos (por dia: sem limite)
+            prune_every: Lotes gravados entre rodadas de limpeza
+        """
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.retention = {
+            'events': event_retention_days * 86400,
+            'minute': minute_retention_hours * 3600,
+            'hour': hour_retention_days * 86400,
+        }
+        self.prune_every = max(1, prune_every)
+        
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._unfinished = 0
+        self._state = threading.Condition()
+        self._closed = False
+        self._batches = 0
+        self.recorded = 0
+        self.dropped = 0
+        
+        self._thread = threading.Thread(target=self._run, name="llm-usage-store", daemon=True)
+        self._thread.start()
+    
+    def record(self, event: Dict[str, Any]) -> None:
+        """Enfileira o registro de uma chamada (retorna imediatamente)"""
+        with self._state:
+            if self._closed:
+                self.dropped += 1
+                return
+            self._unfinished += 1
+        self._queue.put(event)
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Aguarda a gravação dos eventos enfileirados (True se esvaziou dentro do timeout)"""
+        with self._state:
+            return self._state.wait_for(lambda: self._unfinished == 0, timeout)
+    
+    def close(self, timeout: Optional[float] = None) -> bool:
+        """Grava os eventos pendentes e encerra a thread de escrita"""
+        with self._state:
+            if self._closed:
+                return self._unfinished == 0
+            self._closed = True
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+    
+    def _run(self):
+        """Loop da thread de escrita: drena a fila em lotes"""
+        conn = configure_connection(sqlite3.connect(self.db_path, check_same_thread=False))
+        self._prune(conn)
+        
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is self._STOP:
+                break
+            
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            
+            self._write_batch(conn, batch)
+            self._batches += 1
+            if self._batches % self.prune_every == 0:
+                self._prune(conn)
+        
+        conn.close()
+    
+    def _write_batch(self, conn: sqlite3.Connection, batch: List[Dict[str, Any]]):
+        """Insere os eventos e soma os rollups numa única transação"""
+        try:
+            rollups: Dict[Tuple[str, int, str, str], List[int]] = {}
+            sessions: Dict[str, List[Any]] = {}
+            events = []
+            for event in batch:
+                ts = float(event['ts'])
+                provider = event.get('provider') or ''
+                model = event.get('model') or ''
+                tokens = [int(event.get(field) or 0) for field in TOKEN_FIELDS]
+                latency = int(round(event.get('latency_ms') or 0))
+                outcome = event.get('outcome') or 'ok'
+                failed = int(outcome not in ('ok', 'cancelled'))
+                limited = int(outcome == 'rate_limited')
+                events.append((ts, provider, model, event.get('session_id'), *tokens, latency, outcome))
+                
+                for granularity, size in GRANULARITIES.items():
+                    key = (granularity, int(ts // size) * size, provider, model)
+                    totals = rollups.get(key)
+                    if totals is None:
+                        totals = rollups[key] = [0] * 9
+                    totals[0] += 1
+                    totals[1] += failed
+                    totals[2] += limited
+                    for index, value in enumerate(tokens):
+                        totals[3 + index] += value
+                    totals[7] += latency
+                    totals[8] = max(totals[8], latency)
+                
+                session_id = event.get('session_id')
+                if session_id:
+                    totals = sessions.get(session_id)
+                    if totals is None:
+                        totals = sessions[session_id] = [0] * 7 + [ts, ts]
+                    totals[0] += 1
+                    totals[1] += failed
+                    for index, value in enumerate(tokens):
+                        totals[2 + index] += value
+                    totals[6] += latency
+                    totals[7] = min(totals[7], ts)
+                    totals[8] = max(totals[8], ts)
+            
+            with conn:
+                conn.executemany(
+                    """
+                    INSERT INTO llm_usage_events
+                        (ts, provider, model, session_id, prompt_tokens, completion_tokens,
+                         cached_tokens, cache_creation_tokens, latency_ms, outcome)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    events
+                )
+                conn.executemany(
+                    """
+                    INSERT INTO llm_usage_rollups
+                        (granularity, bucket, provider, model, calls, errors, rate_limited, prompt_tokens,
+                         completion_tokens, cached_tokens, cache_creation_tokens, latency_ms_total, latency_ms_max)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(granularity, bucket, provider, model) DO UPDATE SET
+                        calls = calls + excluded.calls,
+                        errors = errors + excluded.errors,
+                        rate_limited = rate_limited + excluded.rate_limited,
+                        prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                        completion_tokens = completion_tokens + excluded.completion_tokens,
+                        cached_tokens = cached_tokens + excluded.cached_tokens,
+                        cache_creation_tokens = cache_creation_tokens + excluded.cache_creation_tokens,
+                        latency_ms_total = latency_ms_total + excluded.latency_ms_total,
+                        latency_ms_max = MAX(latency_ms_max, excluded.latency_ms_max)
+                    """,
+                    [(*key, *totals) for key, totals in rollups.items()]
+                )
+                conn.executemany(
+                    """
+                    INSERT INTO llm_usage_sessions
+                        (session_id, calls, errors, prompt_tokens, completion_tokens, cached_tokens,
+                         cache_creation_tokens, latency_ms_total, first_at, last_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(session_id) DO UPDATE SET
+                        calls = calls + excluded.calls,
+                        errors = errors + excluded.errors,
+                        prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                        completion_tokens = completion_tokens + excluded.completion_tokens,
+                        cached_tokens = cached_tokens + excluded.cached_tokens,
+                        cache_creation_tokens = cache_creation_tokens + excluded.cache_creation_tokens,
+                        latency_ms_total = latency_ms_total + excluded.latency_ms_total,
+                        first_at = MIN(first_at, excluded.first_at),
+                        last_at = MAX(last_at, excluded.last_at)
+                    """,
+                    [(session_id, *totals) for session_id, totals in sessions.items()]
+                )
+            self.recorded += len(batch)
+        
+        except Exception as e:
+            self.dropped += len(batch)
+            print(f"ERRO: Erro ao gravar {len(batch)} registros de uso do LLM: {e}")
+        
+        finally:
+            with self._state:
+                self._unfinished -= len(batch)
+                self._state.notify_all()
+    
+    def _prune(self, conn: sqlite3.Connection):
+        """Remove eventos e rollups por minuto/hora além da retenção"""
+        try:
+            now = time.time()
+            with conn:
+                conn.execute("DELETE FROM llm_usage_events WHERE ts < ?", (now - self.retention['events'],))
+                for granularity in ('minute', 'hour'):
+                    conn.execute(
+                        "DELETE FROM llm_usage_rollups WHERE granularity = ? AND bucket < ?",
+                        (granularity, now - self.retention[granularity])
+                    )
+        
+        except Exception as e:
+            print(f"AVISO: Limpeza da contabilidade de uso falhou: {e}")
+    
+    def rollups(self, granularity: str = 'hour', buckets: int = 24, until: Optional[float] = None,
+                provider: Optional[str] = None, model: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Uso dos últimos buckets de uma granularidade
+        
+        Lê só os rollups (faixa da chave primária), sem varrer os eventos.
+        
+        Args:
+            granularity: 'minute', 'hour' ou 'day'
+            buckets: Número de buckets até until (inclusive o atual)
+            until: Epoch de referência (None = agora)
+            provider: Filtra por provedor
+            model: Filtra por modelo
+        
+        Returns:
+            Dict com buckets (totais por bucket e por provedor/modelo) e totals do período
+        """
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Granularidade inválida: {granularity} (use {', '.join(GRANULARITIES)})")
+        size = GRANULARITIES[granularity]
+        end = int((until if until is not None else time.time()) // size) * size
+        start = end - (max(1, buckets) - 1) * size
+        
+        query = """
+            SELECT bucket, provider, model, calls, errors, rate_limited, prompt_tokens, completion_tokens,
+                   cached_tokens, cache_creation_tokens, latency_ms_total, latency_ms_max
+            FROM llm_usage_rollups
+            WHERE granularity = ? AND bucket BETWEEN ? AND ?
+        """
+        params: List[Any] = [granularity, start, end]
+        if provider:
+            query += " AND provider = ?"
+            params.append(provider)
+        if model:
+            query += " AND model = ?"
+            params.append(model)
+        query += " ORDER BY bucket"
+        
+        with configure_connection(sqlite3.connect(self.db_path)) as conn:
+            rows = conn.execute(query, params).fetchall()
+        
+        by_bucket: Dict[int, Dict[str, Any]] = {}
+        totals = _empty_totals()
+        for row in rows:
+            bucket, row_provider, row_model = row[0], row[1], row[2]
+            entry = _totals_from_row(row[3:])
+            slot = by_bucket.get(bucket)
+            if slot is None:
+                slot = by_bucket[bucket] = {'bucket': bucket, **_empty_totals(), 'models': {}}
+            _add_totals(slot, entry)
+            _add_totals(totals, entry)
+            slot['models'][f"{row_provider}/{row_model}"] = _with_average(entry)
+        
+        return {
+            'granularity': granularity,
+            'start': start,
+            'end': end + size,
+            'buckets': [_with_average(slot) for slot in by_bucket.values()],
+            'totals': _with_average(totals)
+        }
+    
+    def session_usage(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Totais de uso de uma sessão (None se não houver chamadas registradas)"""
+        with configure_connection(sqlite3.connect(self.db_path)) as conn:
+            row = conn.execute(
+                """
+                SELECT calls, errors, prompt_tokens, completion_tokens, cached_tokens,
+                       cache_creation_tokens, latency_ms_total, first_at, last_at
+                FROM llm_usage_sessions WHERE session_id = ?
+                """,
+                (session_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        calls, errors, *tokens, latency_total, first_at, last_at = row
+        return _with_average({
+            'session_id': session_id,
+            'calls': calls,
+            'errors': errors,
+            **dict(zip(TOKEN_FIELDS, tokens)),
+            'latency_ms_total': latency_total,
+            'first_at': first_at,
+            'last_at': last_at
+        })
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Métricas da gravação"""
+        with self._state:
+            pending = self._unfinished
+        return {'recorded': self.recorded, 'pending': pending, 'dropped': self.dropped}
+
+
+def _empty_totals() -> Dict[str, int]:
+    return {'calls': 0, 'errors': 0, 'rate_limited': 0, **{field: 0 for field in TOKEN_FIELDS},
+            'latency_ms_total': 0, 'latency_ms_max': 0}
+
+
+def _totals_from_row(values) -> Dict[str, int]:
+    calls, errors, limited, *rest = values
+    tokens, (latency_total, latency_max) = rest[:len(TOKEN_FIELDS)], rest[len(TOKEN_FIELDS):]
+    return {'calls': calls, 'errors': errors, 'rate_limited': limited, **dict(zip(TOKEN_FIELDS, tokens)),
+            'latency_ms_total': latency_total, 'latency_ms_max': latency_max}
+
+
+def _add_totals(target: Dict[str, Any], entry: Dict[str, int]) -> None:
+    for field, value in entry.items():
+        if field == 'latency_ms_max':
+            target[field] = max(target[field], value)
+        else:
+            target[field] += value
+
+
+def _with_average(totals: Dict[str, Any]) -> Dict[str, Any]:
+    """Acrescenta a latência média por chamada"""
+    calls = totals.get('calls') or 0
+    totals['latency_ms_avg'] = round(totals['latency_ms_total'] / calls, 2) if calls else 0.0
+    return totals
+
+
+# Stores compartilhados por banco (uma thread de escrita por banco)
+_usage_stores: Dict[str, UsageStore] = {}
+_usage_stores_lock = threading.Lock()
+
+
+def get_usage_store(db_path: str) -> UsageStore:
+    """Retorna o UsageStore do banco, criando-o se necessário"""
+    with _usage_stores_lock:
+        store = _usage_stores.get(db_path)
+        if store is None:
+            store = UsageStore(db_path)
+            _usage_stores[db_path] = store
+        return store
+
+
+def close_usage_stores(timeout: Optional[float] = 10.0) -> bool:
+    """Grava os registros pendentes e encerra os stores (usar no shutdown)"""
+    with _usage_stores_lock:
+        stores = list(_usage_stores.values())
+        _usage_stores.clear()
+    
+    ok = True
+    for store in stores:
+        ok = store.close(timeout) and ok
+    return ok
+
+
+atexit.register(close_usage_stores)
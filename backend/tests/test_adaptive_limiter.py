@@ -0,0 +1,125 @@
+"""
+Testes do limitador AIMD por provedor/modelo: aumento aditivo com o limite
+em uso, corte multiplicativo em 429/529 e pausa pelo Retry-After
+"""
+
+import asyncio
+import time
+
+from agentes.orb_agent.utils.concurrency import AdaptiveLimiter, parse_reset, parse_retry_after
+
+
+async def _hold(limiter, count, action):
+    """Ocupa count vagas enquanto action() roda"""
+    release = asyncio.Event()
+    entered = 0
+    
+    async def occupy():
+        nonlocal entered
+        async with limiter.slot():
+            entered += 1
+            await release.wait()
+    
+    tasks = [asyncio.create_task(occupy()) for _ in range(count)]
+    while entered < count:
+        await asyncio.sleep(0)
+    try:
+        action()
+    finally:
+        release.set()
+        await asyncio.gather(*tasks)
+
+
+def test_limit_grows_only_while_in_use():
+    limiter = AdaptiveLimiter('teste', initial=2, max_limit=4, decrease_cooldown=0)
+    
+    # Uma vaga ocupada de duas: latência saudável não aumenta o limite
+    for _ in range(10):
+        limiter.observe_latency(0.1)
+    assert limiter.limit == 2
+    
+    def saturated():
+        for _ in range(50):
+            limiter.observe_latency(0.1)
+    
+    asyncio.run(_hold(limiter, 2, saturated))
+    assert limiter.limit > 2
+    assert limiter.limit <= 4
+
+
+def test_overload_cuts_limit_once_per_cooldown():
+    limiter = AdaptiveLimiter('teste', initial=8, min_limit=1, backoff=0.5, decrease_cooldown=60)
+    
+    limiter.on_overload()
+    limiter.on_overload()
+    
+    assert limiter.limit == 4
+    assert limiter.overloads == 2
+    
+    for _ in range(10):
+        limiter._last_decrease = 0.0
+        limiter.on_overload()
+    assert limiter.limit == 1
+
+
+def test_latency_spike_cuts_limit():
+    limiter = AdaptiveLimiter('teste', initial=8, latency_backoff=0.5, latency_tolerance=2.0, decrease_cooldown=0)
+    for _ in range(20):
+        limiter.observe_latency(0.1)
+    
+    for _ in range(5):
+        limiter.observe_latency(2.0)
+    
+    assert limiter.limit < 8
+    assert limiter.latency_decreases >= 1
+
+
+def test_retry_after_pauses_new_calls():
+    limiter = AdaptiveLimiter('teste', initial=4, decrease_cooldown=0)
+    
+    async def run():
+        limiter.observe_response(429, {'retry-after-ms': '200'})
+        started = time.monotonic()
+        async with limiter.slot():
+            return time.monotonic() - started
+    
+    waited = asyncio.run(run())
+    
+    assert limiter.limit == 2
+    assert limiter.overloads == 1
+    assert waited >= 0.15
+    assert limiter.queued == 1
+
+
+def test_rate_limit_headers():
+    limiter = AdaptiveLimiter('teste', initial=8)
+    
+    limiter.observe_response(200, {'x-ratelimit-remaining-requests': '3'})
+    assert limiter.limit == 3
+    
+    limiter.observe_response(200, {'x-ratelimit-remaining-requests': '0', 'x-ratelimit-reset-requests': '2s'})
+    assert limiter.paused_until > time.monotonic() + 1
+    
+    assert parse_retry_after({'retry-after': '1.5'}) == 1.5
+    assert parse_retry_after({'retry-after': 'Wed, 21 Oct 2015 07:28:00 GMT'}) is None
+    assert parse_reset('6m0s') == 360
+    assert parse_reset('120ms') == 0.12
+
+
+def test_waiters_are_served_in_order():
+    limiter = AdaptiveLimiter('teste', initial=1)
+    order = []
+    
+    async def call(index):
+        async with limiter.slot():
+            order.append(index)
+            await asyncio.sleep(0.01)
+    
+    async def run():
+        await asyncio.gather(*(call(index) for index in range(5)))
+    
+    asyncio.run(run())
+    
+    assert order == [0, 1, 2, 3, 4]
+    assert limiter.in_flight == 0
+    assert limiter.max_queue_depth == 4
@@ -0,0 +1,157 @@
+"""
+Testes do circuit breaker dos backends LLM: abertura por falhas seguidas
+ou taxa de erro, teste único em half-open e fechamento, e o failover do
+RoutingProvider respeitando os circuitos abertos
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from agentes.orb_agent.llms.llm_provider import BaseLLMProvider
+from agentes.orb_agent.llms.router import (
+    CLOSED, HALF_OPEN, OPEN, Backend, BackendHealth, NoHealthyBackendError, RoutingProvider
+)
+
+
+def _call(health, ok=True):
+    health.begin()
+    if ok:
+        health.success(0.1)
+    else:
+        health.failure()
+
+
+def _expire_cooldown(health):
+    health.opened_at = time.monotonic() - health.current_cooldown
+
+
+def test_consecutive_failures_open_the_circuit():
+    health = BackendHealth('openai/teste', failure_threshold=3, min_calls=100)
+    
+    _call(health, ok=False)
+    _call(health, ok=False)
+    assert health.state == CLOSED
+    _call(health, ok=False)
+    
+    assert health.state == OPEN
+    assert health.trips == 1
+    assert not health.available()
+
+
+def test_error_rate_opens_the_circuit():
+    health = BackendHealth('openai/teste', failure_threshold=100, min_calls=4, error_rate=0.5)
+    
+    for ok in (True, False, True):
+        _call(health, ok)
+    assert health.state == CLOSED
+    _call(health, ok=False)
+    
+    assert health.state == OPEN
+
+
+def test_half_open_allows_a_single_probe_and_success_closes():
+    health = BackendHealth('openai/teste', failure_threshold=1, cooldown=30)
+    _call(health, ok=False)
+    assert not health.available()
+    
+    _expire_cooldown(health)
+    assert health.available()
+    assert health.state == HALF_OPEN
+    
+    health.begin()
+    # Teste em andamento: nenhuma outra chamada até o resultado
+    assert health.probe_in_flight
+    assert not health.available()
+    
+    health.success(0.1)
+    assert health.state == CLOSED
+    assert health.available()
+    assert health.current_cooldown == 30
+
+
+def test_failed_probe_reopens_with_longer_cooldown():
+    health = BackendHealth('openai/teste', failure_threshold=1, cooldown=30, max_cooldown=100)
+    _call(health, ok=False)
+    
+    for expected in (60, 100, 100):
+        _expire_cooldown(health)
+        assert health.available()
+        _call(health, ok=False)
+        assert health.state == OPEN
+        assert health.current_cooldown == expected
+        assert not health.available()
+
+
+def test_cancelled_probe_frees_the_slot():
+    health = BackendHealth('openai/teste', failure_threshold=1)
+    _call(health, ok=False)
+    _expire_cooldown(health)
+    assert health.available()
+    
+    health.begin()
+    health.cancelled()
+    
+    assert health.state == HALF_OPEN
+    assert health.available()
+
+
+class FakeProvider(BaseLLMProvider):
+    """Provedor sem rede que falha enquanto failing for True"""
+    
+    name = 'openai'
+    
+    def __init__(self, model, failing=False):
+        self.config = {'llm_model': model}
+        self.failing = failing
+        self.calls = 0
+    
+    async def generate_response(self, context):
+        self.calls += 1
+        await asyncio.sleep(0)
+        if self.failing:
+            raise ConnectionError(f"{self.config['llm_model']} indisponível")
+        return f"resposta de {self.config['llm_model']}"
+
+
+def _router(primary_failing=False, secondary_failing=False):
+    primary = Backend('openai/primario', FakeProvider('primario', primary_failing),
+                      BackendHealth('openai/primario', failure_threshold=2))
+    secondary = Backend('openai/secundario', FakeProvider('secundario', secondary_failing),
+                        BackendHealth('openai/secundario', failure_threshold=2))
+    return RoutingProvider([primary, secondary], strategy='priority'), primary, secondary
+
+
+def test_router_fails_over_and_skips_open_circuits():
+    router, primary, secondary = _router(primary_failing=True)
+    
+    for _ in range(2):
+        context = {'served_by': {}}
+        assert asyncio.run(router.generate_response(context)) == 'resposta de secundario'
+        assert context['served_by']['backend'] == 'openai/secundario'
+    
+    # Duas falhas seguidas abriram o circuito: o primário nem é tentado
+    assert primary.health.state == OPEN
+    assert asyncio.run(router.generate_response({})) == 'resposta de secundario'
+    assert primary.provider.calls == 2
+    assert secondary.provider.calls == 3
+    
+    # Após o cooldown, o primário recuperado recebe o teste e volta a atender
+    primary.provider.failing = False
+    _expire_cooldown(primary.health)
+    assert asyncio.run(router.generate_response({})) == 'resposta de primario'
+    assert primary.health.state == CLOSED
+
+
+def test_router_raises_when_every_circuit_is_open():
+    router, primary, secondary = _router(primary_failing=True, secondary_failing=True)
+    
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            asyncio.run(router.generate_response({}))
+    
+    assert primary.health.state == OPEN
+    assert secondary.health.state == OPEN
+    with pytest.raises(NoHealthyBackendError):
+        asyncio.run(router.generate_response({}))
@@ -0,0 +1,147 @@
+"""
+Testes da fila write-behind do chat: turnos gravados em lote, mensagens
+pendentes visíveis na leitura (sem duplicar as já gravadas) e flush
+"""
+
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from database import chat_memory
+from database.chat_memory import ChatMemoryManager, ChatMessage, TurnRecord, close_write_queues
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'database', 'schema.sql')
+
+
+@pytest.fixture
+def memory(tmp_path):
+    db_path = str(tmp_path / 'chat.db')
+    with sqlite3.connect(db_path) as conn:
+        with open(SCHEMA_PATH, encoding='utf-8') as schema:
+            conn.executescript(schema.read())
+    yield ChatMemoryManager(db_path)
+    close_write_queues(5)
+
+
+class GatedWriter:
+    """Segura a thread de escrita no primeiro lote até release() e registra o tamanho de cada lote"""
+    
+    def __init__(self, write_queue):
+        self.write_queue = write_queue
+        self.batches = []
+        self.entered = threading.Event()
+        self.gate = threading.Event()
+        self._write_batch = write_queue._write_batch
+        write_queue._write_batch = self
+    
+    def __call__(self, conn, batch):
+        self.batches.append(len(batch))
+        self.entered.set()
+        self.gate.wait(5)
+        self._write_batch(conn, batch)
+    
+    def release(self):
+        self.gate.set()
+
+
+def _turn(session_id, index):
+    return TurnRecord(session_id, [
+        ChatMessage('user', f'pergunta {index}'),
+        ChatMessage('assistant', f'resposta {index}')
+    ])
+
+
+def _stored(memory, session_id):
+    with sqlite3.connect(memory.db_path) as conn:
+        rows = conn.execute(
+            "SELECT message FROM message_store WHERE session_id = ? ORDER BY id",
+            (session_id,)
+        ).fetchall()
+    return [ChatMessage.from_json(row[0]).content for row in rows]
+
+
+def test_turns_queued_during_a_write_go_in_one_batch(memory):
+    write_queue = memory.write_queue
+    writer = GatedWriter(write_queue)
+    commits = []
+    write_queue.add_commit_listener(lambda session_id, before, after: commits.append((session_id, before, after)))
+    
+    write_queue.enqueue(_turn('a', 0))
+    assert writer.entered.wait(5)
+    for index in range(1, 6):
+        write_queue.enqueue(_turn('a' if index % 2 else 'b', index))
+    writer.release()
+    
+    assert write_queue.flush(5)
+    assert writer.batches == [1, 5]
+    assert _stored(memory, 'a') == ['pergunta 0', 'resposta 0', 'pergunta 1', 'resposta 1',
+                                    'pergunta 3', 'resposta 3', 'pergunta 5', 'resposta 5']
+    assert _stored(memory, 'b') == ['pergunta 2', 'resposta 2', 'pergunta 4', 'resposta 4']
+    # Um aviso por sessão e por lote, com as versões antes/depois
+    assert commits == [('a', 0, 2), ('a', 2, 8), ('b', 0, 4)]
+
+
+def test_pending_turns_are_read_once(memory):
+    memory.enqueue_turn('s', 'primeira', 'ok')
+    assert memory.flush(5)
+    writer = GatedWriter(memory.write_queue)
+    
+    memory.enqueue_turn('s', 'segunda', 'ok')
+    assert writer.entered.wait(5)
+    
+    # Ainda na fila: visível na leitura, mais recente primeiro
+    assert [msg.content for msg in memory.get_messages('s', limit=10)] == ['ok', 'segunda', 'ok', 'primeira']
+    assert memory.count_messages('s') == 4
+    
+    writer.release()
+    assert memory.flush(5)
+    assert [msg.content for msg in memory.get_messages('s')] == ['primeira', 'ok', 'segunda', 'ok']
+    assert memory.count_messages('s') == 4
+
+
+def test_written_turn_not_yet_released_is_not_duplicated(memory):
+    write_queue = memory.write_queue
+    record = _turn('s', 0)
+    
+    # Sem transação: pendente em qualquer versão lida
+    assert len(write_queue.unwritten_messages([record], 0)) == 2
+    
+    # Gravado na versão 2: leituras que já veem a versão 2 não o repetem
+    record.version = 2
+    assert len(write_queue.unwritten_messages([record], 0)) == 2
+    assert write_queue.unwritten_messages([record], 2) == []
+
+
+def test_failed_turn_does_not_drop_the_rest_of_the_batch(memory):
+    write_queue = memory.write_queue
+    writer = GatedWriter(write_queue)
+    
+    write_queue.enqueue(_turn('s', 0))
+    assert writer.entered.wait(5)
+    broken = TurnRecord('s', [ChatMessage('user', object())])
+    write_queue.enqueue(broken)
+    write_queue.enqueue(_turn('s', 1))
+    writer.release()
+    
+    assert write_queue.flush(5)
+    assert broken.version is None
+    assert _stored(memory, 's') == ['pergunta 0', 'resposta 0', 'pergunta 1', 'resposta 1']
+    assert write_queue.pending_count() == 0
+
+
+def test_flush_times_out_while_writer_is_busy(memory, monkeypatch):
+    writer = GatedWriter(memory.write_queue)
+    memory.enqueue_turn('s', 'pergunta', 'resposta')
+    assert writer.entered.wait(5)
+    monkeypatch.setattr(chat_memory, 'DELETE_FLUSH_TIMEOUT', 0.05)
+    
+    assert not memory.flush(0.05)
+    # Delete não roda com turnos pendentes (eles recriariam a sessão)
+    assert not memory.delete_session('s')
+    
+    writer.release()
+    assert memory.flush(5)
+    assert memory.delete_session('s')
+    assert _stored(memory, 's') == []
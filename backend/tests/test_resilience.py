@@ -0,0 +1,172 @@
+"""
+Testes da resiliência das chamadas ao provedor: retentativas dentro do
+prazo (max_response_time / Retry-After) e hedge disparado pelo percentil
+de latência
+"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from agentes.orb_agent.llms import resilience
+from agentes.orb_agent.llms.resilience import ResiliencePolicy, ResilientCaller
+
+
+@pytest.fixture(autouse=True)
+def fresh_stats(monkeypatch):
+    """Latências e contadores novos a cada teste (são globais do processo)"""
+    monkeypatch.setattr(resilience, '_latency_tracker', None)
+    monkeypatch.setattr(resilience, '_resilience_stats', None)
+
+
+class Overloaded(Exception):
+    """Erro do provedor com status e cabeçalhos, no formato dos SDKs"""
+    
+    def __init__(self, status_code=503, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+def _failing(failures, error_factory, result='ok'):
+    """Fábrica de tentativas que falha nas primeiras failures chamadas"""
+    calls = []
+    
+    async def attempt():
+        calls.append(time.monotonic())
+        if len(calls) <= failures:
+            raise error_factory()
+        return result
+    
+    return attempt, calls
+
+
+def test_transient_errors_are_retried():
+    factory, calls = _failing(2, ConnectionError)
+    caller = ResilientCaller(ResiliencePolicy(retry_attempts=2, retry_base_delay=0.001, retry_max_delay=0.01))
+    
+    assert asyncio.run(caller.call(factory, 'openai:teste')) == 'ok'
+    assert len(calls) == 3
+    stats = resilience.get_resilience_stats().get_stats()
+    assert stats['retries'] == 2
+    assert stats['successes'] == 1
+
+
+def test_non_retryable_errors_fail_at_once():
+    factory, calls = _failing(1, lambda: Overloaded(status_code=400))
+    caller = ResilientCaller(ResiliencePolicy(retry_attempts=3, retry_base_delay=0.001))
+    
+    with pytest.raises(Overloaded):
+        asyncio.run(caller.call(factory, 'openai:teste'))
+    assert len(calls) == 1
+
+
+def test_retries_stop_when_attempts_run_out():
+    factory, calls = _failing(5, lambda: Overloaded(status_code=529))
+    caller = ResilientCaller(ResiliencePolicy(retry_attempts=1, retry_base_delay=0.001, retry_max_delay=0.01))
+    
+    with pytest.raises(Overloaded):
+        asyncio.run(caller.call(factory, 'anthropic:teste'))
+    assert len(calls) == 2
+    assert resilience.get_resilience_stats().get_stats()['exhausted'] == 1
+
+
+def test_retry_after_beyond_the_deadline_is_not_waited():
+    factory, calls = _failing(1, lambda: Overloaded(status_code=429, headers={'retry-after': '5'}))
+    caller = ResilientCaller(ResiliencePolicy(
+        retry_attempts=3, retry_base_delay=0.001, retry_max_delay=10, max_response_time=1.0
+    ))
+    
+    started = time.monotonic()
+    with pytest.raises(Overloaded):
+        asyncio.run(caller.call(factory, 'openai:teste'))
+    
+    assert len(calls) == 1
+    assert time.monotonic() - started < 0.5
+
+
+def test_retry_after_within_the_deadline_is_honored():
+    factory, calls = _failing(1, lambda: Overloaded(status_code=429, headers={'retry-after-ms': '100'}))
+    caller = ResilientCaller(ResiliencePolicy(
+        retry_attempts=1, retry_base_delay=0.001, retry_max_delay=1, max_response_time=2.0
+    ))
+    
+    assert asyncio.run(caller.call(factory, 'openai:teste')) == 'ok'
+    assert calls[1] - calls[0] >= 0.09
+
+
+def _seed_latency(key, seconds, samples=20):
+    tracker = resilience.get_latency_tracker()
+    for _ in range(samples):
+        tracker.observe(key, seconds)
+
+
+def test_slow_attempt_is_hedged_and_cancelled():
+    _seed_latency('openai:teste', 0.01)
+    cancelled = []
+    calls = []
+    
+    async def attempt():
+        calls.append(len(calls))
+        if len(calls) == 1:
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+            return 'lenta'
+        return 'hedge'
+    
+    caller = ResilientCaller(ResiliencePolicy(hedge=True, hedge_min_delay=0.02, hedge_min_samples=20))
+    started = time.monotonic()
+    
+    assert asyncio.run(caller.call(attempt, 'openai:teste')) == 'hedge'
+    assert time.monotonic() - started < 0.5
+    assert cancelled == [True]
+    stats = resilience.get_resilience_stats().get_stats()
+    assert stats['hedges'] == 1
+    assert stats['hedge_wins'] == 1
+
+
+def test_no_hedge_without_enough_samples():
+    _seed_latency('openai:teste', 0.01, samples=5)
+    calls = []
+    
+    async def attempt():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'ok'
+    
+    caller = ResilientCaller(ResiliencePolicy(hedge=True, hedge_min_delay=0.01, hedge_min_samples=20))
+    
+    assert asyncio.run(caller.call(attempt, 'openai:teste')) == 'ok'
+    assert len(calls) == 1
+    assert resilience.get_resilience_stats().get_stats()['hedges'] == 0
+
+
+def test_stream_retries_until_the_first_delta():
+    opened = []
+    closed = []
+    
+    async def generator():
+        index = len(opened)
+        opened.append(index)
+        try:
+            if index == 0:
+                raise ConnectionError("conexão caiu antes do primeiro delta")
+            for delta in ('Olá', ', ', 'mundo'):
+                yield delta
+        finally:
+            closed.append(index)
+    
+    caller = ResilientCaller(ResiliencePolicy(retry_attempts=1, retry_base_delay=0.001, retry_max_delay=0.01))
+    
+    async def consume():
+        return [delta async for delta in caller.stream(generator, 'openai:teste')]
+    
+    assert asyncio.run(consume()) == ['Olá', ', ', 'mundo']
+    assert opened == [0, 1]
+    assert sorted(closed) == [0, 1]
+    assert resilience.get_latency_tracker().percentile('openai:teste:first_token', 50) is not None
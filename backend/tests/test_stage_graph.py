@@ -0,0 +1,173 @@
+"""
+Testes do executor de etapas do pipeline: ordem por dependência com etapas
+independentes em paralelo, timeout com retentativa e cancelamento das
+etapas em andamento
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from agentes.orb_agent.utils.stage_graph import Stage, StageGraph, StageTimeoutError
+
+
+def test_independent_stages_run_concurrently_before_their_consumer():
+    events = []
+    
+    async def slow(name, value):
+        events.append(f'{name}:start')
+        await asyncio.sleep(0.1)
+        events.append(f'{name}:end')
+        return value
+    
+    graph = StageGraph([
+        Stage('join', lambda left, right: left + right, inputs=('left', 'right')),
+        Stage('left', lambda message: slow('left', message.upper()), inputs=('message',)),
+        Stage('right', lambda message: slow('right', message[::-1]), inputs=('message',)),
+    ])
+    
+    started = time.monotonic()
+    values = asyncio.run(graph.run({'message': 'abc'}))
+    elapsed = time.monotonic() - started
+    
+    assert values['join'] == 'ABCcba'
+    assert elapsed < 0.18
+    assert events[:2] == ['left:start', 'right:start']
+
+
+def test_targets_run_only_required_stages():
+    calls = []
+    
+    def stage(name, result):
+        def func(**kwargs):
+            calls.append(name)
+            return result
+        return func
+    
+    graph = StageGraph([
+        Stage('context', stage('context', 'ctx'), inputs=('session_id',)),
+        Stage('tools', stage('tools', 'tl'), inputs=('message',)),
+        Stage('answer', stage('answer', 'ok'), inputs=('context', 'tools')),
+    ])
+    
+    values = asyncio.run(graph.run({'session_id': 's', 'message': 'oi'}, targets=['context']))
+    
+    assert calls == ['context']
+    assert values['context'] == 'ctx'
+    assert 'answer' not in values
+
+
+def test_invalid_graphs_are_rejected():
+    with pytest.raises(ValueError):
+        StageGraph([
+            Stage('a', lambda b: b, inputs=('b',)),
+            Stage('b', lambda a: a, inputs=('a',)),
+        ])
+    
+    graph = StageGraph([Stage('a', lambda missing: missing, inputs=('missing',))])
+    with pytest.raises(ValueError):
+        asyncio.run(graph.run({}))
+
+
+def test_timed_out_attempt_is_retried():
+    attempts = []
+    
+    async def flaky():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            await asyncio.sleep(1)
+        return 'ok'
+    
+    stage = Stage('flaky', flaky, timeout=0.05, retries=1)
+    values = asyncio.run(StageGraph([stage]).run({}))
+    
+    assert values['flaky'] == 'ok'
+    assert len(attempts) == 2
+    assert stage.timeouts == 1
+    assert stage.retried == 1
+
+
+def test_timeout_cancels_sibling_stages():
+    cancelled = asyncio.Event()
+    
+    async def sibling():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+    
+    async def run():
+        graph = StageGraph([
+            Stage('slow', lambda: asyncio.sleep(1), timeout=0.05),
+            Stage('sibling', sibling),
+        ])
+        with pytest.raises(StageTimeoutError):
+            await graph.run({})
+        await asyncio.sleep(0)
+        return cancelled.is_set()
+    
+    assert asyncio.run(run())
+
+
+def test_upstream_failure_is_propagated_and_consumers_do_not_run():
+    consumed = []
+    
+    def broken(message):
+        raise KeyError(message)
+    
+    graph = StageGraph([
+        Stage('broken', broken, inputs=('message',)),
+        Stage('consumer', lambda broken: consumed.append(broken), inputs=('broken',)),
+    ])
+    
+    with pytest.raises(KeyError):
+        asyncio.run(graph.run({'message': 'oi'}))
+    assert consumed == []
+    assert graph.stages['broken'].failures == 1
+
+
+def test_cancelling_the_run_cancels_running_stages():
+    cancelled = []
+    
+    async def long(name):
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(name)
+            raise
+    
+    async def run():
+        graph = StageGraph([
+            Stage('a', lambda: long('a')),
+            Stage('b', lambda: long('b')),
+        ])
+        task = asyncio.create_task(graph.run({}))
+        await asyncio.sleep(0.02)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0)
+    
+    asyncio.run(run())
+    
+    assert sorted(cancelled) == ['a', 'b']
+
+
+def test_cached_result_skips_the_stage():
+    calls = []
+    
+    def tools(message):
+        calls.append(message)
+        return len(message)
+    
+    stage = Stage('tools', tools, inputs=('message',), cache_ttl=60)
+    graph = StageGraph([stage])
+    
+    assert asyncio.run(graph.run({'message': 'oi'}))['tools'] == 2
+    assert asyncio.run(graph.run({'message': 'oi'}))['tools'] == 2
+    assert asyncio.run(graph.run({'message': 'olá'}))['tools'] == 3
+    
+    assert calls == ['oi', 'olá']
+    assert stage.cache_hits == 1
@@ -0,0 +1,133 @@
+"""
+Testes da contabilidade de uso do LLM: tokens de cada chamada ao provedor
+gravados no UsageStore, inclusive quando a chamada passa pelas tentativas
+(tasks) do ResilientCaller
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+from agentes.orb_agent.llms.llm_provider import LLMProvider, OpenAIProvider
+from agentes.orb_agent.utils import metrics
+from database.usage_store import UsageStore
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'database', 'schema.sql')
+
+USAGE = SimpleNamespace(prompt_tokens=120, completion_tokens=7, prompt_tokens_details=SimpleNamespace(cached_tokens=64))
+
+
+def _chunk(content=None, usage=None):
+    choices = [SimpleNamespace(delta=SimpleNamespace(content=content))] if content is not None else []
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+class FakeStream:
+    """Stream de chunks no formato do SDK da OpenAI (o último traz o uso)"""
+    
+    def __init__(self, chunks):
+        self.chunks = chunks
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc):
+        return False
+    
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            await asyncio.sleep(0)
+            yield chunk
+
+
+class FakeCompletions:
+    async def create(self, stream=False, **kwargs):
+        if stream:
+            return FakeStream([_chunk('Olá'), _chunk(', tudo'), _chunk(' bem?'), _chunk(usage=USAGE)])
+        message = SimpleNamespace(content='Olá, tudo bem?')
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=USAGE)
+
+
+class FakeOpenAIProvider(OpenAIProvider):
+    """OpenAIProvider com cliente falso (sem SDK nem rede)"""
+    
+    def __init__(self, config):
+        self.config = config
+        self.logger = logging.getLogger(__name__)
+        self._client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+    
+    @property
+    def client(self):
+        return self._client
+
+
+@pytest.fixture
+def usage_store(tmp_path):
+    db_path = str(tmp_path / 'usage.db')
+    with sqlite3.connect(db_path) as conn:
+        with open(SCHEMA_PATH, encoding='utf-8') as schema:
+            conn.executescript(schema.read())
+    store = UsageStore(db_path)
+    metrics.set_usage_recorder(store.record)
+    yield store
+    metrics.set_usage_recorder(None)
+    store.close(5)
+
+
+def _llm_provider():
+    config = {'llm_provider': 'openai', 'llm_model': 'gpt-4o-mini'}
+    llm = LLMProvider(config)
+    llm.provider = FakeOpenAIProvider(config)
+    return llm
+
+
+async def _run_turn(session_id, call):
+    timer = metrics.PipelineTimer()
+    timer.session_id = session_id
+    with metrics.track_pipeline(timer):
+        result = await call({'user_input': 'oi', 'served_by': {}})
+    return result, timer
+
+
+def _assert_persisted(store, session_id):
+    assert store.flush(5)
+    session = store.session_usage(session_id)
+    assert session is not None
+    assert session['calls'] == 1
+    assert session['prompt_tokens'] == 120
+    assert session['completion_tokens'] == 7
+    assert session['cached_tokens'] == 64
+    
+    with sqlite3.connect(store.db_path) as conn:
+        row = conn.execute(
+            "SELECT provider, model, prompt_tokens, completion_tokens, outcome FROM llm_usage_events WHERE session_id = ?",
+            (session_id,)
+        ).fetchone()
+    assert row == ('openai', 'gpt-4o-mini', 120, 7, 'ok')
+
+
+def test_streamed_call_persists_token_counts(usage_store):
+    llm = _llm_provider()
+    
+    async def stream(context):
+        return [delta async for delta in llm.stream_response(context)]
+    
+    deltas, timer = asyncio.run(_run_turn('sessao-stream', stream))
+    
+    assert ''.join(deltas) == 'Olá, tudo bem?'
+    assert timer.usage['prompt_tokens'] == 120
+    _assert_persisted(usage_store, 'sessao-stream')
+
+
+def test_generated_call_persists_token_counts(usage_store):
+    llm = _llm_provider()
+    
+    content, timer = asyncio.run(_run_turn('sessao-generate', llm.generate_response))
+    
+    assert content == 'Olá, tudo bem?'
+    assert timer.usage['completion_tokens'] == 7
+    _assert_persisted(usage_store, 'sessao-generate')